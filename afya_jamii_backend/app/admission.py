@@ -0,0 +1,234 @@
+"""Priority admission control: shed low-priority requests before they pile up.
+
+When the LLM upstream slows down, requests stay in flight longer, the
+threadpool and DB pool fill up and the event loop falls behind, which hurts
+every route equally. Each worker therefore admits requests by priority:
+
+====  ========  ================================================
+  0   triage    chat advice
+  1   vitals    vitals submission
+  2   auth      signup and login
+  3   history   history, sync, trends, usage and everything else
+  4   bulk      exports, analytics, API docs
+====  ========  ================================================
+
+``/livez``, ``/readyz``, ``/metrics`` and WebSockets are never held back.
+
+Three signals are checked when a request arrives:
+
+- Event-loop lag, measured by a task that sleeps ADMISSION_LAG_INTERVAL_MS
+  and records how late it wakes, averaged over about LAG_WINDOW_SECONDS by
+  time, so one slow callback barely moves it but a loop that keeps
+  stalling does. A priority is rejected once lag passes
+  ADMISSION_LAG_TARGET_MS times its factor in ``LAG_FACTORS``: bulk work
+  goes first, triage never goes for lag alone.
+- DB pool saturation (HEALTH_POOL_SATURATION, as in /readyz): history and
+  bulk reads are rejected while it lasts.
+- In-flight requests. Priority p may only use ``SHARES[p]`` of
+  ADMISSION_MAX_IN_FLIGHT, so the rest stays free for more important
+  work, and routes in ADMISSION_ROUTE_LIMITS are capped on their own (the
+  LLM routes, so slow LLM calls cannot take every threadpool thread).
+
+Rejections for lag and pool saturation are immediate. A request that only
+lacks capacity waits in a queue, most important first, for up to
+ADMISSION_QUEUE_TIMEOUT_MS times its factor in ``QUEUE_FACTORS`` (bulk
+work does not wait). Rejected requests get 503 with Retry-After. The limits
+are per worker.
+"""
+import asyncio
+import bisect
+import itertools
+import json
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.health import pool_usage
+from app.metrics import LOOP_LAG, record_admission
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRIAGE, VITALS, AUTH, HISTORY, BULK = range(5)
+PRIORITY_NAMES = ("triage", "vitals", "auth", "history", "bulk")
+LAG_FACTORS = (None, 8, 4, 2, 1)  # multiples of ADMISSION_LAG_TARGET_MS; None: never shed for lag
+SHARES = (1.0, 0.9, 0.8, 0.6, 0.4)  # of ADMISSION_MAX_IN_FLIGHT
+QUEUE_FACTORS = (4, 2, 2, 1, 0)  # multiples of ADMISSION_QUEUE_TIMEOUT_MS
+LAG_WINDOW_SECONDS = 1.0
+
+EXEMPT = ("/livez", "/readyz", "/metrics")
+# First matching prefix wins; the prefix is also the route ADMISSION_ROUTE_LIMITS refers to
+ROUTES: Tuple[Tuple[str, int], ...] = (
+    ("/api/v1/chat/advice", TRIAGE),
+    ("/api/v1/vitals/submit", VITALS),
+    ("/api/v1/auth/", AUTH),
+    ("/api/v1/export/", BULK),
+    ("/api/v1/analytics/", BULK),
+    ("/docs", BULK),
+    ("/redoc", BULK),
+    ("/openapi.json", BULK),
+)
+DEFAULT_ROUTE = ("", HISTORY)
+
+
+def classify(path: str) -> Optional[Tuple[str, int]]:
+    """(route prefix, priority) for a request path; None for exempt paths."""
+    if path in EXEMPT:
+        return None
+    for prefix, priority in ROUTES:
+        if path.startswith(prefix):
+            return prefix, priority
+    return DEFAULT_ROUTE
+
+
+class AdmissionController:
+    def __init__(self):
+        self.in_flight = [0] * len(PRIORITY_NAMES)
+        self.route_in_flight: Dict[str, int] = {}
+        self.lag = 0.0  # seconds
+        self.shedding: Tuple[str, ...] = ()  # priorities currently shed for lag
+        self._waiters: List[tuple] = []  # (priority, seq, route, future), best first
+        self._seq = itertools.count()
+
+    @property
+    def total(self) -> int:
+        return sum(self.in_flight)
+
+    async def run_monitor(self):
+        interval = settings.ADMISSION_LAG_INTERVAL_MS / 1000
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            elapsed = time.perf_counter() - start
+            # A late sample covers more time, so it weighs more
+            weight = 1 - math.exp(-elapsed / LAG_WINDOW_SECONDS)
+            self.lag += (max(0.0, elapsed - interval) - self.lag) * weight
+            LOOP_LAG.set(self.lag)
+            shedding = tuple(name for name, factor in zip(PRIORITY_NAMES, LAG_FACTORS)
+                             if factor is not None and self.lag * 1000 >= settings.ADMISSION_LAG_TARGET_MS * factor)
+            if shedding != self.shedding:
+                self.shedding = shedding
+                logger.warning("Event-loop lag %.0f ms; shedding: %s", self.lag * 1000, ', '.join(shedding) or 'none')
+
+    def _shed_reason(self, priority: int) -> Optional[str]:
+        factor = LAG_FACTORS[priority]
+        if factor is not None and self.lag * 1000 >= settings.ADMISSION_LAG_TARGET_MS * factor:
+            return "lag"
+        if priority >= HISTORY and pool_usage()["saturated"]:
+            return "pool"
+        return None
+
+    def _has_room(self, route: str, priority: int) -> bool:
+        if self.total >= settings.ADMISSION_MAX_IN_FLIGHT * SHARES[priority]:
+            return False
+        limit = settings.ADMISSION_ROUTE_LIMITS.get(route)
+        return limit is None or self.route_in_flight.get(route, 0) < limit
+
+    def _enter(self, route: str, priority: int):
+        self.in_flight[priority] += 1
+        self.route_in_flight[route] = self.route_in_flight.get(route, 0) + 1
+
+    async def admit(self, route: str, priority: int) -> Optional[str]:
+        """None once the request may run (call ``release`` after it), else why it was rejected."""
+        reason = self._shed_reason(priority)
+        if reason:
+            record_admission(PRIORITY_NAMES[priority], f"rejected_{reason}")
+            return reason
+        if self._has_room(route, priority):
+            self._enter(route, priority)
+            record_admission(PRIORITY_NAMES[priority], "admitted")
+            return None
+
+        timeout = settings.ADMISSION_QUEUE_TIMEOUT_MS * QUEUE_FACTORS[priority] / 1000
+        if timeout <= 0 or len(self._waiters) >= settings.ADMISSION_MAX_QUEUED:
+            record_admission(PRIORITY_NAMES[priority], "rejected_capacity")
+            return "capacity"
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._seq), route, future)
+        bisect.insort(self._waiters, waiter, key=lambda w: w[:2])
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(route, priority)  # admitted just as the client went away
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+                self._waiters.remove(waiter)
+        if future.cancelled():
+            record_admission(PRIORITY_NAMES[priority], "rejected_capacity")
+            return "capacity"
+        record_admission(PRIORITY_NAMES[priority], "queued")
+        return None
+
+    def release(self, route: str, priority: int):
+        self.in_flight[priority] -= 1
+        self.route_in_flight[route] -= 1
+        self._wake()
+
+    def _wake(self):
+        # Most important waiters first; one stuck on its route limit does not block the others
+        for waiter in list(self._waiters):
+            priority, _, route, future = waiter
+            if self._has_room(route, priority):
+                self._waiters.remove(waiter)
+                self._enter(route, priority)
+                future.set_result(True)
+
+    def retry_after(self, reason: str) -> int:
+        if reason == "lag":
+            return max(settings.ADMISSION_RETRY_AFTER_SECONDS, math.ceil(self.lag))
+        return settings.ADMISSION_RETRY_AFTER_SECONDS
+
+    def snapshot(self) -> dict:
+        return {
+            "lag_ms": round(self.lag * 1000, 2),
+            "in_flight": dict(zip(PRIORITY_NAMES, self.in_flight)),
+            "queued": len(self._waiters),
+        }
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that holds each HTTP request to ``admission`` before it reaches the app."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        route = classify(scope["path"])
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        prefix, priority = route
+        reason = await admission.admit(prefix, priority)
+        if reason:
+            await _send_busy(send, admission.retry_after(reason))
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(prefix, priority)
+
+
+async def _send_busy(send, retry_after: int):
+    body = json.dumps({"detail": "Server busy, please retry shortly."}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
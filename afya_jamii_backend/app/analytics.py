@@ -0,0 +1,223 @@
+"""Pre-aggregated risk rollups for supervisor dashboards.
+
+Each vitals submission increments one row per granularity (hour, day) keyed
+by (bucket_start, account_type, risk_label). Rows carry a count, a
+probability sum and a fixed-width probability histogram (p00..p19), which
+acts as a mergeable quantile sketch. Dashboard queries therefore read a
+few rows per bucket instead of scanning vitals_records.
+
+Rebuild from history with::
+
+    python -m app.analytics rebuild [--chunk-size 5000]
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import and_, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import SQLModel
+
+from app.auth import get_current_active_user
+from app.config import settings
+from app.database import engine
+from app.models import AccountType, RiskRollup, RiskRollupBucket, UserDB, VitalsRecord
+import logging
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day")
+PROBABILITY_BINS = 20
+BIN_COLUMNS = [f"p{i:02d}" for i in range(PROBABILITY_BINS)]  # the histogram columns of RiskRollup
+
+risk_rollups = RiskRollup.__table__
+
+# (granularity, bucket_start, account_type, risk_label)
+RollupKey = Tuple[str, datetime, str, str]
+
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def probability_bin(probability: float) -> int:
+    return min(max(int(probability * PROBABILITY_BINS), 0), PROBABILITY_BINS - 1)
+
+
+class RollupDelta:
+    """Increments for one rollup row, accumulated before hitting the database."""
+
+    __slots__ = ("count", "probability_sum", "bins")
+
+    def __init__(self):
+        self.count = 0
+        self.probability_sum = 0.0
+        self.bins: Dict[int, int] = defaultdict(int)
+
+    def add(self, probability: float):
+        self.count += 1
+        self.probability_sum += probability
+        self.bins[probability_bin(probability)] += 1
+
+
+def accumulate(deltas: Dict[RollupKey, RollupDelta], at: datetime,
+               account_type: str, risk_label: str, probability: float):
+    for granularity in GRANULARITIES:
+        key = (granularity, bucket_start(at, granularity), account_type, risk_label)
+        if key not in deltas:
+            deltas[key] = RollupDelta()
+        deltas[key].add(probability)
+
+
+def apply_deltas(conn, deltas: Dict[RollupKey, RollupDelta]):
+    """Add deltas to their rows: UPDATE, and INSERT when the row does not exist yet."""
+    c = risk_rollups.c
+    for (granularity, start, account_type, risk_label), delta in deltas.items():
+        where = and_(
+            c.granularity == granularity, c.bucket_start == start,
+            c.account_type == account_type, c.risk_label == risk_label,
+        )
+        increments = {
+            "count": c["count"] + delta.count,
+            "probability_sum": c.probability_sum + delta.probability_sum,
+            **{BIN_COLUMNS[i]: c[BIN_COLUMNS[i]] + n for i, n in delta.bins.items()},
+        }
+        if conn.execute(update(risk_rollups).where(where).values(increments)).rowcount:
+            continue
+        row = {
+            "granularity": granularity, "bucket_start": start,
+            "account_type": account_type, "risk_label": risk_label,
+            "count": delta.count, "probability_sum": delta.probability_sum,
+            **{name: delta.bins.get(i, 0) for i, name in enumerate(BIN_COLUMNS)},
+        }
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(risk_rollups).values(row))
+        except IntegrityError:
+            # Another writer created the row first
+            conn.execute(update(risk_rollups).where(where).values(increments))
+
+
+def record_submission(at: datetime, account_type: AccountType, risk_label: str, probability: float):
+    """Fold one vitals submission into the rollups (run as a background task)."""
+    deltas: Dict[RollupKey, RollupDelta] = {}
+    accumulate(deltas, at, account_type.value, risk_label, probability)
+    try:
+        with engine.begin() as conn:
+            apply_deltas(conn, deltas)
+    except Exception as e:
+        logger.error("Failed to update risk rollups: %s", e)
+
+
+def rebuild_rollups(chunk_size: Optional[int] = None) -> int:
+    """Recompute all rollups from vitals_records in keyset-paginated chunks.
+
+    Submissions arriving during a rebuild are still counted by the live path;
+    run it in a quiet period to avoid counting a racing submission twice.
+    """
+    chunk_size = chunk_size or settings.ANALYTICS_REBUILD_CHUNK_SIZE
+    with engine.begin() as conn:
+        conn.execute(delete(risk_rollups))
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(VitalsRecord.id))).scalar() or 0
+
+    v, u = VitalsRecord.__table__.c, UserDB.__table__.c
+    last_id, processed = 0, 0
+    while last_id < max_id:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(v.id, v.created_at, v.ml_risk_label, v.ml_probability, u.account_type)
+                .join_from(VitalsRecord.__table__, UserDB.__table__, v.user_id == u.id)
+                .where(v.id > last_id, v.id <= max_id)
+                .order_by(v.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            deltas: Dict[RollupKey, RollupDelta] = {}
+            for row in rows:
+                account_type = row.account_type.value if isinstance(row.account_type, AccountType) else str(row.account_type)
+                accumulate(deltas, row.created_at, account_type, row.ml_risk_label, row.ml_probability)
+            apply_deltas(conn, deltas)
+        last_id = rows[-1].id
+        processed += len(rows)
+        logger.info("Rebuilt rollups through vitals_records.id=%s (%s rows)", last_id, processed)
+    return processed
+
+
+def _quantile(bins: List[int], total: int, q: float) -> float:
+    """Quantile from the histogram, interpolating linearly within the bin."""
+    if not total:
+        return 0.0
+    target = q * total
+    seen = 0
+    for i, n in enumerate(bins):
+        if n and seen + n >= target:
+            return (i + (target - seen) / n) / PROBABILITY_BINS
+        seen += n
+    return 1.0
+
+
+def query_distribution(granularity: str, start: datetime, end: datetime,
+                       account_type: Optional[AccountType] = None) -> List[RiskRollupBucket]:
+    c = risk_rollups.c
+    conditions = [c.granularity == granularity, c.bucket_start >= start, c.bucket_start < end]
+    if account_type:
+        conditions.append(c.account_type == account_type.value)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(risk_rollups).where(and_(*conditions)).order_by(c.bucket_start, c.account_type)
+        ).all()
+
+    merged: Dict[Tuple[datetime, str], dict] = {}
+    for row in rows:
+        entry = merged.setdefault((row.bucket_start, row.account_type), {
+            "total": 0, "probability_sum": 0.0, "by_label": {}, "bins": [0] * PROBABILITY_BINS,
+        })
+        entry["total"] += row.count
+        entry["probability_sum"] += row.probability_sum
+        entry["by_label"][row.risk_label] = row.count
+        for i, name in enumerate(BIN_COLUMNS):
+            entry["bins"][i] += getattr(row, name)
+
+    return [
+        RiskRollupBucket(
+            bucket_start=start_at,
+            account_type=AccountType(account),
+            total=entry["total"],
+            by_label=entry["by_label"],
+            mean_probability=entry["probability_sum"] / entry["total"] if entry["total"] else 0.0,
+            p50_probability=_quantile(entry["bins"], entry["total"], 0.50),
+            p90_probability=_quantile(entry["bins"], entry["total"], 0.90),
+            p99_probability=_quantile(entry["bins"], entry["total"], 0.99),
+        )
+        for (start_at, account), entry in merged.items()
+    ]
+
+
+async def get_current_supervisor(current_user: UserDB = Depends(get_current_active_user)) -> UserDB:
+    if current_user.username not in settings.SUPERVISOR_USERNAMES:
+        raise HTTPException(status_code=403, detail="Supervisor access required")
+    return current_user
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Maintain the risk_rollups analytics tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="recompute rollups from vitals_records")
+    rebuild.add_argument("--chunk-size", type=int, default=settings.ANALYTICS_REBUILD_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    SQLModel.metadata.create_all(engine, tables=[risk_rollups])
+    if args.command == "rebuild":
+        count = rebuild_rollups(args.chunk_size)
+        print(f"Rebuilt risk rollups from {count} vitals records")
+
+
+if __name__ == "__main__":
+    main()
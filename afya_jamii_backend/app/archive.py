@@ -0,0 +1,163 @@
+"""Retention tiers for conversation_history.
+
+Turns older than CONVERSATION_HOT_DAYS are moved into
+``conversation_history_archive``, a user's consecutive turns packed into
+zlib-compressed blocks of up to ARCHIVE_BLOCK_TURNS. Compressing a block
+instead of single turns lets zlib reuse the phrasing shared across one
+user's advice, which is where most of the savings come from.
+``read_history`` serves the history API from both tiers, so callers never
+need to know where a turn lives; conversation exports (``app.export``) read
+both tiers too. Run from cron::
+
+    python -m app.archive run [--hot-days 90]
+    python -m app.archive report
+"""
+import argparse
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import delete, distinct, func, insert, select
+from sqlmodel import Session, SQLModel
+
+from app.config import settings
+from app.database import engine
+from app.models import ConversationArchive, ConversationHistory
+import logging
+
+logger = logging.getLogger(__name__)
+
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+}
+
+# Turn fields stored in a block, in order
+TURN_FIELDS = ("id", "vitals_record_id", "created_at", "user_message", "ai_response")
+
+
+def pack(turns, codec: str = "zlib") -> bytes:
+    compress, _ = CODECS[codec]
+    rows = [[t.id, t.vitals_record_id, t.created_at.isoformat(), t.user_message, t.ai_response] for t in turns]
+    return compress(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+
+
+def unpack(block: ConversationArchive) -> List[dict]:
+    """Turns of a block as column dicts, oldest first."""
+    _, decompress = CODECS[block.codec]
+    return [dict(zip(TURN_FIELDS, values)) for values in json.loads(decompress(block.payload))]
+
+
+def archive_user(conn, user_id: int, cutoff: datetime, block_turns: int) -> int:
+    hot = ConversationHistory.__table__
+    moved, last_id = 0, 0
+    while True:
+        rows = conn.execute(
+            select(hot).where(hot.c.user_id == user_id, hot.c.created_at < cutoff, hot.c.id > last_id)
+            .order_by(hot.c.id).limit(block_turns)
+        ).all()
+        if not rows:
+            return moved
+        conn.execute(insert(ConversationArchive.__table__).values(
+            user_id=user_id,
+            first_turn_id=rows[0].id, last_turn_id=rows[-1].id,
+            first_at=rows[0].created_at, last_at=rows[-1].created_at,
+            turns=len(rows), codec="zlib",
+            raw_size=sum(len(r.user_message.encode("utf-8")) + len(r.ai_response.encode("utf-8")) for r in rows),
+            payload=pack(rows),
+        ))
+        conn.execute(delete(hot).where(hot.c.id.in_([r.id for r in rows])))
+        last_id = rows[-1].id
+        moved += len(rows)
+
+
+def archive_conversations(hot_days: Optional[int] = None, block_turns: Optional[int] = None) -> int:
+    """Move turns older than hot_days into the archive tier; returns the number moved.
+
+    Each user is archived in one transaction, so an interrupted run leaves
+    every turn in exactly one tier and can simply be rerun.
+    """
+    hot_days = settings.CONVERSATION_HOT_DAYS if hot_days is None else hot_days
+    block_turns = block_turns or settings.ARCHIVE_BLOCK_TURNS
+    cutoff = datetime.utcnow() - timedelta(days=hot_days)
+    hot = ConversationHistory.__table__
+
+    with engine.connect() as conn:
+        user_ids = conn.execute(
+            select(distinct(hot.c.user_id)).where(hot.c.created_at < cutoff).order_by(hot.c.user_id)
+        ).scalars().all()
+
+    moved = 0
+    for user_id in user_ids:
+        with engine.begin() as conn:
+            moved += archive_user(conn, user_id, cutoff, block_turns)
+    logger.info("Archived %s conversation turns of %s users", moved, len(user_ids))
+    return moved
+
+
+def read_history(session: Session, user_id: int, limit: int) -> List[ConversationHistory]:
+    """Newest-first turns for a user, from the hot table and then the archive."""
+    turns = list(session.scalars(
+        select(ConversationHistory).where(ConversationHistory.user_id == user_id)
+        .order_by(ConversationHistory.created_at.desc()).limit(limit)
+    ))
+    if len(turns) >= limit:
+        return turns
+
+    # Archived turns are trusted rows: build only the ones returned, without validation
+    archived: List[dict] = []
+    last_id = None
+    while len(turns) + len(archived) < limit:
+        query = select(ConversationArchive).where(ConversationArchive.user_id == user_id)
+        if last_id is not None:
+            query = query.where(ConversationArchive.id < last_id)
+        block = session.scalars(query.order_by(ConversationArchive.id.desc()).limit(1)).first()
+        if block is None:
+            break
+        archived.extend(reversed(unpack(block)))
+        last_id = block.id
+    for turn in archived[:limit - len(turns)]:
+        turn["created_at"] = datetime.fromisoformat(turn["created_at"])
+        turns.append(ConversationHistory.model_construct(user_id=user_id, **turn))
+    return turns
+
+
+def storage_report() -> dict:
+    """Row counts and payload bytes per tier (text bytes for hot, blob bytes for cold)."""
+    hot, cold = ConversationHistory.__table__.c, ConversationArchive.__table__.c
+    with engine.connect() as conn:
+        hot_rows, hot_bytes = conn.execute(
+            select(func.count(), func.coalesce(func.sum(func.length(hot.user_message) + func.length(hot.ai_response)), 0))
+        ).one()
+        blocks, turns, raw_bytes, cold_bytes = conn.execute(
+            select(func.count(), func.coalesce(func.sum(cold.turns), 0), func.coalesce(func.sum(cold.raw_size), 0),
+                   func.coalesce(func.sum(func.length(cold.payload)), 0))
+        ).one()
+    return {
+        "hot": {"turns": hot_rows, "bytes": int(hot_bytes)},
+        "archive": {
+            "blocks": blocks, "turns": int(turns), "raw_bytes": int(raw_bytes), "stored_bytes": int(cold_bytes),
+            "compression_ratio": round(raw_bytes / cold_bytes, 2) if cold_bytes else None,
+        },
+    }
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Move old conversation turns to the compressed archive tier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="archive turns older than --hot-days")
+    run.add_argument("--hot-days", type=int, default=settings.CONVERSATION_HOT_DAYS)
+    run.add_argument("--block-turns", type=int, default=settings.ARCHIVE_BLOCK_TURNS)
+    sub.add_parser("report", help="print per-tier sizes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    SQLModel.metadata.create_all(engine, tables=[ConversationArchive.__table__])
+    if args.command == "run":
+        count = archive_conversations(args.hot_days, args.block_turns)
+        print(f"Archived {count} conversation turns")
+    print(json.dumps(storage_report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
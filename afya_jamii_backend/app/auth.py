@@ -7,6 +7,7 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.config import settings
 from app.models import TokenData, UserDB
 from app.database import get_session
+from app.metrics import observe_stage, record_error
 from sqlmodel import Session, select
 import logging
 
@@ -31,7 +32,7 @@ def authenticate_user(session: Session, username: str, password: str) -> Optiona
             return None
         return user
     except Exception as e:
-        logger.error(f"Authentication error for user {username}: {e}")
+        logger.error("Authentication error for user %s: %s", username, e)
         return None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -53,18 +54,20 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(credentials.credentials, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    with observe_stage("user_resolution"):
+        try:
+            payload = jwt.decode(credentials.credentials, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError as e:
+            logger.error("JWT decoding error: %s", e)
+            record_error("auth")
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError as e:
-        logger.error(f"JWT decoding error: {e}")
-        raise credentials_exception
-    
-    statement = select(UserDB).where(UserDB.username == token_data.username, UserDB.is_active == True)
-    user = session.exec(statement).first()
+
+        statement = select(UserDB).where(UserDB.username == token_data.username, UserDB.is_active == True)
+        user = session.exec(statement).first()
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,365 @@
+"""WebSocket chat with conversation state held by the server.
+
+A client authenticates once per connection and then asks any number of
+questions. The worker keeps one ``ChatSession`` per user: the most recent
+LLM_HISTORY_TURNS turns, the latest vitals record id and the risk trend
+text. A turn needs no token decoding or user lookup. Today's token usage is
+read at every turn, so tokens spent over HTTP or on other workers count
+against the daily budget.
+The latest turns come from memory; older turns relevant to the question
+come from the retrieval index (see app.retrieval), which only reads rows
+added since its last search.
+Turns and token usage are written by a per-session background writer, in
+order, after the reply has been sent.
+
+Protocol (JSON text frames)::
+
+    -> {"type": "auth", "token": "<access token>"}           first frame
+    <- {"type": "ready", "turns": 3}
+    -> {"type": "question", "question": "...", "id": "q1"}   id is optional and echoed back
+    <- {"type": "token", "id": "q1", "text": "..."}          repeated
+    <- {"type": "done", "id": "q1", "advice": "...", "timestamp": "..."}
+    <- {"type": "error", "id": "q1", "detail": "..."}        the socket stays open
+
+Sessions with no open socket are evicted after WS_SESSION_IDLE_SECONDS.
+Each worker holds at most WS_MAX_SESSIONS. Vitals submitted and questions
+asked over HTTP in the same worker update the session. Other workers catch
+up when their session is next loaded.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from jose import JWTError, jwt
+from limits import parse_many
+from pydantic import ValidationError
+from sqlmodel import Session, select
+
+from app.config import settings
+from app.database import engine
+from app.llm_budget import FULL, BudgetPlan, plan_for, record_usage, stream_budgeted_advice
+from app.llm_router import LLMReply, StreamItem
+from app.metrics import record_error
+from app.models import ConversationHistory, LLMAdviceRequest, UserDB, VitalsRecord
+from app.rate_limit import limiter, llm_user_limits
+from app.retrieval import prompt_history
+from app.trends import describe_trend, get_trend
+from app.write_behind import write_behind
+import logging
+
+logger = logging.getLogger(__name__)
+
+AUTH_FAILED = 4401  # application close codes live in 4000-4999
+TRY_AGAIN_LATER = 1013
+SWEEP_INTERVAL_SECONDS = 30.0
+_END = object()
+
+
+class ChatSession:
+    def __init__(self, user: UserDB, turns, vitals_record_id: Optional[int], trend_text: str):
+        self.user_id = user.id
+        self.username = user.username
+        self.turns: Deque[Tuple[str, str]] = deque(turns, maxlen=max(settings.LLM_HISTORY_TURNS, 1))
+        self.vitals_record_id = vitals_record_id
+        self.trend_text = trend_text
+        self.connections = 0
+        self.last_active = time.monotonic()
+        self.lock = asyncio.Lock()  # one turn at a time, across the user's sockets
+        self._writes: "asyncio.Queue[Callable[[], None]]" = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def history(self, question: str, turns: int) -> str:
+        """Prompt history; runs in a worker thread.
+
+        The recent turns come from memory. Retrieval still reads the rows
+        written since the last turn to update the index, and the hits by
+        primary key; that also picks up turns written over HTTP.
+        """
+        with Session(engine) as db:
+            return prompt_history(db, self.user_id, question, turns, recent=list(self.turns))
+
+    def prepare(self, question: str) -> Tuple[BudgetPlan, str]:
+        """The budget plan from today's recorded usage, and the prompt history; runs in a worker thread."""
+        plan = plan_for(self.user_id)
+        return plan, self.history(question, plan.history_turns)
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append((question, answer))
+        self.last_active = time.monotonic()
+
+    def persist(self, write: Callable[[], None]):
+        self._writes.put_nowait(write)
+
+    async def flush(self):
+        """Wait until the writes queued so far, usage included, are done."""
+        await self._writes.join()
+
+    async def _write_loop(self):
+        while True:
+            write = await self._writes.get()
+            try:
+                await run_in_threadpool(write)
+            except Exception:
+                logger.exception("Chat session write failed for user %s", self.user_id)
+                record_error("chat_ws_persist")
+            finally:
+                self._writes.task_done()
+
+    async def close(self):
+        await self._writes.join()
+        self._writer.cancel()
+
+
+def _load_session_state(user: UserDB) -> tuple:
+    with Session(engine) as session:
+        records = session.exec(
+            select(ConversationHistory)
+            .where(ConversationHistory.user_id == user.id)
+            .order_by(ConversationHistory.created_at.desc())
+            .limit(settings.LLM_HISTORY_TURNS)
+        ).all()
+        latest_vitals_id = session.exec(
+            select(VitalsRecord.id).where(VitalsRecord.user_id == user.id)
+            .order_by(VitalsRecord.created_at.desc()).limit(1)
+        ).first()
+        trend_text = describe_trend(get_trend(session, user.id))
+    turns = [(r.user_message, r.ai_response) for r in reversed(records)]
+    return turns, latest_vitals_id, trend_text
+
+
+class ChatSessionRegistry:
+    def __init__(self):
+        self._sessions: "OrderedDict[int, ChatSession]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    async def open(self, user: UserDB) -> Optional[ChatSession]:
+        """The user's session, loaded on first use; None when the worker is full."""
+        session = self._sessions.get(user.id)
+        if session is None:
+            loading = self._loading.get(user.id)
+            if loading is not None:
+                await asyncio.shield(loading)
+                return await self.open(user)
+            if len(self._sessions) >= settings.WS_MAX_SESSIONS and not await self._evict_one():
+                return None
+            loading = self._loading[user.id] = asyncio.get_running_loop().create_future()
+            try:
+                state = await run_in_threadpool(_load_session_state, user)
+                session = self._sessions[user.id] = ChatSession(user, *state)
+            finally:
+                loading.set_result(None)
+                del self._loading[user.id]
+        self._sessions.move_to_end(user.id)
+        session.connections += 1
+        session.last_active = time.monotonic()
+        return session
+
+    def release(self, session: ChatSession):
+        session.connections -= 1
+        session.last_active = time.monotonic()
+
+    async def _evict_one(self) -> bool:
+        for user_id, session in self._sessions.items():  # least recently opened first
+            if session.connections == 0:
+                del self._sessions[user_id]
+                await session.close()
+                return True
+        return False
+
+    async def sweep(self):
+        cutoff = time.monotonic() - settings.WS_SESSION_IDLE_SECONDS
+        idle = [uid for uid, s in self._sessions.items() if s.connections == 0 and s.last_active < cutoff]
+        for user_id in idle:
+            await self._sessions.pop(user_id).close()
+        if idle:
+            logger.info("Evicted %s idle chat sessions (%s left)", len(idle), len(self._sessions))
+
+    async def run_sweeper(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Chat session sweep failed")
+
+    async def close_all(self):
+        while self._sessions:
+            await self._sessions.popitem()[1].close()
+
+    # ---- updates from the HTTP endpoints of this worker ----
+    def note_vitals(self, user_id: int, vitals_record_id: int, trend_text: str):
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.vitals_record_id = vitals_record_id
+            session.trend_text = trend_text
+
+    def note_turn(self, user_id: int, question: str, answer: str):
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.add_turn(question, answer)
+
+
+chat_sessions = ChatSessionRegistry()
+
+
+def _authenticate(token: str) -> Optional[UserDB]:
+    try:
+        username = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+    if not username:
+        return None
+    with Session(engine) as session:
+        return session.exec(
+            select(UserDB).where(UserDB.username == username, UserDB.is_active == True)
+        ).first()
+
+
+def _allow_turn(username: str) -> bool:
+    """Count the turn against the same per-user llm limits as the HTTP endpoints; runs in a worker thread."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return True
+    return all(
+        limiter.limiter.hit(item, f"user:{username}", "llm") for item in parse_many(llm_user_limits)
+    )
+
+
+async def _iterate_in_thread(make_iterator: Callable[[], Iterator[StreamItem]]) -> AsyncIterator[StreamItem]:
+    """Run a blocking iterator in the threadpool and yield its items on the event loop."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for item in make_iterator():
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _END)
+
+    producer = asyncio.ensure_future(run_in_threadpool(produce))
+    while True:
+        item = await queue.get()
+        if item is _END:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+    await producer
+
+
+def _persist_turn(session: ChatSession, vitals_record_id: Optional[int], question: str,
+                  reply: LLMReply, degraded: bool) -> Callable[[], None]:
+    user_id = session.user_id
+
+    def write():
+        write_behind.save_sync(ConversationHistory(
+            user_id=user_id, vitals_record_id=vitals_record_id,
+            user_message=question, ai_response=reply.text,
+        ))
+        record_usage(user_id, reply.prompt_tokens, reply.completion_tokens, degraded)
+
+    return write
+
+
+async def _answer(websocket: WebSocket, session: ChatSession, question: str, request_id) -> bool:
+    """Stream one reply; False once the client has gone away."""
+    # The previous turn's usage must be recorded before the budget is read
+    await session.flush()
+    plan, history = await run_in_threadpool(session.prepare, question)
+    prompt_data = {
+        "context": f"The user is asking a follow-up question.\nRecent Trend: {session.trend_text}",
+        "history": history,
+        "question": question,
+    }
+    connected = True
+    reply = None
+    try:
+        async for item in _iterate_in_thread(lambda: stream_budgeted_advice(prompt_data, plan)):
+            if isinstance(item, LLMReply):
+                reply = item
+            elif connected:
+                try:
+                    await websocket.send_json({"type": "token", "id": request_id, "text": item})
+                except (WebSocketDisconnect, RuntimeError):
+                    connected = False  # keep going: the reply is paid for and still gets stored
+    except Exception:
+        logger.exception("WebSocket chat generation failed")
+        record_error("llm")
+        reply = None
+    if reply is None:
+        reply = LLMReply("LLM currently unavailable; please consult a clinician.")
+
+    degraded = plan.mode != FULL or reply.backend == "templated"
+    session.add_turn(question, reply.text)
+    session.persist(_persist_turn(session, session.vitals_record_id, question, reply, degraded))
+    if connected:
+        await websocket.send_json({
+            "type": "done", "id": request_id, "advice": reply.text,
+            "timestamp": datetime.utcnow().isoformat(), "budget_mode": plan.mode,
+        })
+    return connected
+
+
+async def chat_websocket(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        frame = await asyncio.wait_for(websocket.receive_json(), timeout=settings.WS_AUTH_TIMEOUT_SECONDS)
+    except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        await websocket.close(code=AUTH_FAILED)
+        return
+    user = None
+    if isinstance(frame, dict) and frame.get("type") == "auth" and isinstance(frame.get("token"), str):
+        user = await run_in_threadpool(_authenticate, frame["token"])
+    if user is None:
+        record_error("auth")
+        await websocket.close(code=AUTH_FAILED, reason="Could not validate credentials")
+        return
+
+    try:
+        session = await chat_sessions.open(user)
+    except Exception:
+        logger.exception("Could not load chat session for user %s", user.id)
+        record_error("chat_ws_load")
+        await websocket.close(code=TRY_AGAIN_LATER, reason="Could not load chat session, try again later")
+        return
+    if session is None:
+        await websocket.close(code=TRY_AGAIN_LATER, reason="Too many chat sessions, try again later")
+        return
+    try:
+        await websocket.send_json({"type": "ready", "turns": len(session.turns)})
+        while True:
+            try:
+                frame = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_json({"type": "error", "id": None, "detail": "Frames must be JSON"})
+                continue
+            if not isinstance(frame, dict):
+                frame = {}
+            request_id = frame.get("id")
+            try:
+                if frame.get("type") != "question":
+                    raise ValueError("Expected a question frame")
+                question = LLMAdviceRequest(question=frame.get("question")).question
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "id": request_id, "detail": e.errors()[0]["msg"]})
+                continue
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "id": request_id, "detail": str(e)})
+                continue
+            if not await run_in_threadpool(_allow_turn, session.username):
+                record_error("rate_limit")
+                await websocket.send_json({"type": "error", "id": request_id, "detail": "Rate limit exceeded"})
+                continue
+            async with session.lock:
+                if not await _answer(websocket, session, question, request_id):
+                    break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        chat_sessions.release(session)
@@ -41,16 +41,114 @@ class Settings(BaseSettings):
 
     # ML Model
     MODEL_PATH: str = "./data/risk_model_v1.pkl"
+    # Out-of-process inference (see app.inference_server); unset scores inside each API worker
+    INFERENCE_SOCKET: Optional[str] = None  # e.g. /run/afya/inference.sock
+    INFERENCE_WORKERS: int = 1  # inference server processes
+    INFERENCE_BATCH_ROWS: int = 256
+    INFERENCE_CONNECTIONS: int = 8  # per API worker
+    INFERENCE_TIMEOUT_SECONDS: float = 2.0
 
     # Groq LLM
     GROQ_API_KEY: str
+    GROQ_API_BASE: Optional[str] = None  # override for proxies or the benchmark stub
     LLM_MODEL_NAME: str = "meta-llama/llama-4-scout-17b-16e-instruct"
     LLM_TEMPERATURE: float = 0.0
+    LLM_MAX_TOKENS: int = 1024
+    LLM_HISTORY_TURNS: int = 20  # most recent conversation turns sent with a chat question
+    # Per-user daily token budget; replies shrink past the thresholds and are templated at 100%
+    LLM_DAILY_TOKEN_BUDGET: int = 60000
+    LLM_BUDGET_REDUCED_AT: float = 0.7
+    LLM_BUDGET_MINIMAL_AT: float = 0.9
+    # Upstream Groq quota shared by all workers (0 disables); counted in RATE_LIMIT_STORAGE_URI
+    LLM_UPSTREAM_RPM: int = 30
+    LLM_UPSTREAM_TPM: int = 60000
+    # Backend routing: fastest healthy backend first, optionally hedged after its p95, rules engine last
+    LLM_FALLBACK_MODEL_NAME: Optional[str] = None  # second Groq model, e.g. "llama-3.1-8b-instant"
+    LLM_LOCAL_BASE_URL: Optional[str] = None  # OpenAI-compatible local server, e.g. llama.cpp on :8080
+    LLM_LOCAL_MODEL_NAME: str = "local"
+    LLM_TIMEOUT_SECONDS: float = 30.0  # per backend request
+    LLM_ROUTE_DEADLINE_SECONDS: float = 75.0  # whole routed call, failovers and executor queueing included
+    LLM_ROUTER_THREADS: int = 0  # per worker; 0: the admitted chat/submit requests times (1 + LLM_HEDGE_MAX)
+    LLM_HEDGE_MIN_SECONDS: float = 2.0
+    LLM_HEDGE_MAX: int = 0  # extra requests to other backends per call; opt-in, each costs upstream quota
+    LLM_ROUTER_WINDOW: int = 100
+    LLM_ROUTER_MAX_FAILURES: int = 3
+    LLM_ROUTER_MAX_ERROR_RATE: float = 0.5
+    LLM_ROUTER_COOLDOWN_SECONDS: float = 30.0
+
+    # Chat prompt history: latest turns plus the best BM25 matches among older ones (see app.retrieval)
+    RETRIEVAL_ENABLED: bool = True
+    RETRIEVAL_RECENT_TURNS: int = 2
+    RETRIEVAL_TOP_K: int = 4  # older turns and patient notes added per question
+    RETRIEVAL_MAX_DOCS: int = 500  # per user, newest kept
+    RETRIEVAL_MAX_USERS: int = 256  # user indexes kept per worker
+
+    # Write-behind group commit for conversation turns: off | group | async (see app.write_behind)
+    WRITE_BEHIND_MODE: str = "off"
+    WRITE_BEHIND_FLUSH_MS: float = 5.0
+    WRITE_BEHIND_BATCH_ROWS: int = 200
+    WRITE_BEHIND_MAX_ROWS: int = 10000  # queued rows before callers write their own
+
+    # Health probes behind /livez and /readyz (see app.health)
+    HEALTH_PROBE_INTERVAL_SECONDS: float = 5.0
+    HEALTH_DEEP_PROBE_SECONDS: float = 60.0
+    HEALTH_POOL_SATURATION: float = 0.9  # not ready from this share of connections checked out
+    HEALTH_READY_REQUIRES_LLM: bool = False
+    INTERNAL_TOKEN: Optional[str] = None  # X-Internal-Token for /metrics and /health/details; unset: loopback only
+
+    # Admission control: shed low-priority requests under overload (see app.admission)
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_LAG_INTERVAL_MS: float = 20.0
+    ADMISSION_LAG_TARGET_MS: float = 50.0  # event-loop lag at which bulk work is shed; other priorities at multiples
+    ADMISSION_MAX_IN_FLIGHT: int = 64  # per worker, all priorities together
+    ADMISSION_ROUTE_LIMITS: dict[str, int] = {  # per worker; keys are app.admission.ROUTES prefixes
+        "/api/v1/chat/advice": 8,
+        "/api/v1/vitals/submit": 8,
+        "/api/v1/export/": 2,
+    }
+    ADMISSION_QUEUE_TIMEOUT_MS: float = 500.0  # longest wait for capacity, scaled up for higher priorities
+    ADMISSION_MAX_QUEUED: int = 500
+    ADMISSION_RETRY_AFTER_SECONDS: int = 2
+
+    # WebSocket chat
+    WS_AUTH_TIMEOUT_SECONDS: float = 10.0
+    WS_SESSION_IDLE_SECONDS: float = 900.0
+    WS_MAX_SESSIONS: int = 1000  # per worker
+
+    # Risk trends
+    TREND_HALF_LIFE_DAYS: float = 14.0
+    TREND_TRAJECTORY_POINTS: int = 10
+
+    # Population analytics
+    SUPERVISOR_USERNAMES: list[str] = []
+    ANALYTICS_REBUILD_CHUNK_SIZE: int = 5000
+
+    # Research exports
+    EXPORT_CHUNK_SIZE: int = 5000
+    EXPORT_HASH_KEY: Optional[str] = None  # defaults to SECRET_KEY
+
+    # Conversation retention
+    CONVERSATION_HOT_DAYS: int = 90
+    ARCHIVE_BLOCK_TURNS: int = 50
+
+    # Idempotency-Key handling on submit/chat
+    IDEMPOTENCY_TTL_HOURS: int = 24
+    IDEMPOTENCY_CACHE_SIZE: int = 2048  # in-process front cache entries
+    IDEMPOTENCY_WAIT_SECONDS: float = 60.0  # how long a duplicate waits for the first attempt
+    # A claim not refreshed for this long is taken as abandoned; the running attempt refreshes it every third of it
+    IDEMPOTENCY_LEASE_SECONDS: float = 120.0
 
     # App Environment
     ENVIRONMENT: str = "production"
     DEBUG: bool = True
     LOG_LEVEL: str = DEBUG
+    LOG_FORMAT: str = "json"  # json | text
+    LOG_ASYNC: bool = True  # format and write on a background thread (see app.log_pipeline)
+    LOG_QUEUE_SIZE: int = 10000  # records waiting to be written before new ones are dropped
+    LOG_INFO_SAMPLE_RATE: float = 1.0  # share of INFO and lower records kept
+
+    # Response compression (gzip) for bodies of at least this many bytes
+    GZIP_MINIMUM_SIZE: int = 1000
 
     # CORS
     CORS_ORIGINS: list[str] = [
@@ -61,13 +159,33 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     RELOAD: bool = True
+    # python -m app.serve (see app.serve)
+    SERVER_WORKERS: int = 0  # 0: one per available CPU
+    DB_CONNECTION_BUDGET: int = 100  # DB connections all workers on this host share; sets the per-worker pools
+    SERVER_DRAIN_SECONDS: float = 0.0  # after SIGTERM, keep serving with /readyz failing this long
+    SERVER_GRACEFUL_TIMEOUT: float = 60.0  # then wait this long for in-flight requests
+    SERVER_MAX_REQUESTS: int = 10000  # recycle a worker after this many requests; 0 disables
+    SERVER_MAX_REQUESTS_JITTER: int = 1000
+    SERVER_MAX_RSS_MB: int = 1536  # recycle a worker above this resident memory; 0 disables
+    SERVER_KEEPALIVE: int = 5
 
     # Security Headers
     CSP_DIRECTIVES: str = "default-src 'self'; script-src 'self' 'unsafe-inline'"
 
     # Rate Limiting
+    RATE_LIMIT_ENABLED: bool = True
     RATE_LIMIT_PER_MINUTE: int = 60
-    MAX_REQUESTS_PER_USER: int = 1000
+    MAX_REQUESTS_PER_USER: int = 1000  # per user per day on LLM endpoints
+    LLM_RATE_LIMIT_PER_MINUTE: int = 10
+    # Counters shared by all workers on this host; use redis://host:6379 for multi-host
+    RATE_LIMIT_STORAGE_URI: str = "sqlite:////tmp/afya_jamii_ratelimit.db"
+
+    # Profiling (sampled per-request stack profiles)
+    PROFILING_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.01
+    PROFILING_INTERVAL_MS: float = 2.0
+    PROFILING_OUTPUT_DIR: str = "/tmp/afya_jamii_profiles"
+    PROFILING_ADMIN_TOKEN: Optional[str] = None  # enables the X-Profile-Token header
 
     # --- Validators ---
     @field_validator("SECRET_KEY", mode="before")
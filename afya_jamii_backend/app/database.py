@@ -3,7 +3,7 @@ import logging
 from contextlib import contextmanager
 from sqlmodel import SQLModel, create_engine, Session
 from sqlalchemy.pool import QueuePool
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 
 # Load settings
 from app.config import settings
@@ -14,13 +14,20 @@ from app.config import settings
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# Debug DB URL/port
-print(f"Effective DATABASE_URL: {settings.DATABASE_URL}")
-print(f"Effective DATABASE_PORT: {settings.DATABASE_PORT}")
-
 # ───────────────────────────
 # ENGINE (MySQL + pooling)
 # ───────────────────────────
+IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+
+# SQLite is supported for local benchmarks and development only
+if IS_SQLITE:
+    connect_args = {"check_same_thread": False}
+else:
+    connect_args = {
+        "charset": "utf8mb4",
+        "autocommit": False,  # let SQLAlchemy manage transactions
+    }
+
 engine = create_engine(
     settings.DATABASE_URL,
     poolclass=QueuePool,
@@ -28,10 +35,7 @@ engine = create_engine(
     max_overflow=settings.DB_MAX_OVERFLOW,
     pool_recycle=settings.DB_POOL_RECYCLE,
     echo=settings.DB_ECHO,
-    connect_args={
-        "charset": "utf8mb4",
-        "autocommit": False,  # let SQLAlchemy manage transactions
-    },
+    connect_args=connect_args,
 )
 
 # ───────────────────────────
@@ -43,9 +47,32 @@ def create_db_and_tables():
         SQLModel.metadata.create_all(engine)
         logger.info("Database tables created successfully.")
     except Exception as e:
-        logger.error(f"Error creating database tables: {e}")
+        logger.error("Error creating database tables: %s", e)
         raise
 
+    # Add columns and indexes introduced after a table was first created (create_all skips existing tables)
+    try:
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table, column in [
+                ("vitals_records", "ml_feature_schema"),
+                ("vitals_records", "ml_importances"),
+                ("vitals_records", "change_seq"),
+                ("conversation_history", "change_seq"),
+            ]:
+                if column not in {c["name"] for c in inspector.get_columns(table)}:
+                    column_type = SQLModel.metadata.tables[table].c[column].type.compile(engine.dialect)
+                    logger.info("Adding column %s.%s", table, column)
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type} NULL"))
+            for table in ["vitals_records", "conversation_history"]:
+                existing = {i["name"] for i in inspector.get_indexes(table)}
+                for index in SQLModel.metadata.tables[table].indexes:
+                    if index.name not in existing:
+                        logger.info("Creating index %s", index.name)
+                        index.create(conn)
+    except Exception as e:
+        logger.warning("Could not add new columns: %s", e)
+
     # Ensure large text columns are LONGTEXT (MySQL)
     try:
         if settings.DATABASE_URL.startswith("mysql"):
@@ -54,11 +81,11 @@ def create_db_and_tables():
                     ("conversation_history", "ai_response"),
                     ("vitals_records", "ml_feature_importances"),
                 ]:
-                    logger.info(f"Ensuring {table}.{column} is LONGTEXT")
+                    logger.info("Ensuring %s.%s is LONGTEXT", table, column)
                     conn.execute(text(f"ALTER TABLE {table} MODIFY {column} LONGTEXT"))
                 conn.commit()
     except Exception as e:
-        logger.warning(f"Could not alter columns to LONGTEXT: {e}")
+        logger.warning("Could not alter columns to LONGTEXT: %s", e)
 
 # ───────────────────────────
 # SESSION HANDLERS
@@ -70,7 +97,7 @@ def get_session():
             yield session
         except Exception as e:
             session.rollback()
-            logger.error(f"Database session error: {e}")
+            logger.error("Database session error: %s", e)
             raise
         finally:
             session.close()
@@ -84,7 +111,7 @@ def get_db_session():
         session.commit()
     except Exception as e:
         session.rollback()
-        logger.error(f"Database transaction error: {e}")
+        logger.error("Database transaction error: %s", e)
         raise
     finally:
         session.close()
@@ -100,7 +127,7 @@ def test_database_connection() -> bool:
         logger.info("Database connection test successful.")
         return True
     except Exception as e:
-        logger.error(f"Database connection test failed: {e}")
+        logger.error("Database connection test failed: %s", e)
         return False
 
 def get_database_stats():
@@ -118,7 +145,7 @@ def get_database_stats():
                 "active_processes": len(processes),
             }
     except Exception as e:
-        logger.error(f"Error getting database stats: {e}")
+        logger.error("Error getting database stats: %s", e)
         return {}
 
 def check_database_health():
@@ -158,7 +185,7 @@ def check_database_health():
                 status["status"] = "degraded"
 
     except Exception as e:
-        logger.error(f"Database health check failed: {e}")
+        logger.error("Database health check failed: %s", e)
         status["status"] = "unhealthy"
         status["error"] = str(e)
 
@@ -171,29 +198,32 @@ def optimize_database():
     """Run OPTIMIZE TABLE on key tables (MySQL equivalent of VACUUM)."""
     try:
         with Session(engine) as session:
-            for table in ["users", "vitals_records", "conversation_history"]:
+            for table in ["users", "vitals_records", "conversation_history", "conversation_history_archive"]:
                 session.execute(text(f"OPTIMIZE TABLE {table}"))
             session.commit()
         logger.info("Database optimization completed successfully.")
         return True
     except Exception as e:
-        logger.error(f"Database optimization failed: {e}")
+        logger.error("Database optimization failed: %s", e)
         return False
 
 def backup_database(backup_path: str = "/backups"):
     """Placeholder for DB backup logic."""
     try:
-        logger.info(f"Database backup initiated to {backup_path}")
+        logger.info("Database backup initiated to %s", backup_path)
         # implement mysqldump or your backup method here
         return True
     except Exception as e:
-        logger.error(f"Database backup failed: {e}")
+        logger.error("Database backup failed: %s", e)
         return False
 
 # ───────────────────────────
 # OPTIONAL: ASYNC SUPPORT
 # ───────────────────────────
 try:
+    if IS_SQLITE:
+        raise ImportError("async sessions require the MySQL aiomysql driver")
+
     from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
     from sqlalchemy.orm import sessionmaker
 
@@ -215,7 +245,7 @@ try:
                 yield session
             except Exception as e:
                 await session.rollback()
-                logger.error(f"Async database session error: {e}")
+                logger.error("Async database session error: %s", e)
                 raise
             finally:
                 await session.close()
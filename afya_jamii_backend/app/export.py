@@ -0,0 +1,287 @@
+"""De-identified streaming exports of vitals_records and conversation_history.
+
+Rows are read by keyset pagination (``id > last id ... LIMIT chunk
+size``) and encoded chunk by chunk (CSV text or one Parquet row group per
+chunk), so memory use does not depend on the size of the export. User ids
+are replaced by a keyed hash, usernames/emails are never joined in, and
+free text (``patient_history``, and the question and answer of each
+conversation turn) is left out, since it can name people and places.
+Conversation exports therefore carry turn metadata only. They include the
+turns ``app.archive`` has moved to the compressed archive tier, read block
+by block, ahead of the turns still in conversation_history.
+
+    python -m app.export vitals --format parquet --start 2025-01-01 -o vitals.parquet
+"""
+import argparse
+import csv
+import hashlib
+import hmac
+import io
+import json
+import sys
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Float, Integer, select
+
+from app.config import settings
+from app.database import engine
+from app.archive import unpack
+from app.importances import unpack_importances
+from app.models import AccountType, ConversationArchive, ConversationHistory, UserDB, VitalsRecord
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+_v = VitalsRecord.__table__.c
+_c = ConversationHistory.__table__.c
+_u = UserDB.__table__.c
+_a = ConversationArchive.__table__.c
+
+# Exported columns per dataset; "user_id" is replaced by its hash
+DATASETS: Dict[str, dict] = {
+    "vitals": {
+        "table": VitalsRecord.__table__,
+        "columns": [
+            _v.id, _v.user_id, _u.account_type, _v.created_at, _v.age, _v.systolic_bp,
+            _v.diastolic_bp, _v.bs, _v.body_temp, _v.body_temp_unit, _v.heart_rate,
+            _v.ml_risk_label, _v.ml_probability, _v.ml_feature_importances,
+            _v.ml_feature_schema, _v.ml_importances,
+        ],
+    },
+    "conversations": {
+        "table": ConversationHistory.__table__,
+        "columns": [
+            _c.id, _c.user_id, _u.account_type, _c.created_at, _c.vitals_record_id,
+        ],
+    },
+}
+
+
+# Packed importances, folded into ml_feature_importances as JSON
+PACKED_COLUMNS = ("ml_feature_schema", "ml_importances")
+
+
+def output_columns(dataset: str) -> List[Tuple[str, Column]]:
+    """(field name, source column) of each exported field, in output order."""
+    return [
+        ("user_hash" if col.name == "user_id" else col.name, col)
+        for col in DATASETS[dataset]["columns"] if col.name not in PACKED_COLUMNS
+    ]
+
+
+def arrow_schema(dataset: str):
+    """Parquet schema from the table columns, so a chunk of all-NULL values cannot narrow a type."""
+    import pyarrow as pa
+
+    def arrow_type(name: str, col: Column):
+        if name == "user_hash":
+            return pa.string()
+        if isinstance(col.type, Integer):
+            return pa.int64()
+        if isinstance(col.type, Float):
+            return pa.float64()
+        if isinstance(col.type, DateTime):
+            return pa.timestamp("us")
+        return pa.string()  # text, enums and the importances JSON
+
+    return pa.schema([(name, arrow_type(name, col)) for name, col in output_columns(dataset)])
+
+
+def hash_user_id(user_id: int) -> str:
+    """Stable pseudonym for a user id; needs EXPORT_HASH_KEY to be reproduced."""
+    key = (settings.EXPORT_HASH_KEY or settings.SECRET_KEY).encode()
+    return hmac.new(key, str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def _deidentify(record: dict) -> dict:
+    record["user_hash"] = hash_user_id(record["user_hash"])
+    if isinstance(record["account_type"], AccountType):
+        record["account_type"] = record["account_type"].value
+    return record
+
+
+def iter_archived_turns(start: Optional[datetime], end: Optional[datetime],
+                        account_type: Optional[AccountType], chunk_size: int) -> Iterator[List[dict]]:
+    """Conversation rows from archive blocks, in block order, with the same filters as the hot table."""
+    archive = ConversationArchive.__table__
+    conditions = []
+    if start:
+        conditions.append(_a.last_at >= start)
+    if end:
+        conditions.append(_a.first_at < end)
+    if account_type:
+        conditions.append(_u.account_type == account_type)
+
+    blocks_per_query = max(chunk_size // settings.ARCHIVE_BLOCK_TURNS, 1)
+    chunk: List[dict] = []
+    last_id = 0
+    while True:
+        query = (
+            select(_a.id, _a.user_id, _a.codec, _a.payload, _u.account_type)
+            .join_from(archive, UserDB.__table__, _a.user_id == _u.id)
+            .where(_a.id > last_id, *conditions)
+            .order_by(_a.id)
+            .limit(blocks_per_query)
+        )
+        with engine.connect() as conn:
+            blocks = conn.execute(query).all()
+        if not blocks:
+            break
+        for block in blocks:
+            for turn in unpack(block):
+                created_at = datetime.fromisoformat(turn["created_at"])
+                # A block can straddle the range ends
+                if (start and created_at < start) or (end and created_at >= end):
+                    continue
+                chunk.append(_deidentify({
+                    "id": turn["id"], "user_hash": block.user_id, "account_type": block.account_type,
+                    "created_at": created_at, "vitals_record_id": turn["vitals_record_id"],
+                }))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        last_id = blocks[-1].id
+    if chunk:
+        yield chunk
+
+
+def iter_chunks(dataset: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                account_type: Optional[AccountType] = None,
+                chunk_size: Optional[int] = None) -> Iterator[List[dict]]:
+    """Yield de-identified rows as lists of dicts, about chunk_size at a time.
+
+    Rows come in id order; for conversations, archived turns come first.
+    """
+    spec = DATASETS[dataset]
+    table = spec["table"]
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    if dataset == "conversations":
+        yield from iter_archived_turns(start, end, account_type, chunk_size)
+    names = ["user_hash" if col.name == "user_id" else col.name for col in spec["columns"]]
+
+    conditions = []
+    if start:
+        conditions.append(table.c.created_at >= start)
+    if end:
+        conditions.append(table.c.created_at < end)
+    if account_type:
+        conditions.append(_u.account_type == account_type)
+
+    last_id = 0
+    while True:
+        query = (
+            select(*spec["columns"])
+            .join_from(table, UserDB.__table__, table.c.user_id == _u.id)
+            .where(table.c.id > last_id, *conditions)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+        )
+        with engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        if not rows:
+            return
+        chunk = []
+        for row in rows:
+            record = _deidentify(dict(zip(names, row)))
+            if "ml_importances" in record:
+                importances = unpack_importances(
+                    record.pop("ml_feature_schema"), record.pop("ml_importances"), record["ml_feature_importances"]
+                )
+                record["ml_feature_importances"] = json.dumps(importances) if importances else None
+            chunk.append(record)
+        yield chunk
+        last_id = rows[-1][0]
+
+
+def stream_csv(dataset: str, chunks: Iterator[List[dict]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=[name for name, _ in output_columns(dataset)])
+    # The header goes out even when nothing matches
+    writer.writeheader()
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to the generator."""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def stream_parquet(dataset: str, chunks: Iterator[List[dict]]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(dataset)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for chunk in chunks:
+        writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS: Dict[str, Callable[[str, Iterator[List[dict]]], Iterator[bytes]]] = {
+    "csv": stream_csv,
+    "parquet": stream_parquet,
+}
+
+
+def export_stream(dataset: str, fmt: str, **filters) -> Iterator[bytes]:
+    return ENCODERS[fmt](dataset, iter_chunks(dataset, **filters))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--start", type=datetime.fromisoformat)
+    parser.add_argument("--end", type=datetime.fromisoformat)
+    parser.add_argument("--account-type", type=AccountType, choices=list(AccountType))
+    parser.add_argument("--chunk-size", type=int, default=settings.EXPORT_CHUNK_SIZE)
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for data in export_stream(args.dataset, args.format, start=args.start, end=args.end,
+                                  account_type=args.account_type, chunk_size=args.chunk_size):
+            out.write(data)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
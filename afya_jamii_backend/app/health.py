@@ -0,0 +1,197 @@
+"""Background health probes behind cheap liveness and readiness endpoints.
+
+A task on the event loop probes the database (``SELECT 1``), the risk model
+(or the inference server, see app.inference_server)
+and the LLM router every HEALTH_PROBE_INTERVAL_SECONDS and caches the
+result. The expensive ``check_database_health`` runs at most every
+HEALTH_DEEP_PROBE_SECONDS, and only on MySQL. ``/livez`` and ``/readyz``
+never touch the database.
+
+A worker is ready when its last probe is fresh, the database answered,
+the model is loaded and fewer than HEALTH_POOL_SATURATION of its
+connections are checked out. With HEALTH_READY_REQUIRES_LLM it also needs
+a remote LLM backend whose circuit is closed. That is off by default,
+because every worker shares the same upstream and draining them all would
+not help. The load balancer can then move traffic off a saturated worker
+without waiting for requests to fail. A worker that is shutting down
+(see app.serve) reports ``draining`` and is never ready.
+
+Both endpoints are answered by ``ProbeMiddleware``, outside every other
+middleware, so a probe skips host checks, security headers, admission and
+the access log.
+
+The public ``/health`` only reports whether each service is up. The probe
+details (database status, LLM backends, admission state) are served on
+``/health/details``. It and ``/metrics`` sit behind ``require_internal``:
+the X-Internal-Token header when INTERNAL_TOKEN is set, otherwise loopback
+clients only.
+"""
+import asyncio
+import json
+import secrets
+import time
+from typing import Optional
+
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import check_database_health, engine
+from app.llm_groq import afya_llm
+from app.inference_server import inference_client
+from app.ml_model import risk_model
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _probe_database() -> dict:
+    start = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+    except Exception as e:
+        logger.warning("Database probe failed: %s", e)
+        return {"ok": False, "error": str(e)[:200]}
+
+
+def _probe_llm() -> dict:
+    router = afya_llm.router
+    if router is None:
+        return {"ok": False, "backends": {}}
+    backends = router.snapshot()
+    return {"ok": any(b["healthy"] for b in backends.values()), "backends": backends}
+
+
+def pool_usage() -> dict:
+    capacity = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    try:
+        checked_out = engine.pool.checkedout()
+    except AttributeError:
+        # Non-queue pools (e.g. SQLite's SingletonThreadPool) expose no counters
+        checked_out = 0
+    return {
+        "checked_out": checked_out,
+        "capacity": capacity,
+        "saturated": capacity > 0 and checked_out >= capacity * settings.HEALTH_POOL_SATURATION,
+    }
+
+
+class HealthProber:
+    def __init__(self):
+        self.checked_at: Optional[float] = None
+        self.database: dict = {"ok": False}
+        self.database_details: Optional[dict] = None
+        self.model: dict = {"ok": False}
+        self.llm: dict = {"ok": False, "backends": {}}
+        self.draining = False  # set on SIGTERM by app.serve; not ready from then on
+        self._deep_at = 0.0
+
+    def fresh(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self.checked_at is not None and now - self.checked_at <= 3 * settings.HEALTH_PROBE_INTERVAL_SECONDS
+
+    async def probe(self):
+        self.database = await run_in_threadpool(_probe_database)
+        now = time.monotonic()
+        if engine.dialect.name == "mysql" and now - self._deep_at >= settings.HEALTH_DEEP_PROBE_SECONDS:
+            self._deep_at = now
+            self.database_details = await run_in_threadpool(check_database_health)
+        if inference_client.enabled:
+            self.model = {"ok": await inference_client.ping(), "inference_server": inference_client.socket_path}
+        else:
+            self.model = {"ok": bool(risk_model.model_loaded)}
+        self.llm = _probe_llm()
+        self.checked_at = time.monotonic()
+
+    async def run(self):
+        while True:
+            try:
+                await self.probe()
+            except Exception:
+                logger.exception("Health probe failed")
+            await asyncio.sleep(settings.HEALTH_PROBE_INTERVAL_SECONDS)
+
+    def readiness(self) -> tuple[bool, bytes]:
+        """(ready, JSON body) from the cached probes and the live pool counters."""
+        pool = pool_usage()
+        fresh = self.fresh()
+        checks = {
+            "probes_fresh": fresh,
+            "database": self.database["ok"],
+            "model": self.model["ok"],
+            "pool": not pool["saturated"],
+            "llm": self.llm["ok"],
+        }
+        required = [k for k in checks if k != "llm" or settings.HEALTH_READY_REQUIRES_LLM]
+        ready = not self.draining and all(checks[k] for k in required)
+        body = {
+            "status": "draining" if self.draining else "ready" if ready else "not_ready",
+            "checks": checks,
+            "pool": pool,
+            "checked_seconds_ago": round(time.monotonic() - self.checked_at, 3) if self.checked_at else None,
+        }
+        return ready, json.dumps(body).encode()
+
+    def services(self) -> dict:
+        """The public /health services block: up or down, nothing more."""
+        return {
+            "database": "connected" if self.database["ok"] else "unavailable",
+            "ml_model": self.model["ok"],
+            "llm_service": bool(getattr(afya_llm, "llm", None)),
+        }
+
+    def details(self) -> dict:
+        """The probe details served on /health/details."""
+        return {
+            "database": self.database_details,
+            "llm_backends": self.llm["backends"],
+        }
+
+
+health_prober = HealthProber()
+
+
+INTERNAL_HEADER = "X-Internal-Token"
+LOOPBACK_HOSTS = ("127.0.0.1", "::1")
+
+
+def require_internal(request: Request) -> None:
+    """Dependency for operator endpoints: the internal token, or a loopback client when none is set."""
+    if settings.INTERNAL_TOKEN:
+        token = request.headers.get(INTERNAL_HEADER)
+        if token and secrets.compare_digest(token, settings.INTERNAL_TOKEN):
+            return
+    elif request.client and request.client.host in LOOPBACK_HOSTS:
+        return
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not available")
+
+
+PROBE_PATHS = ("/livez", "/readyz")
+ALIVE_BODY = b'{"status":"alive"}'
+
+
+class ProbeMiddleware:
+    """ASGI middleware answering /livez (the event loop answers) and /readyz (the cached probes)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] == "/livez":
+            status, body = 200, ALIVE_BODY
+        else:
+            # 503 tells the balancer to route around this worker
+            ready, body = health_prober.readiness()
+            status = 200 if ready else 503
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
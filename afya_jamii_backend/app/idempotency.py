@@ -0,0 +1,288 @@
+"""Idempotency-Key support for the vitals submit and chat endpoints.
+
+Clients on flaky networks send the same ``Idempotency-Key`` header with
+every attempt of one request. The first attempt runs, and its 2xx response
+is stored. Retries get the stored bytes back, marked with an
+``Idempotent-Replayed: true`` header, instead of inserting rows again and
+paying for another model and LLM call. Keys are scoped to the caller (JWT
+subject, else IP) and the path. Reusing a key with a different body gets a
+422. A failed (non-2xx) attempt releases its key, so the retry runs for real.
+
+Lookups check a bounded in-process LRU first, then the ``idempotency_keys``
+table, so replays also work across workers. A duplicate that arrives while
+the first attempt is still running waits for it: on a future in the same
+process, or by polling the claimed row from another process. The running
+attempt refreshes its claim while it works, and only a claim left
+unrefreshed for IDEMPOTENCY_LEASE_SECONDS (a crashed worker) can be taken
+over by a retry.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.config import settings
+from app.database import engine
+from app.models import IdempotencyRecord
+from app.rate_limit import get_user_or_remote_address
+import logging
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_PATHS = {"/api/v1/vitals/submit", "/api/v1/chat/advice"}
+MAX_KEY_LENGTH = 255
+PURGE_EVERY = 500  # claims between deletes of expired rows
+
+# Outcomes of a claim attempt
+CLAIMED, DONE, BUSY, MISMATCH = "claimed", "done", "busy", "mismatch"
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    status_code: int
+    content_type: Optional[str]
+    body: bytes
+    expires_at: datetime
+
+    def replay(self) -> Response:
+        headers = {"Idempotent-Replayed": "true"}
+        if self.content_type:
+            headers["content-type"] = self.content_type
+        return Response(content=self.body, status_code=self.status_code, headers=headers)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _claim_time() -> datetime:
+    # Whole seconds: claimed_at doubles as the claim's token, and MySQL DATETIME drops microseconds
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def _mismatch() -> Response:
+    return JSONResponse(
+        status_code=422,
+        content={"detail": "Idempotency-Key was already used with a different request body"},
+    )
+
+
+class IdempotencyStore:
+    def __init__(self, cache_size: int = settings.IDEMPOTENCY_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._claims = 0
+
+    # ---- in-process front cache (event loop only, no locking needed) ----
+    def _cache_get(self, key_hash: str) -> Optional[StoredResponse]:
+        stored = self._cache.get(key_hash)
+        if stored is None:
+            return None
+        if stored.expires_at <= datetime.utcnow():
+            del self._cache[key_hash]
+            return None
+        self._cache.move_to_end(key_hash)
+        return stored
+
+    def _cache_put(self, key_hash: str, stored: StoredResponse):
+        self._cache[key_hash] = stored
+        self._cache.move_to_end(key_hash)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # ---- database (run in the threadpool) ----
+    def _claim(self, key_hash: str, request_hash: str, now: datetime) -> Tuple[str, Optional[StoredResponse]]:
+        """Claim the key as of ``now``, which the caller keeps to refresh the claim."""
+        table = IdempotencyRecord.__table__
+        self._claims += 1
+        if self._claims % PURGE_EVERY == 0:
+            self._purge(now)
+
+        with engine.begin() as conn:
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(table).values(
+                        key_hash=key_hash, request_hash=request_hash, status="in_progress",
+                        claimed_at=now, expires_at=now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS),
+                    ))
+                return CLAIMED, None
+            except IntegrityError:
+                pass
+
+            row = conn.execute(select(table).where(table.c.key_hash == key_hash)).first()
+            if row is None:
+                return BUSY, None  # released between our insert and select; try again
+            expired = row.expires_at <= now
+            abandoned = row.status == "in_progress" and (
+                row.claimed_at <= now - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+            )
+            if expired or abandoned:
+                taken = conn.execute(
+                    update(table)
+                    .where(table.c.key_hash == key_hash, table.c.claimed_at == row.claimed_at)
+                    .values(request_hash=request_hash, status="in_progress", status_code=None,
+                            content_type=None, body=None, claimed_at=now,
+                            expires_at=now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS))
+                ).rowcount
+                return (CLAIMED if taken else BUSY), None
+            if row.request_hash != request_hash:
+                return MISMATCH, None
+            if row.status == "done":
+                return DONE, StoredResponse(
+                    row.request_hash, row.status_code, row.content_type, row.body, row.expires_at
+                )
+            return BUSY, None
+
+    def _refresh(self, key_hash: str, claimed_at: datetime) -> Optional[datetime]:
+        """Move our claim's claimed_at to now; None if the claim is no longer ours."""
+        table = IdempotencyRecord.__table__
+        now = _claim_time()
+        with engine.begin() as conn:
+            refreshed = conn.execute(
+                update(table)
+                .where(table.c.key_hash == key_hash, table.c.claimed_at == claimed_at,
+                       table.c.status == "in_progress")
+                .values(claimed_at=now)
+            ).rowcount
+        return now if refreshed else None
+
+    async def _keep_claim(self, key_hash: str, claimed_at: datetime):
+        """Refresh the claim until cancelled, so a slow but live attempt is never taken for abandoned."""
+        while True:
+            await asyncio.sleep(settings.IDEMPOTENCY_LEASE_SECONDS / 3)
+            try:
+                refreshed = await run_in_threadpool(self._refresh, key_hash, claimed_at)
+            except Exception as e:
+                logger.warning("Could not refresh idempotency claim: %s", e)
+                continue
+            if refreshed is None:
+                logger.warning("Idempotency claim was taken over while its request was still running")
+                return
+            claimed_at = refreshed
+
+    def _complete(self, key_hash: str, stored: StoredResponse):
+        table = IdempotencyRecord.__table__
+        with engine.begin() as conn:
+            conn.execute(update(table).where(table.c.key_hash == key_hash).values(
+                status="done", status_code=stored.status_code,
+                content_type=stored.content_type, body=stored.body,
+            ))
+
+    def _release(self, key_hash: str):
+        table = IdempotencyRecord.__table__
+        with engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.key_hash == key_hash))
+
+    def _purge(self, now: datetime):
+        table = IdempotencyRecord.__table__
+        try:
+            with engine.begin() as conn:
+                conn.execute(delete(table).where(table.c.expires_at <= now))
+        except Exception as e:
+            logger.warning("Could not purge expired idempotency keys: %s", e)
+
+    # ---- request handling ----
+    def _from_stored(self, stored: StoredResponse, request_hash: str) -> Response:
+        return stored.replay() if stored.request_hash == request_hash else _mismatch()
+
+    async def run(self, key_hash: str, request_hash: str,
+                  call_next: Callable[[], Awaitable[Response]]) -> Response:
+        # Duplicates in this process wait for the attempt already running here
+        while True:
+            stored = self._cache_get(key_hash)
+            if stored is not None:
+                return self._from_stored(stored, request_hash)
+            inflight = self._inflight.get(key_hash)
+            if inflight is None:
+                break
+            stored = await asyncio.shield(inflight)
+            if stored is not None:
+                return self._from_stored(stored, request_hash)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key_hash] = future
+        claimed = False
+        keeper = None
+        try:
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+            delay = 0.05
+            while True:
+                claimed_at = _claim_time()
+                outcome, stored = await run_in_threadpool(self._claim, key_hash, request_hash, claimed_at)
+                if outcome == CLAIMED:
+                    claimed = True
+                    keeper = asyncio.create_task(self._keep_claim(key_hash, claimed_at))
+                    break
+                if outcome == DONE:
+                    self._cache_put(key_hash, stored)
+                    future.set_result(stored)
+                    return stored.replay()
+                if outcome == MISMATCH:
+                    future.set_result(None)
+                    return _mismatch()
+                # Another worker is running it: poll until it finishes
+                if time.monotonic() >= deadline:
+                    future.set_result(None)
+                    return JSONResponse(
+                        status_code=409, content={"detail": "A request with this Idempotency-Key is in progress"}
+                    )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+
+            response = await call_next()
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            keeper.cancel()
+            if 200 <= response.status_code < 300:
+                stored = StoredResponse(
+                    request_hash, response.status_code, response.headers.get("content-type"), body,
+                    datetime.utcnow() + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS),
+                )
+                await run_in_threadpool(self._complete, key_hash, stored)
+                self._cache_put(key_hash, stored)
+                future.set_result(stored)
+            else:
+                await run_in_threadpool(self._release, key_hash)
+                future.set_result(None)
+            claimed = False
+            return Response(content=body, status_code=response.status_code, headers=dict(response.headers))
+        except BaseException:
+            if claimed:
+                # Off the loop like the other writes; shielded, so a cancelled request still releases its key
+                await asyncio.shield(run_in_threadpool(self._release, key_hash))
+            raise
+        finally:
+            if keeper is not None:
+                keeper.cancel()
+            if not future.done():
+                future.set_result(None)
+            self._inflight.pop(key_hash, None)
+
+
+idempotency_store = IdempotencyStore()
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    """Applies idempotency_store to POSTs on IDEMPOTENT_PATHS that carry an Idempotency-Key."""
+
+    async def dispatch(self, request: Request, call_next):
+        key = request.headers.get("idempotency-key")
+        if key is None or request.method != "POST" or request.url.path not in IDEMPOTENT_PATHS:
+            return await call_next(request)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return JSONResponse(
+                status_code=400, content={"detail": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"}
+            )
+        body = await request.body()
+        principal = get_user_or_remote_address(request)
+        key_hash = _sha256(f"{principal}\n{request.url.path}\n{key}".encode())
+        return await idempotency_store.run(key_hash, _sha256(body), lambda: call_next(request))
@@ -0,0 +1,130 @@
+"""Fixed-layout storage of per-prediction feature importances.
+
+Importances are stored as six little-endian float32 values (24 bytes) in
+``vitals_records.ml_importances``. ``ml_feature_schema`` says which feature
+each slot holds, so a retrained model with other features gets a new schema
+id and older rows still decode. Rows whose importances do not match a known
+schema keep using the legacy JSON column.
+
+Convert existing rows with::
+
+    python -m app.importances migrate [--chunk-size 5000]
+"""
+import argparse
+import json
+import struct
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+
+from app.database import create_db_and_tables, engine
+from app.models import VitalsRecord, VitalsRecordResponse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Never reuse or reorder an id: stored rows refer to it
+FEATURE_SCHEMAS: Dict[int, Tuple[str, ...]] = {
+    1: ("Age", "SystolicBP", "DiastolicBP", "BS", "BodyTemp", "HeartRate"),
+}
+CURRENT_SCHEMA = 1
+_LAYOUTS = {schema_id: struct.Struct(f"<{len(names)}f") for schema_id, names in FEATURE_SCHEMAS.items()}
+
+
+def pack_importances(importances: Optional[Dict[str, float]]) -> Tuple[Optional[int], Optional[bytes]]:
+    """(schema id, blob), or (None, None) when the features do not match the current schema."""
+    names = FEATURE_SCHEMAS[CURRENT_SCHEMA]
+    if not importances or set(importances) != set(names):
+        return None, None
+    return CURRENT_SCHEMA, _LAYOUTS[CURRENT_SCHEMA].pack(*(float(importances[n]) for n in names))
+
+
+def unpack_importances(schema_id: Optional[int], blob: Optional[bytes],
+                       legacy_json: Optional[str] = None) -> Optional[Dict[str, float]]:
+    if blob is not None and schema_id in _LAYOUTS:
+        return dict(zip(FEATURE_SCHEMAS[schema_id], _LAYOUTS[schema_id].unpack(blob)))
+    if legacy_json:
+        return json.loads(legacy_json)
+    return None
+
+
+def importance_columns(importances: Optional[Dict[str, float]]) -> dict:
+    """VitalsRecord column values for a prediction's importances."""
+    schema_id, blob = pack_importances(importances)
+    if blob is None:
+        return {"ml_feature_importances": json.dumps(importances) if importances else None}
+    return {"ml_feature_schema": schema_id, "ml_importances": blob}
+
+
+def vitals_response(record: VitalsRecord) -> VitalsRecordResponse:
+    return VitalsRecordResponse.model_construct(
+        id=record.id, user_id=record.user_id, age=record.age,
+        systolic_bp=record.systolic_bp, diastolic_bp=record.diastolic_bp, bs=record.bs,
+        body_temp=record.body_temp, body_temp_unit=record.body_temp_unit, heart_rate=record.heart_rate,
+        patient_history=record.patient_history, ml_risk_label=record.ml_risk_label,
+        ml_probability=record.ml_probability, created_at=record.created_at, change_seq=record.change_seq,
+        ml_feature_importances=unpack_importances(
+            record.ml_feature_schema, record.ml_importances, record.ml_feature_importances
+        ),
+    )
+
+
+def migrate(chunk_size: Optional[int] = None) -> int:
+    """Pack legacy JSON importances into ml_importances, in id-ordered chunks.
+
+    Converted rows get their JSON column cleared. Rows that cannot be packed
+    are left as they are, so the migration can be rerun at any time.
+    """
+    chunk_size = chunk_size or 5000
+    v = VitalsRecord.__table__.c
+    statement = (
+        update(VitalsRecord.__table__)
+        .where(v.id == bindparam("record_id"))
+        .values(ml_feature_schema=bindparam("schema_id"), ml_importances=bindparam("blob"),
+                ml_feature_importances=None)
+    )
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(v.id))).scalar() or 0
+
+    last_id, converted = 0, 0
+    while last_id < max_id:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(v.id, v.ml_feature_importances)
+                .where(v.id > last_id, v.id <= max_id, v.ml_importances.is_(None))
+                .order_by(v.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            params = []
+            for record_id, legacy in rows:
+                try:
+                    schema_id, blob = pack_importances(json.loads(legacy) if legacy else None)
+                except (TypeError, ValueError):
+                    schema_id, blob = None, None
+                if blob is not None:
+                    params.append({"record_id": record_id, "schema_id": schema_id, "blob": blob})
+            if params:
+                conn.execute(statement, params)
+        last_id = rows[-1].id
+        converted += len(params)
+        logger.info("Packed importances through vitals_records.id=%s (%s rows)", last_id, converted)
+    return converted
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Maintain packed feature importances on vitals_records")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("migrate", help="pack legacy JSON importances")
+    run.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    create_db_and_tables()  # adds the new columns to an existing table
+    if args.command == "migrate":
+        count = migrate(args.chunk_size)
+        print(f"Packed feature importances of {count} vitals records")
+
+
+if __name__ == "__main__":
+    main()
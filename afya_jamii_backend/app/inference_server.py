@@ -0,0 +1,282 @@
+"""Risk-model inference in a separate local process, reached over a Unix socket.
+
+With INFERENCE_SOCKET set, API workers load no model. ``submit_vitals``
+sends the feature row to the inference server through ``inference_client``,
+so XGBoost no longer competes with request handling for the worker's GIL,
+and a single booster serves every worker::
+
+    python -m app.inference_server --socket /run/afya/inference.sock --workers 2
+
+The server loads the model once, then forks ``--workers`` processes that
+share the listening socket (and the booster's pages, copy-on-write). Each
+process collects the requests that arrive while it is busy and scores them
+with one ``predict_batch`` call of up to INFERENCE_BATCH_ROWS rows.
+
+Frames are a header (op or status byte, unsigned 32-bit count) followed by
+raw little-endian float64 values: 6 per row in a request, one probability
+per row in a reply. A row is 48 bytes, so copying it through the socket
+costs less than a shared-memory ring would need for its synchronisation.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.ml_model import RISK_THRESHOLD, RiskPredictionModel, deviation_importances
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("!BI")
+OP_INFO, OP_PREDICT = 0, 1
+STATUS_OK, STATUS_ERROR = 0, 1
+FEATURE_NAMES = RiskPredictionModel().feature_names
+ROW_BYTES = 8 * len(FEATURE_NAMES)
+WIRE_DTYPE = np.dtype("<f8")
+
+
+# ─────────── server ───────────
+class InferenceServer:
+    def __init__(self, model: RiskPredictionModel, batch_rows: int):
+        self.model = model
+        self.batch_rows = batch_rows
+        self._pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def info(self) -> dict:
+        importances = getattr(self.model.model, "feature_importances_", None)
+        return {
+            "pid": os.getpid(),
+            "model_type": self.model.model_metadata.get("model_type"),
+            "model_path": self.model.model_metadata.get("model_path"),
+            "feature_names": self.model.feature_names,
+            "feature_importances": None if importances is None else [float(v) for v in importances],
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                op, count = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if op == OP_INFO:
+                    payload = json.dumps(self.info()).encode()
+                    writer.write(HEADER.pack(STATUS_OK, len(payload)) + payload)
+                elif op == OP_PREDICT:
+                    rows = np.frombuffer(await reader.readexactly(count * ROW_BYTES), dtype=WIRE_DTYPE)
+                    future = loop.create_future()
+                    self._pending.append((rows.reshape(count, len(FEATURE_NAMES)), future))
+                    self._wakeup.set()
+                    try:
+                        probabilities = await future
+                        writer.write(HEADER.pack(STATUS_OK, count) + probabilities.astype(WIRE_DTYPE).tobytes())
+                    except Exception as e:
+                        message = str(e)[:500].encode()
+                        writer.write(HEADER.pack(STATUS_ERROR, len(message)) + message)
+                else:
+                    logger.warning("Unknown inference op %s; closing connection", op)
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def run_batches(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # One more loop pass, so connections whose frames are already buffered join this batch
+            await asyncio.sleep(0)
+            while self._pending:
+                batch, rows = [], 0
+                while self._pending and (not batch or rows + len(self._pending[0][0]) <= self.batch_rows):
+                    request = self._pending.pop(0)
+                    batch.append(request)
+                    rows += len(request[0])
+                self._score(batch)
+
+    def _score(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        try:
+            features = batch[0][0] if len(batch) == 1 else np.concatenate([rows for rows, _ in batch])
+            _, probabilities = self.model.predict_batch(features)
+        except Exception as e:
+            logger.error("Inference batch of %s requests failed: %s", len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        offset = 0
+        for rows, future in batch:
+            if not future.done():
+                future.set_result(probabilities[offset:offset + len(rows)])
+            offset += len(rows)
+
+
+def _serve_forever(sock: socket.socket, model: RiskPredictionModel, batch_rows: int):
+    async def run():
+        server = InferenceServer(model, batch_rows)
+        batcher = asyncio.create_task(server.run_batches())
+        unix_server = await asyncio.start_unix_server(server.handle, sock=sock)
+        logger.info("Inference worker %s serving", os.getpid())
+        try:
+            async with unix_server:
+                await unix_server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(socket_path: str, workers: int, model_path: str, batch_rows: int):
+    model = RiskPredictionModel()
+    if not model.load_model(model_path):
+        raise RuntimeError(f"Could not load model from {model_path}")
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    os.chmod(socket_path, 0o660)
+    sock.listen(1024)
+    logger.info("Inference server listening on %s with %s worker(s)", socket_path, workers)
+
+    # Turn SIGTERM into SystemExit so the finally block stops the workers
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if workers <= 1:
+            _serve_forever(sock, model, batch_rows)
+            return
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=_serve_forever, args=(sock, model, batch_rows), name=f"inference-{i}")
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    finally:
+        if workers > 1:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+        sock.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+# ─────────── client ───────────
+class InferenceError(Exception):
+    pass
+
+
+class InferenceClient:
+    """Async client used by the API workers; keeps up to INFERENCE_CONNECTIONS open connections."""
+
+    def __init__(self, socket_path: Optional[str] = None):
+        self.socket_path = socket_path if socket_path is not None else settings.INFERENCE_SOCKET
+        self.info: Optional[dict] = None
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.socket_path)
+
+    async def _request(self, frame: bytes) -> Tuple[int, bytes]:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(settings.INFERENCE_CONNECTIONS)
+        async with self._slots:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            try:
+                writer.write(frame)
+                status, count = HEADER.unpack(await reader.readexactly(HEADER.size))
+                size = count * 8 if status == STATUS_OK and frame[0] == OP_PREDICT else count
+                payload = await reader.readexactly(size)
+            except BaseException:
+                # Timed out or broken mid-frame: the connection's stream position is unknown
+                writer.close()
+                raise
+            self._idle.append((reader, writer))
+            return status, payload
+
+    async def call(self, op: int, count: int, body: bytes = b"") -> bytes:
+        try:
+            status, payload = await asyncio.wait_for(
+                self._request(HEADER.pack(op, count) + body), settings.INFERENCE_TIMEOUT_SECONDS
+            )
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            raise InferenceError(f"Inference server at {self.socket_path} unavailable: {e!r}") from e
+        if status != STATUS_OK:
+            raise InferenceError(f"Inference failed: {payload.decode(errors='replace')}")
+        return payload
+
+    async def fetch_info(self) -> dict:
+        self.info = json.loads(await self.call(OP_INFO, 0))
+        return self.info
+
+    async def ping(self) -> bool:
+        try:
+            await self.fetch_info()
+            return True
+        except InferenceError as e:
+            logger.warning(str(e))
+            return False
+
+    async def predict_batch(self, features: np.ndarray) -> np.ndarray:
+        """Probabilities for an (n, 6) array in feature_names order."""
+        features = np.ascontiguousarray(features, dtype=WIRE_DTYPE)
+        payload = await self.call(OP_PREDICT, len(features), features.tobytes())
+        return np.frombuffer(payload, dtype=WIRE_DTYPE)
+
+    async def predict(self, features: Dict[str, float]) -> Tuple[str, float, Dict[str, float]]:
+        """Same result as RiskPredictionModel.predict, scored by the inference server."""
+        if self.info is None:
+            await self.fetch_info()
+        row = np.array([[features[name] for name in FEATURE_NAMES]])
+        probability = float((await self.predict_batch(row))[0])
+        risk_label = "high risk" if probability >= RISK_THRESHOLD else "low risk"
+        if self.info["feature_importances"] is not None:
+            importances = dict(zip(self.info["feature_names"], self.info["feature_importances"]))
+        else:
+            importances = deviation_importances(features)
+        return risk_label, probability, importances
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+inference_client = InferenceClient()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the risk model over a Unix socket")
+    parser.add_argument("--socket", default=settings.INFERENCE_SOCKET or "/tmp/afya_inference.sock")
+    parser.add_argument("--workers", type=int, default=settings.INFERENCE_WORKERS)
+    parser.add_argument("--model-path", default=settings.MODEL_PATH)
+    parser.add_argument("--batch-rows", type=int, default=settings.INFERENCE_BATCH_ROWS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    serve(args.socket, args.workers, args.model_path, args.batch_rows)
+
+
+if __name__ == "__main__":
+    main()
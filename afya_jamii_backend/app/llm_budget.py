@@ -0,0 +1,216 @@
+"""Per-user LLM token budgets and the shared upstream (Groq) quota.
+
+Usage is kept as one counter row per user per UTC day in llm_usage_daily.
+Before a call, ``plan_for`` turns today's usage into a plan:
+
+    full       history LLM_HISTORY_TURNS, max_tokens LLM_MAX_TOKENS
+    reduced    (>= LLM_BUDGET_REDUCED_AT) 4 turns, half the max_tokens
+    minimal    (>= LLM_BUDGET_MINIMAL_AT) no history, a quarter of max_tokens
+    exhausted  (>= budget) templated answer, no LLM call
+
+Calls also reserve requests and estimated tokens against LLM_UPSTREAM_RPM
+and LLM_UPSTREAM_TPM, once more for each hedge or failover request the
+router sends. Tokens of hedges that lose count toward the user's budget
+too. The counters live in the rate limit storage, so all workers share
+them. When the upstream quota is spent the caller gets the templated
+answer too, instead of a Groq 429.
+"""
+from datetime import date, datetime
+from typing import Iterator, NamedTuple, Optional
+
+from limits import RateLimitItemPerMinute
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+from sqlalchemy import and_, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.database import engine
+from app.llm_groq import afya_llm
+from app.llm_router import LLMReply, StreamItem
+from app.metrics import observe_stage, record_error
+from app.models import LLMUsageDaily, LLMUsageResponse
+import app.rate_limit  # noqa: F401  registers the sqlite:// limits storage
+import logging
+
+logger = logging.getLogger(__name__)
+
+FULL, REDUCED, MINIMAL, EXHAUSTED = "full", "reduced", "minimal", "exhausted"
+
+TEMPLATED_ADVICE = (
+    "Afya Jamii AI has reached its advice limit for now, so here is our standard guidance. "
+    "{assessment}"
+    "Keep attending your antenatal or postnatal clinic visits, eat a balanced diet with "
+    "vegetables such as sukuma wiki and managu, beans, eggs and fruit, drink plenty of clean water "
+    "and rest well. Seek care immediately for severe headache, blurred vision, swelling of the face "
+    "or hands, bleeding, fever, or reduced baby movements: call 999, 112 or Kenya Red Cross on 1199. "
+    "You can ask again tomorrow for personalised advice."
+)
+
+
+class BudgetPlan(NamedTuple):
+    mode: str
+    history_turns: int
+    max_tokens: int
+
+
+def _today() -> date:
+    return datetime.utcnow().date()
+
+
+def usage_today(user_id: int) -> Optional[LLMUsageDaily]:
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(LLMUsageDaily.__table__)
+            .where(LLMUsageDaily.user_id == user_id, LLMUsageDaily.day == _today())
+        ).first()
+    return LLMUsageDaily(**row._mapping) if row else None
+
+
+def tokens_used_today(user_id: int) -> int:
+    usage = usage_today(user_id)
+    return (usage.prompt_tokens + usage.completion_tokens) if usage else 0
+
+
+def plan_for(user_id: int) -> BudgetPlan:
+    return plan_for_tokens(tokens_used_today(user_id))
+
+
+def plan_for_tokens(used: int) -> BudgetPlan:
+    fraction = used / settings.LLM_DAILY_TOKEN_BUDGET if settings.LLM_DAILY_TOKEN_BUDGET else 0.0
+    if fraction >= 1.0:
+        return BudgetPlan(EXHAUSTED, 0, 0)
+    if fraction >= settings.LLM_BUDGET_MINIMAL_AT:
+        return BudgetPlan(MINIMAL, 0, max(settings.LLM_MAX_TOKENS // 4, 64))
+    if fraction >= settings.LLM_BUDGET_REDUCED_AT:
+        return BudgetPlan(REDUCED, min(4, settings.LLM_HISTORY_TURNS), max(settings.LLM_MAX_TOKENS // 2, 64))
+    return BudgetPlan(FULL, settings.LLM_HISTORY_TURNS, settings.LLM_MAX_TOKENS)
+
+
+def record_usage(user_id: int, prompt_tokens: int, completion_tokens: int, degraded: bool, requests: int = 1):
+    """Add to today's counters: UPDATE, and INSERT for the first call of the day.
+
+    ``requests`` is 0 for the tokens of a losing hedge, which belong to a request already counted.
+    """
+    table = LLMUsageDaily.__table__
+    day = _today()
+    where = and_(table.c.user_id == user_id, table.c.day == day)
+    increments = {
+        "requests": table.c.requests + requests,
+        "prompt_tokens": table.c.prompt_tokens + prompt_tokens,
+        "completion_tokens": table.c.completion_tokens + completion_tokens,
+        "degraded_requests": table.c.degraded_requests + int(degraded),
+    }
+    try:
+        with engine.begin() as conn:
+            if conn.execute(update(table).where(where).values(increments)).rowcount:
+                return
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(table).values(
+                        user_id=user_id, day=day, requests=requests, prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens, degraded_requests=int(degraded),
+                    ))
+            except IntegrityError:
+                # Another request created today's row first
+                conn.execute(update(table).where(where).values(increments))
+    except Exception as e:
+        logger.error("Failed to record LLM usage for user %s: %s", user_id, e)
+
+
+class UpstreamQuota:
+    """Fixed-window RPM/TPM counters for the upstream API, shared through the limits storage."""
+
+    def __init__(self):
+        self._limiter = None
+
+    def _get_limiter(self) -> FixedWindowRateLimiter:
+        if self._limiter is None:
+            self._limiter = FixedWindowRateLimiter(storage_from_string(settings.RATE_LIMIT_STORAGE_URI))
+        return self._limiter
+
+    def acquire(self, estimated_tokens: int) -> bool:
+        """Reserve one request and estimated_tokens; False when either quota is spent this minute."""
+        try:
+            limiter = self._get_limiter()
+            if settings.LLM_UPSTREAM_RPM and not limiter.hit(
+                RateLimitItemPerMinute(settings.LLM_UPSTREAM_RPM), "llm-upstream", "requests"
+            ):
+                return False
+            if settings.LLM_UPSTREAM_TPM and not limiter.hit(
+                RateLimitItemPerMinute(settings.LLM_UPSTREAM_TPM), "llm-upstream", "tokens",
+                cost=min(estimated_tokens, settings.LLM_UPSTREAM_TPM),
+            ):
+                return False
+            return True
+        except Exception as e:
+            # Never block advice on the quota store itself
+            logger.warning("Upstream quota check failed, allowing call: %s", e)
+            return True
+
+
+upstream_quota = UpstreamQuota()
+
+
+def templated_advice(assessment: str = "") -> str:
+    return TEMPLATED_ADVICE.format(assessment=f"{assessment} " if assessment else "")
+
+
+def _quota_for_extra(prompt_data: dict, plan: BudgetPlan):
+    """allow_extra for the router: each hedge or failover reserves quota like the first request."""
+    estimated_tokens = afya_llm.estimate_tokens(prompt_data, plan.max_tokens)
+    return lambda: upstream_quota.acquire(estimated_tokens)
+
+
+def _admit(prompt_data: dict, plan: BudgetPlan) -> bool:
+    if plan.mode == EXHAUSTED:
+        return False
+    if not upstream_quota.acquire(afya_llm.estimate_tokens(prompt_data, plan.max_tokens)):
+        logger.warning("Upstream LLM quota reached - answering with templated advice")
+        record_error("llm_quota")
+        return False
+    return True
+
+
+def budgeted_advice(user_id: int, prompt_data: dict, plan: BudgetPlan, assessment: str = "") -> str:
+    """Advice within the user's plan and the upstream quota, else the templated answer."""
+    if not _admit(prompt_data, plan):
+        record_usage(user_id, 0, 0, degraded=True)
+        return templated_advice(assessment)
+
+    with observe_stage("llm_call"):
+        reply = afya_llm.generate(
+            prompt_data, max_tokens=plan.max_tokens,
+            allow_extra=_quota_for_extra(prompt_data, plan),
+            charge_extra=lambda extra: record_usage(
+                user_id, extra.prompt_tokens, extra.completion_tokens, degraded=False, requests=0
+            ),
+        )
+    record_usage(user_id, reply.prompt_tokens, reply.completion_tokens, degraded=plan.mode != FULL)
+    return reply.text
+
+
+def stream_budgeted_advice(prompt_data: dict, plan: BudgetPlan, assessment: str = "") -> Iterator[StreamItem]:
+    """budgeted_advice as a stream; the caller records usage from the final LLMReply."""
+    if not _admit(prompt_data, plan):
+        text = templated_advice(assessment)
+        yield text
+        yield LLMReply(text, backend="templated")
+        return
+    with observe_stage("llm_call"):
+        yield from afya_llm.stream(prompt_data, max_tokens=plan.max_tokens,
+                                   allow_extra=_quota_for_extra(prompt_data, plan))
+
+
+def usage_response(user_id: int) -> LLMUsageResponse:
+    usage = usage_today(user_id) or LLMUsageDaily(user_id=user_id, day=_today())
+    used = usage.prompt_tokens + usage.completion_tokens
+    return LLMUsageResponse(
+        day=usage.day,
+        requests=usage.requests,
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        token_budget=settings.LLM_DAILY_TOKEN_BUDGET,
+        remaining_tokens=max(settings.LLM_DAILY_TOKEN_BUDGET - used, 0),
+        mode=plan_for(user_id).mode,
+    )
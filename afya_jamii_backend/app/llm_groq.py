@@ -1,31 +1,28 @@
 import os
-from langchain_groq import ChatGroq
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from typing import Callable, Iterator, Optional
 from app.config import settings
+from app.llm_router import (
+    ChatGroqBackend, LLMReply, LLMRouter, OpenAICompatibleBackend, RulesBackend, StreamItem
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Rough English/Swahili average, used only to reserve upstream TPM quota before a call
+CHARS_PER_TOKEN = 4
+
 class AfyaJamiiLLM:
     def __init__(self):
         self.llm = None
-        self.chain = None
-        self.initialize_llm()
+        self.prompt = None
+        self.router = None
     
     def initialize_llm(self):
         """Initialize Groq LLM with configuration from settings"""
         try:
-            if not settings.GROQ_API_KEY or settings.GROQ_API_KEY == "your-groq-api-key-here":
-                logger.error("GROQ_API_KEY not configured")
-                return
-            
-            self.llm = ChatGroq(
-                model=settings.LLM_MODEL_NAME,
-                temperature=settings.LLM_TEMPERATURE,
-                api_key=settings.GROQ_API_KEY
-            )
-            
+            # langchain is slow to import, so load it on first initialization
+            from langchain.prompts import PromptTemplate
+
             # Create prompt template
             template = """
 You are Afya Jamii AI, a clinical decision-support and maternal nutrition assistant for Kenyan pregnant and postnatal mothers and general users seeking nutrition advice.
@@ -142,34 +139,68 @@ For these counties, use:
                 template=template
             )
             
-            # Create chain
-            self.chain = LLMChain(
-                llm=self.llm,
-                prompt=self.prompt,
-                verbose=settings.DEBUG
-            )
-            
-            logger.info("Groq LLM initialized successfully")
-            
+            backends = []
+            if not settings.GROQ_API_KEY or settings.GROQ_API_KEY == "your-groq-api-key-here":
+                logger.error("GROQ_API_KEY not configured")
+            else:
+                primary = ChatGroqBackend("groq", settings.LLM_MODEL_NAME)
+                self.llm = primary.llm
+                backends.append(primary)
+                if settings.LLM_FALLBACK_MODEL_NAME:
+                    backends.append(ChatGroqBackend("groq-fallback", settings.LLM_FALLBACK_MODEL_NAME))
+            if settings.LLM_LOCAL_BASE_URL:
+                backends.append(OpenAICompatibleBackend(
+                    "local", settings.LLM_LOCAL_BASE_URL, settings.LLM_LOCAL_MODEL_NAME
+                ))
+            self.router = LLMRouter(backends, RulesBackend())
+
+            logger.info("LLM initialized with backends: %s", [b.name for b in backends] + ['rules'])
+
         except Exception as e:
-            logger.error(f"Failed to initialize LLM: {e}")
+            logger.error("Failed to initialize LLM: %s", e)
             self.llm = None
+            self.router = None
     
-    def generate_advice(self, prompt_data: dict) -> str:
-        """Generate clinical advice using Groq LLM"""
-        if not self.chain:
-            return "LLM service temporarily unavailable. Please try again later."
-        
+    def generate(self, prompt_data: dict, max_tokens: Optional[int] = None,
+                 allow_extra: Optional[Callable[[], bool]] = None,
+                 charge_extra: Optional[Callable[[LLMReply], None]] = None) -> LLMReply:
+        """Generate advice through the backend router and report the token usage of the call"""
+        if not self.router:
+            return LLMReply("LLM service temporarily unavailable. Please try again later.")
+
         try:
-            response = self.chain.run(**prompt_data)
-            return response
+            return self.router.generate(prompt_data, self.prompt.format(**prompt_data), max_tokens,
+                                        allow_extra=allow_extra, charge_extra=charge_extra)
         except Exception as e:
-            logger.error(f"LLM generation error: {e}")
-            return f"Error generating advice: {str(e)}"
+            logger.error("LLM generation error: %s", e)
+            return LLMReply(f"Error generating advice: {str(e)}")
+
+    def stream(self, prompt_data: dict, max_tokens: Optional[int] = None,
+               allow_extra: Optional[Callable[[], bool]] = None) -> Iterator[StreamItem]:
+        """Like generate, as text deltas followed by the final LLMReply"""
+        if not self.router:
+            reply = LLMReply("LLM service temporarily unavailable. Please try again later.")
+            yield reply.text
+            yield reply
+            return
+        yield from self.router.stream(prompt_data, self.prompt.format(**prompt_data), max_tokens,
+                                      allow_extra=allow_extra)
+
+    def generate_advice(self, prompt_data: dict) -> str:
+        """Generate clinical advice using Groq LLM"""
+        return self.generate(prompt_data).text
+
+    def estimate_tokens(self, prompt_data: dict, max_tokens: int) -> int:
+        """Upper estimate of the tokens a call will use (prompt plus completion budget)"""
+        if not self.prompt:
+            return max_tokens
+        return len(self.prompt.format(**prompt_data)) // CHARS_PER_TOKEN + max_tokens
 
-# Global LLM instance
+# Global LLM instance (initialized at application startup)
 afya_llm = AfyaJamiiLLM()
 
 def initialize_llm_service():
     """Initialize LLM service on application startup"""
+    if afya_llm.router is None:
+        afya_llm.initialize_llm()
     return afya_llm.llm is not None
\ No newline at end of file
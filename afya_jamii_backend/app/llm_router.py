@@ -0,0 +1,428 @@
+"""LLM backends and a latency-aware router across them.
+
+A backend turns a formatted prompt into an ``LLMReply`` and raises on any
+failure. ``LLMRouter`` keeps rolling latency and error statistics per
+backend. Each call goes to the healthy backend with the lowest median
+latency. With LLM_HEDGE_MAX set, if no answer has arrived after the p95
+latency of that backend (at least LLM_HEDGE_MIN_SECONDS), a hedge request
+goes to the next healthy backend and the first answer wins. A backend is
+never hedged against itself: when it is slow, a second request to it only
+adds load.
+A backend that fails LLM_ROUTER_MAX_FAILURES times in a row, or above
+LLM_ROUTER_MAX_ERROR_RATE over the window, sits out for
+LLM_ROUTER_COOLDOWN_SECONDS. When every remote backend fails or is cooling
+down, the last-resort backend answers. By default that is the local rules
+engine, which needs no network.
+
+Any object with ``name`` and ``generate(prompt_data, prompt, max_tokens)``
+can be routed, so the router runs offline with stub backends (see
+``benchmarks/llm_router.py``).
+
+A routed call gives up after LLM_ROUTE_DEADLINE_SECONDS, which leaves room
+for failovers past the per-request LLM_TIMEOUT_SECONDS. Requests still
+queued for a thread at that point, or when another request has won, are
+cancelled before they reach a backend.
+
+Every request after the first (hedges and failovers) is an upstream call of
+its own. Callers can pass ``allow_extra`` to reserve quota for each one and
+``charge_extra`` to bill the replies that did not win.
+
+``stream()`` yields text deltas followed by one final ``LLMReply``.
+Streams are not hedged, since tokens already sent cannot be taken back. A
+backend that fails before its first token is failed over like ``generate``.
+"""
+import json
+import re
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+from app.config import settings
+from app.metrics import record_llm_backend, record_llm_tokens
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LLMReply(NamedTuple):
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    backend: str = ""
+
+
+StreamItem = Union[str, LLMReply]
+
+
+class LLMBackend(ABC):
+    name = "backend"
+
+    @abstractmethod
+    def generate(self, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> LLMReply:
+        """The whole reply; raises on any failure."""
+
+    def stream(self, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> Iterator[StreamItem]:
+        """Text deltas, then the final LLMReply; backends without streaming send one delta."""
+        reply = self.generate(prompt_data, prompt, max_tokens)
+        yield reply.text
+        yield reply
+
+
+class ChatGroqBackend(LLMBackend):
+    """A Groq-hosted model through langchain's ChatGroq."""
+
+    def __init__(self, name: str, model: str):
+        from langchain_groq import ChatGroq
+
+        self.name = name
+        self.llm = ChatGroq(
+            model=model,
+            temperature=settings.LLM_TEMPERATURE,
+            api_key=settings.GROQ_API_KEY,
+            base_url=settings.GROQ_API_BASE,
+            timeout=settings.LLM_TIMEOUT_SECONDS,
+        )
+
+    def generate(self, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> LLMReply:
+        from langchain_core.prompt_values import StringPromptValue
+
+        kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+        result = self.llm.generate_prompt([StringPromptValue(text=prompt)], **kwargs)
+        usage = (result.llm_output or {}).get("token_usage") or {}
+        return LLMReply(
+            result.generations[0][0].text,
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            self.name,
+        )
+
+    def stream(self, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> Iterator[StreamItem]:
+        kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+        parts, usage = [], None
+        for chunk in self.llm.stream(prompt, **kwargs):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+            usage = chunk.usage_metadata or usage
+        usage = usage or {}
+        yield LLMReply("".join(parts), usage.get("input_tokens", 0), usage.get("output_tokens", 0), self.name)
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """A model behind an OpenAI-style /v1/chat/completions endpoint, e.g. a
+    local llama.cpp ``llama-server`` running a small quantized model on CPU."""
+
+    def __init__(self, name: str, base_url: str, model: str, api_key: Optional[str] = None):
+        import httpx
+
+        self.name = name
+        self.model = model
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.Client(
+            base_url=base_url.rstrip("/"), headers=headers, timeout=settings.LLM_TIMEOUT_SECONDS
+        )
+
+    def _body(self, prompt: str, max_tokens: Optional[int], stream: bool = False) -> dict:
+        body = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": settings.LLM_TEMPERATURE,
+            "stream": stream,
+        }
+        if max_tokens:
+            body["max_tokens"] = max_tokens
+        return body
+
+    def generate(self, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> LLMReply:
+        response = self.client.post("/v1/chat/completions", json=self._body(prompt, max_tokens))
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get("usage") or {}
+        return LLMReply(
+            data["choices"][0]["message"]["content"],
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            self.name,
+        )
+
+    def stream(self, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> Iterator[StreamItem]:
+        parts, usage = [], {}
+        with self.client.stream("POST", "/v1/chat/completions", json=self._body(prompt, max_tokens, True)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                chunk = json.loads(line[len("data: "):])
+                usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage") or usage
+                for choice in chunk.get("choices") or ():
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        parts.append(text)
+                        yield text
+        yield LLMReply("".join(parts), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), self.name)
+
+
+class RulesBackend(LLMBackend):
+    """Templated guidance picked by keyword from the question and the model's risk label.
+
+    Never fails and needs no network, so it is the router's last resort.
+    """
+
+    name = "rules"
+
+    EMERGENCY = (
+        "If you have severe headache, blurred vision, swelling of the face or hands, "
+        "bleeding, fever, convulsions or reduced baby movements, go to the nearest facility "
+        "now or call 999, 112 or Kenya Red Cross on 1199."
+    )
+    RISK_ADVICE = {
+        "high risk": "Your latest vitals were assessed as HIGH RISK. Please visit a health facility "
+                     "today so a clinician can check your blood pressure and blood sugar.",
+        "mid risk": "Your latest vitals were assessed as MEDIUM RISK. Book a clinic visit within the "
+                    "next few days and keep recording your blood pressure.",
+        "low risk": "Your latest vitals were assessed as LOW RISK. Keep up your routine antenatal "
+                    "or postnatal clinic visits.",
+    }
+    TOPICS = (
+        (("eat", "food", "diet", "nutrition", "chakula", "kula", "lishe"),
+         "Eat a balanced diet: sukuma wiki, managu or terere for iron and folate, beans, ndengu "
+         "or omena for protein, ugali or brown rice for energy, and fruit such as pawpaw, oranges "
+         "and bananas. Take iron and folic acid supplements as prescribed."),
+        (("pressure", "bp", "headache", "kichwa"),
+         "To help with blood pressure, limit salt and processed foods, rest on your left side, and "
+         "have your blood pressure rechecked at the clinic."),
+        (("sugar", "diabetes", "sukari", "glucose"),
+         "To help with blood sugar, choose whole grains and vegetables over sugary drinks and "
+         "mandazi, eat small regular meals, and ask the clinic about a glucose test."),
+        (("fever", "temperature", "homa", "malaria"),
+         "A fever in pregnancy needs testing for malaria and infection. Drink plenty of clean water "
+         "and visit the clinic. Sleep under a treated mosquito net."),
+        (("exercise", "walk", "mazoezi", "sleep", "rest"),
+         "Gentle activity such as walking for 30 minutes most days is safe for most mothers. Rest "
+         "when tired and sleep on your side."),
+    )
+    RISK_PATTERN = re.compile(r"Model Prediction: (high risk|mid risk|low risk)", re.IGNORECASE)
+
+    def generate(self, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> LLMReply:
+        context = prompt_data.get("context", "")
+        words_in_question = set(re.findall(r"\w+", prompt_data.get("question", "").lower()))
+        parts = ["Afya Jamii AI is using its offline guidance right now."]
+        risk = self.RISK_PATTERN.search(context)
+        if risk:
+            parts.append(self.RISK_ADVICE[risk.group(1).lower()])
+        parts.extend(text for words, text in self.TOPICS if words_in_question.intersection(words))
+        if len(parts) == 1:
+            parts.append(self.TOPICS[0][1])
+        parts.append(self.EMERGENCY)
+        return LLMReply(" ".join(parts), backend=self.name)
+
+
+class BackendStats:
+    """Rolling latency and outcome window of one backend."""
+
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def record(self, ok: bool, seconds: float, now: float):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(seconds)
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        tripped = self.consecutive_failures >= settings.LLM_ROUTER_MAX_FAILURES or (
+            len(self.outcomes) >= 10 and self.error_rate() > settings.LLM_ROUTER_MAX_ERROR_RATE
+        )
+        if tripped:
+            self.down_until = now + settings.LLM_ROUTER_COOLDOWN_SECONDS
+            self.consecutive_failures = 0
+            self.outcomes.clear()
+
+
+def router_threads() -> int:
+    """LLM_ROUTER_THREADS, else one thread per LLM request admission lets into this worker, plus its hedges."""
+    if settings.LLM_ROUTER_THREADS:
+        return settings.LLM_ROUTER_THREADS
+    limits = settings.ADMISSION_ROUTE_LIMITS
+    admitted = limits.get("/api/v1/chat/advice", 8) + limits.get("/api/v1/vitals/submit", 8)
+    return max(admitted, 1) * (1 + settings.LLM_HEDGE_MAX)
+
+
+class LLMRouter:
+    def __init__(self, backends: Sequence[LLMBackend], last_resort: Optional[LLMBackend] = None,
+                 window: Optional[int] = None, max_workers: Optional[int] = None):
+        self.backends = list(backends)
+        self.last_resort = last_resort or RulesBackend()
+        self.stats: Dict[str, BackendStats] = {
+            b.name: BackendStats(window or settings.LLM_ROUTER_WINDOW) for b in self.backends
+        }
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or router_threads(), thread_name_prefix="llm")
+
+    def ranked(self) -> List[LLMBackend]:
+        """Healthy backends, fastest median first; untried ones first, in configured order."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [
+                (self.stats[b.name].quantile(0.5) or 0.0, i, b)
+                for i, b in enumerate(self.backends) if self.stats[b.name].healthy(now)
+            ]
+        return [b for _, _, b in sorted(healthy, key=lambda item: item[:2])]
+
+    def hedge_delay(self, backend: LLMBackend) -> float:
+        with self._lock:
+            p95 = self.stats[backend.name].quantile(0.95)
+        return max(settings.LLM_HEDGE_MIN_SECONDS, p95 or 0.0)
+
+    def _call(self, backend: LLMBackend, prompt_data: dict, prompt: str, max_tokens: Optional[int]) -> LLMReply:
+        start = time.perf_counter()
+        try:
+            reply = backend.generate(prompt_data, prompt, max_tokens)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            logger.warning("LLM backend %s failed after %.2fs: %s", backend.name, elapsed, e)
+            self._record(backend, False, elapsed)
+            raise
+        elapsed = time.perf_counter() - start
+        self._record(backend, True, elapsed)
+        # Counted for every completed request, losing hedges included
+        record_llm_tokens(reply.prompt_tokens, reply.completion_tokens)
+        return reply
+
+    def _record(self, backend: LLMBackend, ok: bool, seconds: float):
+        with self._lock:
+            self.stats[backend.name].record(ok, seconds, time.monotonic())
+        record_llm_backend(backend.name, "ok" if ok else "error", seconds)
+
+    def generate(self, prompt_data: dict, prompt: str, max_tokens: Optional[int] = None,
+                 allow_extra: Optional[Callable[[], bool]] = None,
+                 charge_extra: Optional[Callable[[LLMReply], None]] = None) -> LLMReply:
+        """The first answer from the ranked backends, else the last resort.
+
+        ``allow_extra`` is asked before each hedge or failover request; False
+        stops them. ``charge_extra`` gets the reply of every other request
+        that completes, even after this call has returned.
+        """
+        candidates = self.ranked()
+        deadline = time.monotonic() + settings.LLM_ROUTE_DEADLINE_SECONDS
+        pending: Dict[Future, LLMBackend] = {}
+        hedges = 0
+
+        def launch(backend: LLMBackend):
+            pending[self._pool.submit(self._call, backend, prompt_data, prompt, max_tokens)] = backend
+
+        def launch_extra() -> bool:
+            if allow_extra is not None and not allow_extra():
+                return False
+            launch(candidates.pop(0))
+            return True
+
+        def settle(future: Future):
+            if charge_extra is not None and not future.cancelled() and future.exception() is None:
+                charge_extra(future.result())
+
+        def abandon(futures):
+            # Requests still queued in the pool never reach a backend; running ones are billed when they finish
+            for future in futures:
+                if not future.cancel():
+                    future.add_done_callback(settle)
+
+        if candidates:
+            launch(candidates.pop(0))
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                logger.warning("LLM backends timed out - answering from the last-resort backend")
+                break
+            timeout = deadline - now
+            can_hedge = candidates and hedges < settings.LLM_HEDGE_MAX
+            if can_hedge:
+                timeout = min(timeout, self.hedge_delay(next(iter(pending.values()))))
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge:
+                    backend = candidates[0]
+                    if launch_extra():
+                        hedges += 1
+                        record_llm_backend(backend.name, "hedge")
+                    else:
+                        hedges = settings.LLM_HEDGE_MAX  # no quota for a hedge: wait for the first request
+                continue
+            winner, losers = None, []
+            for future in done:
+                pending.pop(future)
+                if future.exception() is not None:
+                    continue
+                if winner is None:
+                    winner = future.result()
+                else:
+                    losers.append(future)
+            if winner is not None:
+                for future in losers:
+                    settle(future)
+                abandon(pending)
+                return winner
+            # Every in-flight request failed: fail over straight away
+            if not pending and candidates:
+                launch_extra()
+
+        abandon(pending)
+        reply = self.last_resort.generate(prompt_data, prompt, max_tokens)
+        record_llm_backend(self.last_resort.name, "last_resort")
+        return reply
+
+    def stream(self, prompt_data: dict, prompt: str, max_tokens: Optional[int] = None,
+               allow_extra: Optional[Callable[[], bool]] = None) -> Iterator[StreamItem]:
+        for attempt, backend in enumerate(self.ranked()):
+            if attempt and allow_extra is not None and not allow_extra():
+                break
+            start = time.perf_counter()
+            started = False
+            try:
+                for item in backend.stream(prompt_data, prompt, max_tokens):
+                    if isinstance(item, LLMReply):
+                        self._record(backend, True, time.perf_counter() - start)
+                        record_llm_tokens(item.prompt_tokens, item.completion_tokens)
+                    else:
+                        started = True
+                    yield item
+                return
+            except Exception as e:
+                elapsed = time.perf_counter() - start
+                logger.warning("LLM backend %s stream failed after %.2fs: %s", backend.name, elapsed, e)
+                self._record(backend, False, elapsed)
+                if started:
+                    raise
+        record_llm_backend(self.last_resort.name, "last_resort")
+        yield from self.last_resort.stream(prompt_data, prompt, max_tokens)
+
+    def snapshot(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    "healthy": stats.healthy(now),
+                    "p50_seconds": stats.quantile(0.5),
+                    "p95_seconds": stats.quantile(0.95),
+                    "error_rate": stats.error_rate(),
+                }
+                for name, stats in self.stats.items()
+            }
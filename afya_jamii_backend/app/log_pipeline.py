@@ -0,0 +1,131 @@
+"""Queue-based logging: the request path enqueues records, a thread formats and writes them.
+
+``configure_logging()`` puts one ``NonBlockingQueueHandler`` on the root
+logger. ``emit`` only samples the record and does a ``put_nowait`` on a
+bounded queue. A ``QueueListener`` thread formats records (JSON through
+python-json-logger, or the old text format with LOG_FORMAT=text) and
+writes them to stdout.
+
+- INFO and lower records are kept with probability LOG_INFO_SAMPLE_RATE.
+  WARNING and higher are always kept.
+- When the queue (LOG_QUEUE_SIZE records) is full, records are dropped
+  instead of blocking.
+- Kept, sampled-out and dropped records are counted in
+  ``afya_log_records_total``.
+
+A record's message is rendered in the writer thread. Logging calls that
+pass arguments (not f-strings) must not mutate those objects afterwards.
+LOG_ASYNC=false restores synchronous writes, e.g. for debugging a crash
+where queued records would be lost.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.config import settings
+from app.metrics import record_log
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Attributes every LogRecord has; anything else was passed with extra=
+# (color_message is uvicorn's coloured copy of the message)
+RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "color_message"}
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: "queue.Queue", sample_rate: float):
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare, leave formatting to the listener thread
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno <= logging.INFO and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            record_log("sampled_out")
+            return
+        try:
+            self.queue.put_nowait(record)
+            record_log("queued")
+        except queue.Full:
+            record_log("dropped")
+
+
+class TextFormatter(logging.Formatter):
+    """TEXT_FORMAT with the record's ``extra=`` fields appended as key=value pairs."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields = " ".join(f"{key}={value}" for key, value in vars(record).items() if key not in RECORD_ATTRS)
+        return f"{line} {fields}" if fields else line
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # The stock put_nowait raises queue.Full when stopping during a burst
+        self.queue.put(self._sentinel)
+
+
+def _formatter() -> logging.Formatter:
+    if settings.LOG_FORMAT == "json":
+        from pythonjsonlogger import jsonlogger
+
+        return jsonlogger.JsonFormatter(
+            "%(asctime)s %(levelname)s %(name)s %(message)s",
+            rename_fields={"asctime": "time", "levelname": "level", "name": "logger"},
+        )
+    return TextFormatter(TEXT_FORMAT)
+
+
+class LogPipeline:
+    def __init__(self):
+        self.handler: Optional[NonBlockingQueueHandler] = None
+        self.listener: Optional[DrainingQueueListener] = None
+        self._output: Optional[logging.Handler] = None
+
+    def _start_listener(self):
+        log_queue: "queue.Queue" = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        self.handler.queue = log_queue
+        self.listener = DrainingQueueListener(log_queue, self._output, respect_handler_level=True)
+        self.listener.start()
+
+    def _after_fork(self):
+        # The parent's writer thread does not exist in a forked worker, and its
+        # queue lock may have been held mid-fork: start over with fresh ones.
+        if self.listener is not None:
+            self._start_listener()
+
+    def configure(self):
+        root = logging.getLogger()
+        root.setLevel(getattr(logging, str(settings.LOG_LEVEL).upper(), logging.INFO))
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+
+        self._output = logging.StreamHandler(sys.stdout)
+        self._output.setFormatter(_formatter())
+        if not settings.LOG_ASYNC:
+            root.addHandler(self._output)
+            return
+
+        self.handler = NonBlockingQueueHandler(queue.Queue(), settings.LOG_INFO_SAMPLE_RATE)
+        self._start_listener()
+        root.addHandler(self.handler)
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Write out everything queued and stop the writer thread."""
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+
+log_pipeline = LogPipeline()
+
+
+def configure_logging():
+    log_pipeline.configure()
@@ -1,6 +1,8 @@
 
-from datetime import datetime
-from typing import List
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
+import asyncio
 import json
 import logging
 import time
@@ -9,12 +11,13 @@ from fastapi import (
     FastAPI, Depends, HTTPException, status, BackgroundTasks, Request
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
-from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
-from slowapi.util import get_remote_address
 from sqlmodel import Session, select
 
 from app.config import settings
@@ -23,23 +26,98 @@ from app.auth import (
     create_access_token, get_password_hash
 )
 from app.ml_model import risk_model, initialize_model
-from app.llm_groq import afya_llm, initialize_llm_service
-from app.database import get_session, create_db_and_tables
+from app.inference_server import inference_client
+from app.llm_groq import initialize_llm_service
+from app.llm_budget import budgeted_advice, plan_for, usage_response
+from app.database import engine, get_session, create_db_and_tables
+from app.rate_limit import limiter, llm_user_limits, get_user_or_remote_address
+from app.profiling import ProfilingMiddleware
+from app.metrics import (
+    REQUEST_LATENCY, observe_stage, record_error, update_pool_gauges, render_metrics
+)
+from app.analytics import (
+    GRANULARITIES, bucket_start, get_current_supervisor, query_distribution, record_submission
+)
+from app.archive import read_history
+from app.retrieval import prompt_history
+from app.chat_ws import chat_sessions, chat_websocket
+from app.write_behind import write_behind
+from app.health import ProbeMiddleware, health_prober, require_internal
+from app.admission import AdmissionMiddleware, admission
+from app.log_pipeline import configure_logging
+from app.importances import importance_columns, vitals_response
+from app.idempotency import IdempotencyMiddleware
+from app.sync import changes_since, current_seq, etag_for, parse_token
+from app.export import DATASETS, FORMATS, export_stream
+from app.trends import update_trend, get_trend, trend_response, describe_trend
 from app.models import (
-    UserDB, VitalsRecord, ConversationHistory,
+    AccountType, UserDB, VitalsRecord, ConversationHistory,
     UserResponse, UserCreate, UserLogin, VitalsSubmission, CombinedResponse,
-    MLModelOutput, LLMAdviceRequest, LLMAdviceResponse, Token
+    MLModelOutput, LLMAdviceRequest, LLMAdviceResponse, Token, RiskTrendResponse,
+    RiskDistributionResponse, VitalsRecordResponse, SyncResponse, LLMUsageResponse
 )
 
 # ────────────── LOGGING ──────────────
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL, "INFO"),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+configure_logging()
 logger = logging.getLogger("app.main")
+access_logger = logging.getLogger("app.access")
+
+# ────────────── STARTUP ──────────────
+def init_database():
+    try:
+        create_db_and_tables()
+        logger.info("Database tables created/verified.")
+    except Exception:
+        logger.exception("Database initialization failed")
+        raise RuntimeError("Database initialization failed")
+
+def init_model():
+    if risk_model.model_loaded or inference_client.enabled:
+        return
+    try:
+        if not initialize_model():
+            raise RuntimeError("initialize_model returned falsy")
+        logger.info("ML model loaded.")
+    except Exception:
+        logger.exception("ML model initialization failed")
+        raise RuntimeError("ML model init failed")
+
+def init_llm():
+    try:
+        if initialize_llm_service():
+            logger.info("LLM service initialized.")
+        else:
+            logger.warning("LLM initialization returned falsy — running reduced LLM mode")
+    except Exception:
+        logger.exception("LLM initialization raised exception; continuing in limited mode")
 
-# ────────────── RATE LIMITER ─────────
-limiter = Limiter(key_func=get_remote_address)
+def preload():
+    """Load the model and LLM client up front, e.g. in a gunicorn master with preload_app,
+    so forked workers share them instead of loading their own copies."""
+    init_model()
+    init_llm()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Starting Afya Jamii AI startup sequence...")
+    # The three steps are independent and mostly I/O or C-extension bound, so
+    # run them side by side instead of one after another.
+    await asyncio.gather(
+        run_in_threadpool(init_database),
+        run_in_threadpool(init_model),
+        run_in_threadpool(init_llm),
+    )
+    logger.info("Afya Jamii startup complete.")
+    sweeper = asyncio.create_task(chat_sessions.run_sweeper())
+    prober = asyncio.create_task(health_prober.run())
+    lag_monitor = asyncio.create_task(admission.run_monitor())
+    yield
+    lag_monitor.cancel()
+    prober.cancel()
+    sweeper.cancel()
+    await chat_sessions.close_all()
+    await inference_client.close()
+    await run_in_threadpool(write_behind.close)
 
 # ────────────── FASTAPI APP ─────────
 app = FastAPI(
@@ -47,7 +125,8 @@ app = FastAPI(
     description="Afya Jamii AI - Clinical Decision Support System",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 app.state.limiter = limiter
 
@@ -62,7 +141,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed"],
 )
+# Added before GZip so it sits inside it and stores uncompressed bodies
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE)
+# Outside idempotency, so a shed request costs no key lookup; inside log_requests, so 503s are logged
+app.add_middleware(AdmissionMiddleware)
 
 @app.middleware("http")
 async def add_security_headers(request: Request, call_next):
@@ -82,55 +167,44 @@ async def log_requests(request: Request, call_next):
     try:
         response = await call_next(request)
     except Exception:
-        logger.exception(f"Unhandled exception {request.method} {request.url.path}")
+        logger.exception("Unhandled exception %s %s", request.method, request.url.path)
+        record_error("unhandled")
         raise
     duration = time.time() - start
-    logger.info(f"{request.method} {request.url.path} -> {response.status_code} ({duration:.3f}s) from {request.client.host}")
+    route = request.scope.get("route")
+    REQUEST_LATENCY.labels(
+        request.method, route.path if route else "unmatched", str(response.status_code)
+    ).observe(duration)
+    update_pool_gauges(engine.pool)
+    access_logger.info("request", extra={
+        "method": request.method, "path": request.url.path, "status": response.status_code,
+        "duration_ms": round(duration * 1000, 2), "client": request.client.host if request.client else None,
+    })
     return response
 
+# Pure ASGI: with profiling off it adds one call per request and nothing else
+app.add_middleware(ProfilingMiddleware)
+
+# Outermost: /livez and /readyz are answered before any other middleware runs
+app.add_middleware(ProbeMiddleware)
+
 # ────────────── EXCEPTION HANDLERS ─────────
 @app.exception_handler(RateLimitExceeded)
 def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    record_error("rate_limit")
     return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded. Try again later."})
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    logger.warning(f"HTTPException for {request.method} {request.url.path}: {exc.detail}")
+    logger.warning("HTTPException for %s %s: %s", request.method, request.url.path, exc.detail)
     return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
-    logger.exception(f"Unhandled exception for {request.method} {request.url.path}")
+    logger.exception("Unhandled exception for %s %s", request.method, request.url.path)
+    record_error("unhandled")
     return JSONResponse(status_code=500, content={"detail": "Internal server error — check server logs for details."})
 
-# ────────────── STARTUP ──────────────
-@app.on_event("startup")
-def startup_event():
-    logger.info("Starting Afya Jamii AI startup sequence...")
-    try:
-        create_db_and_tables()
-        logger.info("Database tables created/verified.")
-    except Exception:
-        logger.exception("Database initialization failed")
-        raise RuntimeError("Database initialization failed")
-
-    try:
-        if not initialize_model():
-            raise RuntimeError("initialize_model returned falsy")
-        logger.info("ML model loaded.")
-    except Exception:
-        logger.exception("ML model initialization failed")
-        raise RuntimeError("ML model init failed")
-
-    try:
-        if initialize_llm_service():
-            logger.info("LLM service initialized.")
-        else:
-            logger.warning("LLM initialization returned falsy — running reduced LLM mode")
-    except Exception:
-        logger.exception("LLM initialization raised exception; continuing in limited mode")
-    logger.info("Afya Jamii startup complete.")
-
 # ────────────── HELPERS ──────────────
 def safe_json(obj):
     """Convert numpy objects to native python types for JSON."""
@@ -147,17 +221,26 @@ async def root():
 @app.get("/health")
 @limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
 async def health_check(request: Request):
+    ready, _ = health_prober.readiness()
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else "degraded",
         "timestamp": datetime.utcnow().isoformat(),
         "version": "1.0.0",
-        "services": {
-            "database": "connected",
-            "ml_model": bool(getattr(risk_model, "model", None)),
-            "llm_service": bool(getattr(afya_llm, "llm", None))
-        }
+        "services": health_prober.services(),
     }
 
+@app.get("/health/details", include_in_schema=False, dependencies=[Depends(require_internal)])
+async def health_details():
+    return {
+        **health_prober.details(),
+        "admission": admission.snapshot(),
+    }
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_internal)])
+async def metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 # ------------ Auth ------------
 @app.post("/api/v1/auth/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 @limiter.limit("10/minute")
@@ -168,7 +251,8 @@ async def signup(request: Request, user_data: UserCreate, session: Session = Dep
     if existing:
         raise HTTPException(status_code=400, detail="Username or email already registered")
 
-    hashed_pw = get_password_hash(user_data.password)
+    # bcrypt takes ~0.3 s of CPU; in a thread it does not hold up the event loop
+    hashed_pw = await run_in_threadpool(get_password_hash, user_data.password)
     db_user = UserDB(**user_data.dict(exclude={"password"}), hashed_password=hashed_pw)
     session.add(db_user)
     session.commit()
@@ -179,7 +263,7 @@ async def signup(request: Request, user_data: UserCreate, session: Session = Dep
 @app.post("/api/v1/auth/login", response_model=Token)
 @limiter.limit("5/minute")
 async def login(request: Request, login_data: UserLogin, session: Session = Depends(get_session)):
-    user = authenticate_user(session, login_data.username, login_data.password)
+    user = await run_in_threadpool(authenticate_user, session, login_data.username, login_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     token = create_access_token(data={"sub": user.username})
@@ -189,6 +273,7 @@ async def login(request: Request, login_data: UserLogin, session: Session = Depe
 
 # ------------ Vitals submission ------------
 @app.post("/api/v1/vitals/submit", response_model=CombinedResponse)
+@limiter.shared_limit(llm_user_limits, scope="llm", key_func=get_user_or_remote_address)
 async def submit_vitals(
     request: Request,
     submission: VitalsSubmission,
@@ -206,18 +291,28 @@ async def submit_vitals(
     }
 
     try:
-        risk_label, prob, feat_imp = risk_model.predict(features)
-
-        vitals_record = VitalsRecord(
-            user_id=current_user.id,
-            **submission.vitals.dict(),
-            ml_risk_label=str(risk_label),
-            ml_probability=float(prob),
-            ml_feature_importances=json.dumps(safe_json(feat_imp))
+        with observe_stage("model_inference"):
+            if inference_client.enabled:
+                risk_label, prob, feat_imp = await inference_client.predict(features)
+            else:
+                risk_label, prob, feat_imp = risk_model.predict(features)
+
+        with observe_stage("db_insert"):
+            vitals_record = VitalsRecord(
+                user_id=current_user.id,
+                **submission.vitals.dict(),
+                ml_risk_label=str(risk_label),
+                ml_probability=float(prob),
+                **importance_columns(safe_json(feat_imp))
+            )
+            session.add(vitals_record)
+            trend = update_trend(session, vitals_record)
+            session.commit()
+            session.refresh(vitals_record)
+        background_tasks.add_task(
+            record_submission, vitals_record.created_at, current_user.account_type,
+            str(risk_label), float(prob)
         )
-        session.add(vitals_record)
-        session.commit()
-        session.refresh(vitals_record)
 
         ml_output = MLModelOutput(
             risk_label=str(risk_label),
@@ -236,6 +331,7 @@ Patient Data:
 - Model Prediction: {str(risk_label)} (Probability: {float(prob):.2f})
 - Feature Importances: {safe_json(feat_imp)}
 - Patient History: {submission.vitals.patient_history or "No history"}
+- Recent Trend: {describe_trend(trend)}
 """
         llm_prompt_data = {
             "context": context,
@@ -244,21 +340,28 @@ Patient Data:
         }
 
         try:
-            advice = afya_llm.generate_advice(llm_prompt_data)
+            # In a thread: a slow upstream must not stall the event loop for other routes
+            advice = await run_in_threadpool(
+                budgeted_advice, current_user.id, llm_prompt_data, plan_for(current_user.id),
+                assessment=f"Your latest check shows {risk_label} ({float(prob):.0%})."
+            )
         except Exception:
             logger.exception("LLM generate_advice failed - continuing without LLM")
+            record_error("llm")
             advice = "LLM currently unavailable; please consult a clinician."
 
         llm_advice = LLMAdviceResponse(advice=advice, timestamp=datetime.utcnow())
-
-        convo = ConversationHistory(
-            user_id=current_user.id,
-            vitals_record_id=vitals_record.id,
-            user_message="Initial assessment request",
-            ai_response=advice
-        )
-        session.add(convo)
-        session.commit()
+        chat_sessions.note_vitals(current_user.id, vitals_record.id, describe_trend(trend))
+        chat_sessions.note_turn(current_user.id, "Initial assessment request", advice)
+
+        with observe_stage("db_insert"):
+            convo = ConversationHistory(
+                user_id=current_user.id,
+                vitals_record_id=vitals_record.id,
+                user_message="Initial assessment request",
+                ai_response=advice
+            )
+            await write_behind.save(session, convo)
 
         return CombinedResponse(
             user_id=current_user.id,
@@ -269,10 +372,12 @@ Patient Data:
         )
     except Exception:
         logger.exception("Vitals submission failed")
+        record_error("vitals_submit")
         raise HTTPException(status_code=500, detail="Vitals submission failed - see server logs")
 
 # ------------ LLM Chat Endpoint ------------
 @app.post("/api/v1/chat/advice", response_model=LLMAdviceResponse)
+@limiter.shared_limit(llm_user_limits, scope="llm", key_func=get_user_or_remote_address)
 async def get_llm_advice(
     request: Request,
     advice_request: LLMAdviceRequest,
@@ -280,28 +385,22 @@ async def get_llm_advice(
     session: Session = Depends(get_session)
 ):
     """Let user ask follow-up questions."""
-    # Fetch conversation history
-    history_records = session.exec(
-        select(ConversationHistory)
-        .where(ConversationHistory.user_id == current_user.id)
-        .order_by(ConversationHistory.created_at.asc())
-    ).all()
-
-    # Format history for the prompt
-    history = "\n".join(
-        [f"User: {rec.user_message}\nAI: {rec.ai_response}" for rec in history_records]
-    )
+    plan = plan_for(current_user.id)
+    # Latest turns plus the older turns and notes most relevant to the question
+    history = prompt_history(session, current_user.id, advice_request.question, plan.history_turns)
 
     llm_prompt_data = {
-        "context": "The user is asking a follow-up question.",
+        "context": "The user is asking a follow-up question.\n"
+                   f"Recent Trend: {describe_trend(get_trend(session, current_user.id))}",
         "history": history,
         "question": advice_request.question
     }
 
     try:
-        advice = afya_llm.generate_advice(llm_prompt_data)
+        advice = await run_in_threadpool(budgeted_advice, current_user.id, llm_prompt_data, plan)
     except Exception:
         logger.exception("LLM advice retrieval failed - continuing without LLM")
+        record_error("llm")
         advice = "LLM currently unavailable; please consult a clinician."
 
     # Get the latest vitals record to associate the conversation
@@ -310,19 +409,27 @@ async def get_llm_advice(
         .order_by(VitalsRecord.created_at.desc()).limit(1)
     ).first()
 
-    convo = ConversationHistory(
-        user_id=current_user.id,
-        vitals_record_id=latest_vitals.id if latest_vitals else None,
-        user_message=advice_request.question,
-        ai_response=advice
-    )
-    session.add(convo)
-    session.commit()
+    with observe_stage("db_insert"):
+        convo = ConversationHistory(
+            user_id=current_user.id,
+            vitals_record_id=latest_vitals.id if latest_vitals else None,
+            user_message=advice_request.question,
+            ai_response=advice
+        )
+        await write_behind.save(session, convo)
+    chat_sessions.note_turn(current_user.id, advice_request.question, advice)
 
     return LLMAdviceResponse(advice=advice, timestamp=datetime.utcnow())
 
+app.add_api_websocket_route("/api/v1/chat/ws", chat_websocket)
+
+@app.get("/api/v1/usage", response_model=LLMUsageResponse)
+async def get_llm_usage(request: Request, current_user: UserDB = Depends(get_current_active_user)):
+    """Today's LLM token usage against the user's daily budget."""
+    return await run_in_threadpool(usage_response, current_user.id)
+
 # ------------ History ------------
-@app.get("/api/v1/history/vitals", response_model=List[VitalsRecord])
+@app.get("/api/v1/history/vitals", response_model=List[VitalsRecordResponse])
 async def get_vitals_history(request: Request, limit: int = 10,
                              current_user: UserDB = Depends(get_current_active_user),
                              session: Session = Depends(get_session)):
@@ -330,14 +437,73 @@ async def get_vitals_history(request: Request, limit: int = 10,
         select(VitalsRecord).where(VitalsRecord.user_id == current_user.id)
         .order_by(VitalsRecord.created_at.desc()).limit(limit)
     ).all()
-    return records
+    return [vitals_response(record) for record in records]
 
 @app.get("/api/v1/history/conversations", response_model=List[ConversationHistory])
 async def get_conversation_history(request: Request, limit: int = 20,
                                    current_user: UserDB = Depends(get_current_active_user),
                                    session: Session = Depends(get_session)):
-    convos = session.exec(
-        select(ConversationHistory).where(ConversationHistory.user_id == current_user.id)
-        .order_by(ConversationHistory.created_at.desc()).limit(limit)
-    ).all()
-    return convos
\ No newline at end of file
+    return read_history(session, current_user.id, limit)
+
+# ------------ Delta sync ------------
+@app.get("/api/v1/sync", response_model=SyncResponse)
+async def sync_changes(request: Request, since: Optional[str] = None, limit: int = 200,
+                       current_user: UserDB = Depends(get_current_active_user),
+                       session: Session = Depends(get_session)):
+    """Vitals and conversations changed after the `since` token.
+
+    The ETag is the token the client is synced up to once it applies this
+    page, so If-None-Match with the last ETag answers 304 when nothing changed
+    after `since` either; a client re-fetching an older page gets the rows.
+    """
+    try:
+        since_seq = parse_token(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+    latest = current_seq(session, current_user.id)
+    if since_seq >= latest and request.headers.get("if-none-match") == etag_for(latest):
+        return Response(status_code=304, headers={"ETag": etag_for(latest)})
+
+    delta = changes_since(session, current_user.id, since_seq, limit, latest)
+    return JSONResponse(
+        content=jsonable_encoder(delta),
+        headers={"ETag": etag_for(int(delta.next_token)), "Cache-Control": "private, no-cache"},
+    )
+
+# ------------ Trends ------------
+@app.get("/api/v1/trends", response_model=RiskTrendResponse)
+async def get_risk_trend(request: Request,
+                         current_user: UserDB = Depends(get_current_active_user),
+                         session: Session = Depends(get_session)):
+    return trend_response(current_user.id, get_trend(session, current_user.id))
+
+# ------------ Analytics (supervisors) ------------
+@app.get("/api/v1/analytics/risk-distribution", response_model=RiskDistributionResponse)
+async def get_risk_distribution(request: Request, granularity: str = "day",
+                                start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                account_type: Optional[AccountType] = None,
+                                supervisor: UserDB = Depends(get_current_supervisor)):
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    end = end or datetime.utcnow()
+    start = bucket_start(start or end - timedelta(days=30), granularity)
+    buckets = query_distribution(granularity, start, end, account_type)
+    return RiskDistributionResponse(granularity=granularity, start=start, end=end, buckets=buckets)
+
+@app.get("/api/v1/export/{dataset}")
+def export_dataset(dataset: str, format: str = "csv",
+                   start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   account_type: Optional[AccountType] = None,
+                   supervisor: UserDB = Depends(get_current_supervisor)):
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset; use one of {', '.join(DATASETS)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    media_type, extension = FORMATS[format]
+    logger.info("Export of %s (%s) requested by %s", dataset, format, supervisor.username)
+    return StreamingResponse(
+        export_stream(dataset, format, start=start, end=end, account_type=account_type),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{extension}"'},
+    )
@@ -0,0 +1,166 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from app.profiling import stage_timings
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# With PROMETHEUS_MULTIPROC_DIR set (e.g. under gunicorn) every worker writes its
+# samples to mmap'd files in that directory and /metrics aggregates all of them.
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+REQUEST_LATENCY = Histogram(
+    "afya_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "afya_stage_duration_seconds",
+    "Latency of individual request stages",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+ERRORS = Counter(
+    "afya_errors_total",
+    "Errors by source",
+    ["source"],
+)
+LLM_TOKENS = Counter(
+    "afya_llm_tokens_total",
+    "LLM tokens consumed",
+    ["kind"],
+)
+LLM_BACKEND_CALLS = Counter(
+    "afya_llm_backend_calls_total",
+    "LLM backend calls by outcome (ok, error, hedge, last_resort)",
+    ["backend", "outcome"],
+)
+LLM_BACKEND_LATENCY = Histogram(
+    "afya_llm_backend_duration_seconds",
+    "LLM backend call latency",
+    ["backend"],
+    buckets=LATENCY_BUCKETS,
+)
+WRITE_BEHIND_ROWS = Counter(
+    "afya_write_behind_rows_total",
+    "Rows written by the write-behind buffer (flushed in a batch, direct when full, failed)",
+    ["outcome"],
+)
+WRITE_BEHIND_FLUSH = Histogram(
+    "afya_write_behind_flush_seconds",
+    "Time to insert and commit one write-behind batch",
+    buckets=LATENCY_BUCKETS,
+)
+LOG_RECORDS = Counter(
+    "afya_log_records_total",
+    "Log records by outcome (queued, sampled_out, dropped when the queue is full)",
+    ["outcome"],
+)
+ADMISSIONS = Counter(
+    "afya_admission_total",
+    "Admission decisions by priority (admitted, queued, rejected_lag, rejected_pool, rejected_capacity)",
+    ["priority", "outcome"],
+)
+LOOP_LAG = Gauge(
+    "afya_event_loop_lag_seconds",
+    "Event-loop lag seen by the admission controller (highest worker)",
+    multiprocess_mode="max",
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "afya_db_pool_checked_out",
+    "Database connections currently checked out",
+    multiprocess_mode="livesum",
+)
+DB_POOL_SIZE = Gauge(
+    "afya_db_pool_size",
+    "Configured database pool size",
+    multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "afya_db_pool_overflow",
+    "Database connections opened beyond the pool size",
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Time the enclosed block into the per-stage latency histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        timings = stage_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def record_error(source: str):
+    ERRORS.labels(source).inc()
+
+
+def record_llm_tokens(prompt_tokens: int, completion_tokens: int):
+    if prompt_tokens:
+        LLM_TOKENS.labels("prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels("completion").inc(completion_tokens)
+
+
+def record_llm_backend(backend: str, outcome: str, seconds: Optional[float] = None):
+    LLM_BACKEND_CALLS.labels(backend, outcome).inc()
+    if seconds is not None:
+        LLM_BACKEND_LATENCY.labels(backend).observe(seconds)
+
+
+def record_write_behind(outcome: str, rows: int, seconds: Optional[float] = None):
+    WRITE_BEHIND_ROWS.labels(outcome).inc(rows)
+    if seconds is not None:
+        WRITE_BEHIND_FLUSH.observe(seconds)
+
+
+def record_log(outcome: str):
+    LOG_RECORDS.labels(outcome).inc()
+
+
+def record_admission(priority: str, outcome: str):
+    ADMISSIONS.labels(priority, outcome).inc()
+
+
+def update_pool_gauges(pool):
+    """Refresh pool gauges from a SQLAlchemy QueuePool (cheap attribute reads)."""
+    try:
+        DB_POOL_CHECKED_OUT.set(pool.checkedout())
+        DB_POOL_SIZE.set(pool.size())
+        DB_POOL_OVERFLOW.set(max(pool.overflow(), 0))
+    except AttributeError:
+        # Non-queue pools (e.g. SQLite's SingletonThreadPool) expose no counters
+        pass
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Return the exposition payload and content type for /metrics."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Drop a dead worker's live gauges; call from the process manager's child_exit hook."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
@@ -1,14 +1,34 @@
 import pickle
-import joblib
 import numpy as np
-from typing import Dict, Any, Tuple
-import xgboost as xgb
+from typing import Dict, Any, List, Tuple
 from app.config import settings
 import logging
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+RISK_THRESHOLD = 0.5
+
+def deviation_importances(features: Dict[str, float]) -> Dict[str, float]:
+    """Simplified importance based on deviation from normal ranges, for models without feature_importances_"""
+    normal_ranges = {
+        'Age': 30, 'SystolicBP': 120, 'DiastolicBP': 80, 
+        'BS': 5.5, 'BodyTemp': 37.0, 'HeartRate': 70
+    }
+    
+    importances = {}
+    for feature, value in features.items():
+        normal_value = normal_ranges.get(feature)
+        if normal_value:
+            deviation = abs(value - normal_value) / normal_value
+            importances[feature] = min(deviation, 1.0)  # Cap at 1.0
+    
+    # Normalize to sum to 1
+    total = sum(importances.values())
+    if total > 0:
+        importances = {k: v/total for k, v in importances.items()}
+    return importances
+
 class RiskPredictionModel:
     def __init__(self):
         self.model = None
@@ -21,13 +41,14 @@ class RiskPredictionModel:
         try:
             model_file = Path(model_path)
             if not model_file.exists():
-                logger.error(f"Model file not found: {model_path}")
+                logger.error("Model file not found: %s", model_path)
                 return False
             
             if model_path.endswith('.pkl'):
                 with open(model_path, 'rb') as f:
                     self.model = pickle.load(f)
             elif model_path.endswith('.joblib'):
+                import joblib  # only needed for .joblib artifacts
                 self.model = joblib.load(model_path)
             else:
                 logger.error("Unsupported model format. Use .pkl or .joblib")
@@ -42,11 +63,11 @@ class RiskPredictionModel:
             }
             
             self.model_loaded = True
-            logger.info(f"Model loaded successfully from {model_path}")
+            logger.info("Model loaded successfully from %s", model_path)
             return True
             
         except Exception as e:
-            logger.error(f"Error loading model from {model_path}: {str(e)}")
+            logger.error("Error loading model from %s: %s", model_path, str(e))
             self.model_loaded = False
             return False
     
@@ -70,19 +91,37 @@ class RiskPredictionModel:
                 probability = float(raw_pred)
             
             # Determine risk label with threshold
-            risk_threshold = 0.5
-            risk_label = "high risk" if probability >= risk_threshold else "low risk"
+            risk_label = "high risk" if probability >= RISK_THRESHOLD else "low risk"
             
             # Calculate feature importances
             feature_importances = self._calculate_feature_importance(features, probability)
             
-            logger.debug(f"Prediction completed - Risk: {risk_label}, Probability: {probability:.3f}")
+            logger.debug("Prediction completed - Risk: %s, Probability: %.3f", risk_label, probability)
             return risk_label, probability, feature_importances
             
         except Exception as e:
-            logger.error(f"Error during prediction: {str(e)}")
+            logger.error("Error during prediction: %s", str(e))
             raise Exception(f"Prediction failed: {str(e)}")
     
+    def predict_batch(self, feature_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized predict for an (n, 6) array in feature_names order; returns (labels, probabilities)"""
+        if not self.model_loaded or not self.model:
+            raise Exception("Model not loaded. Call load_model() first.")
+
+        if hasattr(self.model, 'predict_proba'):
+            probabilities = self.model.predict_proba(feature_array)[:, 1]
+        else:
+            probabilities = np.asarray(self.model.predict(feature_array), dtype=float)
+        labels = np.where(probabilities >= RISK_THRESHOLD, "high risk", "low risk")
+        return labels, probabilities
+
+    def feature_importances_batch(self, feature_array: np.ndarray) -> List[Dict[str, float]]:
+        """Per-row feature importances for predict_batch input, computed as predict does"""
+        if hasattr(self.model, 'feature_importances_'):
+            shared = dict(zip(self.feature_names, (float(v) for v in self.model.feature_importances_)))
+            return [shared] * len(feature_array)
+        return [deviation_importances(dict(zip(self.feature_names, row))) for row in feature_array.tolist()]
+    
     def _calculate_feature_importance(self, features: Dict[str, float], probability: float) -> Dict[str, float]:
         """Calculate feature importance scores"""
         try:
@@ -90,28 +129,12 @@ class RiskPredictionModel:
             if hasattr(self.model, 'feature_importances_'):
                 importances = dict(zip(self.feature_names, self.model.feature_importances_))
             else:
-                # Fallback: simplified importance based on deviation from normal ranges
-                normal_ranges = {
-                    'Age': 30, 'SystolicBP': 120, 'DiastolicBP': 80, 
-                    'BS': 5.5, 'BodyTemp': 37.0, 'HeartRate': 70
-                }
-                
-                importances = {}
-                for feature, value in features.items():
-                    normal_value = normal_ranges.get(feature)
-                    if normal_value:
-                        deviation = abs(value - normal_value) / normal_value
-                        importances[feature] = min(deviation, 1.0)  # Cap at 1.0
-                
-                # Normalize to sum to 1
-                total = sum(importances.values())
-                if total > 0:
-                    importances = {k: v/total for k, v in importances.items()}
+                importances = deviation_importances(features)
             
             return importances
             
         except Exception as e:
-            logger.warning(f"Feature importance calculation failed: {e}")
+            logger.warning("Feature importance calculation failed: %s", e)
             return {feature: 0.0 for feature in self.feature_names}
     
     def get_model_info(self) -> Dict[str, Any]:
@@ -120,7 +143,7 @@ class RiskPredictionModel:
             'loaded': self.model_loaded,
             'metadata': self.model_metadata,
             'feature_names': self.feature_names,
-            'risk_threshold': 0.5
+            'risk_threshold': RISK_THRESHOLD
         }
     
     def validate_features(self, features: Dict[str, float]) -> bool:
@@ -129,38 +152,38 @@ class RiskPredictionModel:
             # Check all required features are present
             for feature in self.feature_names:
                 if feature not in features:
-                    logger.error(f"Missing feature: {feature}")
+                    logger.error("Missing feature: %s", feature)
                     return False
             
             # Validate feature ranges
             if not (15 <= features['Age'] <= 50):
-                logger.error(f"Age out of range: {features['Age']}")
+                logger.error("Age out of range: %s", features['Age'])
                 return False
             
             if not (70 <= features['SystolicBP'] <= 200):
-                logger.error(f"SystolicBP out of range: {features['SystolicBP']}")
+                logger.error("SystolicBP out of range: %s", features['SystolicBP'])
                 return False
             
             if not (40 <= features['DiastolicBP'] <= 130):
-                logger.error(f"DiastolicBP out of range: {features['DiastolicBP']}")
+                logger.error("DiastolicBP out of range: %s", features['DiastolicBP'])
                 return False
             
             if not (3.0 <= features['BS'] <= 30.0):
-                logger.error(f"BS out of range: {features['BS']}")
+                logger.error("BS out of range: %s", features['BS'])
                 return False
             
             if not (35.0 <= features['BodyTemp'] <= 42.0):
-                logger.error(f"BodyTemp out of range: {features['BodyTemp']}")
+                logger.error("BodyTemp out of range: %s", features['BodyTemp'])
                 return False
             
             if not (40 <= features['HeartRate'] <= 150):
-                logger.error(f"HeartRate out of range: {features['HeartRate']}")
+                logger.error("HeartRate out of range: %s", features['HeartRate'])
                 return False
             
             return True
             
         except Exception as e:
-            logger.error(f"Feature validation error: {e}")
+            logger.error("Feature validation error: %s", e)
             return False
 
 # Global model instance
@@ -176,5 +199,5 @@ def initialize_model() -> bool:
             logger.error("ML model initialization failed")
         return success
     except Exception as e:
-        logger.error(f"ML model initialization error: {e}")
+        logger.error("ML model initialization error: %s", e)
         return False
\ No newline at end of file
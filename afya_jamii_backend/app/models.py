@@ -1,7 +1,9 @@
 from typing import Optional, List, Dict, Any, Union
-from pydantic import BaseModel, Field, validator
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field, validator
+from datetime import date, datetime
 from enum import Enum
+from sqlalchemy import BigInteger, Column, Index, LargeBinary, SmallInteger
+from sqlalchemy.dialects.mysql import BINARY, LONGBLOB
 from sqlmodel import SQLModel, Field as SQLField
 
 class AccountType(str, Enum):
@@ -95,7 +97,8 @@ class UserDB(SQLModel, table=True):
 
 class VitalsRecord(SQLModel, table=True):
     __tablename__ = "vitals_records"
-    
+    __table_args__ = (Index("ix_vitals_records_user_change_seq", "user_id", "change_seq"),)
+
     id: Optional[int] = SQLField(default=None, primary_key=True)
     user_id: int = SQLField(foreign_key="users.id")
     age: int
@@ -108,15 +111,213 @@ class VitalsRecord(SQLModel, table=True):
     patient_history: Optional[str] = SQLField(default=None, max_length=1000)
     ml_risk_label: str
     ml_probability: float
-    ml_feature_importances: Optional[str] = SQLField(default=None)  # JSON string
+    ml_feature_importances: Optional[str] = SQLField(default=None)  # legacy JSON string, see app.importances
+    ml_feature_schema: Optional[int] = SQLField(default=None, sa_column=Column(SmallInteger))
+    ml_importances: Optional[bytes] = SQLField(
+        default=None, sa_column=Column(LargeBinary(24).with_variant(BINARY(24), "mysql"))
+    )  # float32 x 6, layout given by ml_feature_schema
     created_at: datetime = SQLField(default_factory=datetime.utcnow)
+    change_seq: Optional[int] = SQLField(default=None, sa_column=Column(BigInteger))  # see app.sync
+
+class VitalsRecordResponse(BaseModel):
+    id: int
+    user_id: int
+    age: int
+    systolic_bp: int
+    diastolic_bp: int
+    bs: float
+    body_temp: float
+    body_temp_unit: str
+    heart_rate: int
+    patient_history: Optional[str] = None
+    ml_risk_label: str
+    ml_probability: float
+    ml_feature_importances: Optional[Dict[str, float]] = None
+    created_at: datetime
+    change_seq: Optional[int] = None
 
 class ConversationHistory(SQLModel, table=True):
     __tablename__ = "conversation_history"
-    
+    __table_args__ = (Index("ix_conversation_history_user_change_seq", "user_id", "change_seq"),)
+
     id: Optional[int] = SQLField(default=None, primary_key=True)
     user_id: int = SQLField(foreign_key="users.id")
     vitals_record_id: Optional[int] = SQLField(foreign_key="vitals_records.id", default=None)
     user_message: str = SQLField(max_length=500)
     ai_response: str
-    created_at: datetime = SQLField(default_factory=datetime.utcnow)
\ No newline at end of file
+    created_at: datetime = SQLField(default_factory=datetime.utcnow)
+    change_seq: Optional[int] = SQLField(default=None, sa_column=Column(BigInteger))  # see app.sync
+
+
+class UserRiskTrend(SQLModel, table=True):
+    """Exponentially weighted running statistics of a user's vitals, updated per submission."""
+    __tablename__ = "user_risk_trends"
+
+    user_id: int = SQLField(foreign_key="users.id", primary_key=True)
+    submissions: int = SQLField(default=0)
+    first_at: Optional[datetime] = None
+    last_at: Optional[datetime] = None
+    last_risk_label: Optional[str] = SQLField(default=None, max_length=50)
+
+    # Weighted regression sums, re-centred so the latest submission is t=0 (days)
+    w_sum: float = 0.0
+    t_sum: float = 0.0
+    tt_sum: float = 0.0
+    systolic_bp_sum: float = 0.0
+    systolic_bp_t_sum: float = 0.0
+    systolic_bp_last: float = 0.0
+    diastolic_bp_sum: float = 0.0
+    diastolic_bp_t_sum: float = 0.0
+    diastolic_bp_last: float = 0.0
+    bs_sum: float = 0.0
+    bs_t_sum: float = 0.0
+    bs_last: float = 0.0
+    ml_probability_sum: float = 0.0
+    ml_probability_t_sum: float = 0.0
+    ml_probability_last: float = 0.0
+
+    recent_probabilities: Optional[str] = SQLField(default=None, max_length=2000)  # JSON list
+
+class MetricTrend(BaseModel):
+    latest: float
+    ewma: float
+    slope_per_day: Optional[float] = None
+
+class RiskPoint(BaseModel):
+    timestamp: datetime
+    probability: float
+    risk_label: str
+
+class RiskTrendResponse(BaseModel):
+    user_id: int
+    submissions: int
+    first_at: Optional[datetime] = None
+    last_at: Optional[datetime] = None
+    half_life_days: float
+    systolic_bp: Optional[MetricTrend] = None
+    diastolic_bp: Optional[MetricTrend] = None
+    bs: Optional[MetricTrend] = None
+    risk_probability: Optional[MetricTrend] = None
+    trajectory: List[RiskPoint] = []
+
+class RiskRollup(SQLModel, table=True):
+    """Pre-aggregated submissions per time bucket, account type and risk label (see app.analytics)."""
+    __tablename__ = "risk_rollups"
+
+    granularity: str = SQLField(primary_key=True, max_length=8)  # hour | day
+    bucket_start: datetime = SQLField(primary_key=True)
+    account_type: str = SQLField(primary_key=True, max_length=20)
+    risk_label: str = SQLField(primary_key=True, max_length=50)
+    count: int = 0
+    probability_sum: float = 0.0
+    # Probability histogram: p00 counts [0, 0.05), ..., p19 counts [0.95, 1]
+    p00: int = 0
+    p01: int = 0
+    p02: int = 0
+    p03: int = 0
+    p04: int = 0
+    p05: int = 0
+    p06: int = 0
+    p07: int = 0
+    p08: int = 0
+    p09: int = 0
+    p10: int = 0
+    p11: int = 0
+    p12: int = 0
+    p13: int = 0
+    p14: int = 0
+    p15: int = 0
+    p16: int = 0
+    p17: int = 0
+    p18: int = 0
+    p19: int = 0
+
+class RiskRollupBucket(BaseModel):
+    bucket_start: datetime
+    account_type: AccountType
+    total: int
+    by_label: Dict[str, int]
+    mean_probability: float
+    p50_probability: float
+    p90_probability: float
+    p99_probability: float
+
+class RiskDistributionResponse(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    buckets: List[RiskRollupBucket]
+
+class VitalsRescore(SQLModel, table=True):
+    """Score of a historical VitalsRecord under another model version (batch re-scoring)."""
+    __tablename__ = "vitals_rescores"
+    model_config = ConfigDict(protected_namespaces=())  # allows the model_version field
+
+    vitals_record_id: int = SQLField(foreign_key="vitals_records.id", primary_key=True)
+    model_version: str = SQLField(primary_key=True, max_length=100)
+    risk_label: str = SQLField(max_length=50)
+    probability: float
+    previous_label: str = SQLField(max_length=50)
+    previous_probability: float
+    scored_at: datetime = SQLField(default_factory=datetime.utcnow)
+
+class ConversationArchive(SQLModel, table=True):
+    """Cold tier of conversation_history: a compressed block of consecutive turns of one user."""
+    __tablename__ = "conversation_history_archive"
+
+    id: Optional[int] = SQLField(default=None, primary_key=True)
+    user_id: int = SQLField(foreign_key="users.id", index=True)
+    first_turn_id: int
+    last_turn_id: int
+    first_at: datetime
+    last_at: datetime
+    turns: int
+    codec: str = SQLField(default="zlib", max_length=10)
+    raw_size: int  # bytes of the turns' text before compression
+    payload: bytes = SQLField(sa_column=Column(LargeBinary().with_variant(LONGBLOB, "mysql"), nullable=False))
+
+class UserSyncState(SQLModel, table=True):
+    """Per-user change counter behind the delta sync API."""
+    __tablename__ = "user_sync_state"
+
+    user_id: int = SQLField(foreign_key="users.id", primary_key=True)
+    change_seq: int = SQLField(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+
+class SyncResponse(BaseModel):
+    vitals: List[VitalsRecordResponse]
+    conversations: List[ConversationHistory]
+    next_token: str
+    has_more: bool
+
+class IdempotencyRecord(SQLModel, table=True):
+    """Stored outcome of a request sent with an Idempotency-Key header."""
+    __tablename__ = "idempotency_keys"
+
+    key_hash: str = SQLField(primary_key=True, max_length=64)  # sha256 of principal, path and key
+    request_hash: str = SQLField(max_length=64)  # sha256 of the request body
+    status: str = SQLField(default="in_progress", max_length=12)  # in_progress | done
+    status_code: Optional[int] = None
+    content_type: Optional[str] = SQLField(default=None, max_length=100)
+    body: Optional[bytes] = SQLField(default=None, sa_column=Column(LargeBinary().with_variant(LONGBLOB, "mysql")))
+    claimed_at: datetime = SQLField(default_factory=datetime.utcnow)
+    expires_at: datetime = SQLField(index=True)
+
+class LLMUsageDaily(SQLModel, table=True):
+    """LLM calls and tokens per user per day (UTC), incremented after every call."""
+    __tablename__ = "llm_usage_daily"
+
+    user_id: int = SQLField(foreign_key="users.id", primary_key=True)
+    day: date = SQLField(primary_key=True)
+    requests: int = SQLField(default=0)
+    prompt_tokens: int = SQLField(default=0)
+    completion_tokens: int = SQLField(default=0)
+    degraded_requests: int = SQLField(default=0)  # answered with a reduced or templated reply
+
+class LLMUsageResponse(BaseModel):
+    day: date
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    token_budget: int
+    remaining_tokens: int
+    mode: str
@@ -0,0 +1,136 @@
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile-Token"
+
+# Stage timings of the request being profiled; None when profiling is off so
+# observe_stage pays only a ContextVar lookup.
+stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+class StackSampler:
+    """Samples one thread's Python stack on an interval and folds it into collapsed stacks.
+
+    Sampling the event-loop thread is loop-wide: the stacks include every
+    request the loop ran during the profile, not just the profiled one, and
+    miss work the request hands to the threadpool. ``stage_timings`` are the
+    request's own.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="afya-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def should_profile(request: Request) -> bool:
+    """Profile when the admin header carries the configured token, or on a random sample."""
+    token = request.headers.get(PROFILE_HEADER)
+    if token and settings.PROFILING_ADMIN_TOKEN:
+        return secrets.compare_digest(token, settings.PROFILING_ADMIN_TOKEN)
+    return settings.PROFILING_ENABLED and random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def write_profile(sampler: StackSampler, meta: dict):
+    """Write <name>.folded (collapsed stacks for flamegraph.pl/speedscope) and <name>.json metadata.
+
+    The metadata's ``scope`` says what the stacks cover; see StackSampler.
+    """
+    try:
+        os.makedirs(settings.PROFILING_OUTPUT_DIR, exist_ok=True)
+        route = re.sub(r"[^A-Za-z0-9]+", "_", meta["route"]).strip("_") or "root"
+        name = f"{int(meta['started_at'] * 1000)}_{route}_{os.getpid()}_{secrets.token_hex(4)}"
+        base = os.path.join(settings.PROFILING_OUTPUT_DIR, name)
+        with open(base + ".folded", "w") as f:
+            f.write(sampler.collapsed())
+        with open(base + ".json", "w") as f:
+            json.dump(meta, f, indent=2)
+        logger.info("Wrote request profile %s.folded", base)
+    except Exception as e:
+        logger.warning("Could not write request profile: %s", e)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests ``should_profile`` picks.
+
+    With neither PROFILING_ENABLED nor PROFILING_ADMIN_TOKEN set, requests
+    pass straight through: no Request object, task or stream wrapper.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not (settings.PROFILING_ENABLED or settings.PROFILING_ADMIN_TOKEN)
+                or not should_profile(Request(scope))):
+            await self.app(scope, receive, send)
+            return
+
+        status = {}
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        timings = {}
+        token = stage_timings.set(timings)
+        sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL_MS / 1000)
+        started_at = time.time()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            sampler.stop()
+            stage_timings.reset(token)
+        route = scope.get("route")
+        await run_in_threadpool(write_profile, sampler, {
+            "method": scope["method"],
+            "route": route.path if route else scope["path"],
+            "status": status.get("code"),
+            "started_at": started_at,
+            "duration": time.time() - started_at,
+            "stage_timings": timings,
+            "samples": sum(sampler.stacks.values()),
+            "interval_ms": settings.PROFILING_INTERVAL_MS,
+            "scope": "event loop thread: stacks include all requests in flight, not threadpool work",
+        })
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from fastapi import Request
+from jose import JWTError, jwt
+from limits.storage import Storage
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(Storage):
+    """Fixed-window counters in a local SQLite file shared by all workers on one host.
+
+    Selected with ``RATE_LIMIT_STORAGE_URI=sqlite:////path/to/file``; every
+    hit is a single atomic UPSERT so no cross-process locking is needed.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+        # Same layout as SQLAlchemy URLs: sqlite:///relative.db or sqlite:////abs/path.db
+        self.path = (uri or "sqlite:///:memory:")[len("sqlite:///"):]
+        self._local = threading.local()
+        self._inherited = []  # connections opened before a fork; kept open, never used
+        self._hits = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, value INTEGER NOT NULL, expiry REAL NOT NULL)"
+        )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid != os.getpid():
+            # Opened by the parent before a fork (gunicorn preload). SQLite locks are per
+            # process, so the child must neither use nor close it.
+            self._inherited.append(conn)
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        now = time.time()
+        row = self._conn().execute(
+            "INSERT INTO rate_limits (key, value, expiry) VALUES (?1, ?2, ?3 + ?4) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN expiry <= ?3 THEN ?2 ELSE value + ?2 END, "
+            "expiry = CASE WHEN expiry <= ?3 THEN ?3 + ?4 ELSE expiry END "
+            "RETURNING value",
+            (key, amount, now, expiry),
+        ).fetchone()
+        self._hits += 1
+        if self._hits % self.CLEANUP_EVERY == 0:
+            self._conn().execute("DELETE FROM rate_limits WHERE expiry <= ?", (now,))
+        return row[0]
+
+    def get(self, key: str) -> int:
+        row = self._conn().execute(
+            "SELECT value FROM rate_limits WHERE key = ? AND expiry > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._conn().execute(
+            "SELECT expiry FROM rate_limits WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self._conn().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        return self._conn().execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        self._conn().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+
+def get_user_or_remote_address(request: Request) -> str:
+    """Rate limit key: the JWT subject when a valid bearer token is present, else client IP."""
+    auth = request.headers.get("authorization", "")
+    if auth[:7].lower() == "bearer ":
+        try:
+            payload = jwt.decode(auth[7:], settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+    return get_remote_address(request)
+
+
+# Global limiter instance
+limiter = Limiter(
+    key_func=get_remote_address,
+    enabled=settings.RATE_LIMIT_ENABLED,
+    storage_uri=settings.RATE_LIMIT_STORAGE_URI,
+    in_memory_fallback_enabled=True,
+)
+
+# Per-user quotas shared by all endpoints that call the LLM
+llm_user_limits = (
+    f"{settings.LLM_RATE_LIMIT_PER_MINUTE}/minute;"
+    f"{settings.MAX_REQUESTS_PER_USER}/day"
+)
@@ -0,0 +1,250 @@
+"""Batch re-scoring of historical vitals with a (new) risk model.
+
+Reads vitals_records by keyset pagination (``id > last id ... LIMIT
+chunk size``), so memory is bounded by the chunk size. Each chunk is
+scored with the vectorized ``RiskPredictionModel.predict_batch`` in a
+process pool, and the results go to ``vitals_rescores`` (default) or back
+onto vitals_records (``--write-back``). Progress is checkpointed
+after every written chunk, so an interrupted run resumes where it stopped.
+
+Write-back replaces the label, probability and feature importances of each
+record, and once every chunk is written it rebuilds what is derived from
+them: the analytics rollups (``app.analytics``) and the per-user risk
+trends (``app.trends``). Run it in a quiet period, as those rebuilds
+require::
+
+    python -m app.rescore --model-path ./data/risk_model_v2.pkl --workers 4
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter, deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlmodel import SQLModel
+
+from app.analytics import rebuild_rollups
+from app.config import settings
+from app.database import engine
+from app.importances import importance_columns
+from app.ml_model import RiskPredictionModel
+from app.models import VitalsRecord, VitalsRescore
+from app.sync import reserve_change_seqs
+from app.trends import rebuild_all_trends
+import logging
+
+logger = logging.getLogger(__name__)
+
+FEATURE_COLUMNS = ["age", "systolic_bp", "diastolic_bp", "bs", "body_temp", "heart_rate"]
+
+
+class Chunk(NamedTuple):
+    ids: np.ndarray
+    user_ids: np.ndarray
+    features: np.ndarray
+    previous_labels: list
+    previous_probabilities: np.ndarray
+
+
+# ─────────── worker process ───────────
+_worker_model: Optional[RiskPredictionModel] = None
+
+
+def _init_worker(model_path: str):
+    global _worker_model
+    _worker_model = RiskPredictionModel()
+    if not _worker_model.load_model(model_path):
+        raise RuntimeError(f"Could not load model from {model_path}")
+
+
+def _score(features: np.ndarray, with_importances: bool = False):
+    labels, probabilities = _worker_model.predict_batch(features)
+    importances = _worker_model.feature_importances_batch(features) if with_importances else None
+    return labels.tolist(), probabilities.astype(float), importances
+
+
+# ─────────── reading ───────────
+def iter_chunks(start_after: int, max_id: int, chunk_size: int) -> Iterator[Chunk]:
+    """Yield chunks of at most chunk_size rows with start_after < id <= max_id, in id order."""
+    v = VitalsRecord.__table__.c
+    columns = [v.id, *(v[name] for name in FEATURE_COLUMNS), v.ml_risk_label, v.ml_probability, v.user_id]
+    last_id = start_after
+    while last_id < max_id:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(*columns).where(v.id > last_id, v.id <= max_id).order_by(v.id).limit(chunk_size)
+            ).fetchall()
+        if not rows:
+            return
+        yield Chunk(
+            ids=np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+            user_ids=np.fromiter((r[9] for r in rows), dtype=np.int64, count=len(rows)),
+            features=np.array([r[1:7] for r in rows], dtype=np.float64),
+            previous_labels=[r[7] for r in rows],
+            previous_probabilities=np.fromiter((r[8] for r in rows), dtype=np.float64, count=len(rows)),
+        )
+        last_id = int(rows[-1][0])
+
+
+# ─────────── writing ───────────
+def write_side_table(chunk: Chunk, labels, probabilities, model_version: str):
+    now = datetime.utcnow()
+    rows = [
+        {
+            "vitals_record_id": int(record_id),
+            "model_version": model_version,
+            "risk_label": label,
+            "probability": float(probability),
+            "previous_label": previous_label,
+            "previous_probability": float(previous_probability),
+            "scored_at": now,
+        }
+        for record_id, label, probability, previous_label, previous_probability in zip(
+            chunk.ids, labels, probabilities, chunk.previous_labels, chunk.previous_probabilities
+        )
+    ]
+    table = VitalsRescore.__table__
+    with engine.begin() as conn:
+        # Delete first so re-running a chunk after a crash stays idempotent
+        conn.execute(delete(table).where(
+            table.c.model_version == model_version,
+            table.c.vitals_record_id.between(int(chunk.ids[0]), int(chunk.ids[-1])),
+        ))
+        conn.execute(insert(table), rows)
+
+
+def write_back(chunk: Chunk, labels, probabilities, importances):
+    table = VitalsRecord.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("record_id"))
+        .values(ml_risk_label=bindparam("label"), ml_probability=bindparam("probability"),
+                ml_feature_schema=bindparam("schema_id"), ml_importances=bindparam("blob"),
+                ml_feature_importances=bindparam("legacy"), change_seq=bindparam("seq"))
+    )
+    with engine.begin() as conn:
+        # Changed rows get new sequence numbers so delta sync clients pick them up
+        next_seq = {}
+        for user_id, count in Counter(chunk.user_ids.tolist()).items():
+            next_seq[user_id] = reserve_change_seqs(conn, user_id, count)
+        params = []
+        for i, u, l, p, imp in zip(chunk.ids, chunk.user_ids.tolist(), labels, probabilities, importances):
+            # The old model's importances must not outlive its label
+            columns = importance_columns(imp)
+            params.append({
+                "record_id": int(i), "label": l, "probability": float(p), "seq": next_seq[u],
+                "schema_id": columns.get("ml_feature_schema"), "blob": columns.get("ml_importances"),
+                "legacy": columns.get("ml_feature_importances"),
+            })
+            next_seq[u] += 1
+        conn.execute(statement, params)
+
+
+# ─────────── checkpoint ───────────
+def load_checkpoint(path: Path, model_version: str) -> dict:
+    if path.exists():
+        state = json.loads(path.read_text())
+        if state.get("model_version") == model_version:
+            return state
+        logger.warning("Ignoring checkpoint %s for model version %s", path, state.get('model_version'))
+    return {"model_version": model_version, "last_id": 0, "rows": 0, "label_changes": 0}
+
+
+def save_checkpoint(path: Path, state: dict):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, path)
+
+
+# ─────────── driver ───────────
+def rescore(model_path: str, model_version: str, chunk_size: int, workers: int,
+            write_back_records: bool, checkpoint_path: Path) -> dict:
+    state = load_checkpoint(checkpoint_path, model_version)
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(VitalsRecord.id))).scalar() or 0
+    logger.info("Re-scoring vitals_records ids %s..%s with %s", state['last_id'] + 1, max_id, model_version)
+
+    def flush(chunk: Chunk, labels, probabilities, importances):
+        if write_back_records:
+            write_back(chunk, labels, probabilities, importances)
+        else:
+            write_side_table(chunk, labels, probabilities, model_version)
+        state["last_id"] = int(chunk.ids[-1])
+        state["rows"] += len(chunk.ids)
+        state["label_changes"] += sum(a != b for a, b in zip(labels, chunk.previous_labels))
+        save_checkpoint(checkpoint_path, state)
+
+    start, rows_at_start = time.perf_counter(), state["rows"]
+
+    def report():
+        elapsed = time.perf_counter() - start
+        rate = (state["rows"] - rows_at_start) / elapsed if elapsed else 0.0
+        logger.info("%s rows scored through id %s (%.0f rows/s)", state['rows'], state['last_id'], rate)
+        return rate
+
+    chunks = iter_chunks(state["last_id"], max_id, chunk_size)
+    if workers <= 0:
+        _init_worker(model_path)
+        for chunk in chunks:
+            flush(chunk, *_score(chunk.features, write_back_records))
+            report()
+    else:
+        # At most 2 chunks per worker in flight keeps memory bounded
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, pool.submit(_score, chunk.features, write_back_records)))
+                while len(pending) >= 2 * workers:
+                    done_chunk, future = pending.popleft()
+                    flush(done_chunk, *future.result())
+                    report()
+            while pending:
+                done_chunk, future = pending.popleft()
+                flush(done_chunk, *future.result())
+                report()
+
+    if write_back_records:
+        # Rollups and trends were computed from the old labels and probabilities
+        state["rollup_rows_rebuilt"] = rebuild_rollups()
+        state["trends_rebuilt"] = rebuild_all_trends()
+
+    elapsed = time.perf_counter() - start
+    return {
+        **state,
+        "elapsed_s": elapsed,
+        "rows_per_s": (state["rows"] - rows_at_start) / elapsed if elapsed else 0.0,
+        "target": "vitals_records" if write_back_records else VitalsRescore.__tablename__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-path", default=settings.MODEL_PATH)
+    parser.add_argument("--model-version", help="defaults to the model file name")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="scoring processes; 0 scores in this process")
+    parser.add_argument("--write-back", action="store_true",
+                        help="overwrite ml_risk_label/ml_probability/importances instead of writing "
+                             "vitals_rescores, then rebuild risk rollups and trends")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: rescore-<version>.json)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    model_version = args.model_version or Path(args.model_path).stem
+    checkpoint = Path(args.checkpoint or f"rescore-{model_version}.json")
+    SQLModel.metadata.create_all(engine, tables=[VitalsRescore.__table__])
+    summary = rescore(
+        args.model_path, model_version, args.chunk_size, args.workers, args.write_back, checkpoint
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Per-user BM25 retrieval over past conversation turns and vitals notes.
+
+Chat prompts no longer carry the user's whole recent history. They carry the
+RETRIEVAL_RECENT_TURNS latest turns, for continuity, plus the
+RETRIEVAL_TOP_K older turns and ``patient_history`` notes that best match
+the question. Ranking is Okapi BM25 over lowercase word tokens. It runs
+offline; there is no embedding service.
+
+Each worker keeps an inverted index per user, for at most
+RETRIEVAL_MAX_USERS users (least recently used are dropped) and
+RETRIEVAL_MAX_DOCS documents per user (oldest are dropped). Memory therefore
+stays bounded however long a history gets. The index holds term statistics
+and row ids only; the texts of the k hits are read back by primary key.
+
+An index is built on first use from the user's newest rows. After that it
+is brought up to date before each search from rows whose ``change_seq``
+(see app.sync) is above the last one it saw. Each new row is tokenized
+once, whichever worker wrote it. Turns moved to the archive stay in an
+index that already has them, but are not loaded into new ones.
+"""
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlmodel import Session, select
+
+from app.config import settings
+from app.models import ConversationHistory, VitalsRecord
+import logging
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+QUESTION_WEIGHT = 2  # a term in the user's question counts twice as much as one in the reply
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a about after all also am an and any are as at be been but by can could did do does for from had has have
+he her his how i if in into is it its just me my no not of on or our she should so some than that the
+their them then there these they this to too was we were what when where which who why will with would
+you your na ya wa kwa ni la za katika hii hiyo kama au lakini pia sana
+""".split())
+
+DocKey = Tuple[str, int]  # ("turn", ConversationHistory.id) or ("note", VitalsRecord.id)
+
+
+def _normalize(token: str) -> str:
+    # Plural "s" only ("headaches" finds "headache"); anything more needs a real stemmer
+    return token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+
+
+def tokenize(text: str) -> List[str]:
+    return [_normalize(t) for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+class UserIndex:
+    """Inverted index of one user's documents, newest RETRIEVAL_MAX_DOCS kept."""
+
+    def __init__(self, max_docs: int):
+        self.max_docs = max_docs
+        self.docs: "OrderedDict[DocKey, Tuple[int, Tuple[str, ...]]]" = OrderedDict()  # key -> (length, terms)
+        self.postings: Dict[str, Dict[DocKey, int]] = {}
+        self.total_length = 0
+        self.turn_seq = 0
+        self.note_seq = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def add(self, key: DocKey, tokens: List[str]):
+        if key in self.docs or not tokens:
+            return
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[key] = tf
+        self.docs[key] = (len(tokens), tuple(counts))
+        self.total_length += len(tokens)
+        while len(self.docs) > self.max_docs:
+            self._evict()
+
+    def _evict(self):
+        key, (length, terms) = self.docs.popitem(last=False)
+        self.total_length -= length
+        for term in terms:
+            posting = self.postings[term]
+            del posting[key]
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query: str, k: int) -> List[Tuple[DocKey, float]]:
+        if not self.docs or k <= 0:
+            return []
+        n = len(self.docs)
+        average_length = self.total_length / n
+        scores: Dict[DocKey, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for key, tf in posting.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.docs[key][0] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def _turn_tokens(question: str, answer: str) -> List[str]:
+    return tokenize(question) * QUESTION_WEIGHT + tokenize(answer)
+
+
+class ConversationIndex:
+    def __init__(self):
+        self._users: "OrderedDict[int, UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user_index(self, user_id: int) -> UserIndex:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+                return index
+            index = self._users[user_id] = UserIndex(settings.RETRIEVAL_MAX_DOCS)
+            while len(self._users) > settings.RETRIEVAL_MAX_USERS:
+                self._users.popitem(last=False)
+            return index
+
+    def _load(self, session: Session, user_id: int, index: UserIndex):
+        initial = not index.loaded
+        c, v = ConversationHistory, VitalsRecord
+        turns = select(c.id, c.user_message, c.ai_response, c.change_seq).where(c.user_id == user_id)
+        notes = select(v.id, v.patient_history, v.change_seq).where(
+            v.user_id == user_id, v.patient_history.is_not(None), v.patient_history != ""
+        )
+        if initial:
+            # Newest rows by id, so rows written before change_seq existed are included
+            turns = turns.order_by(c.id.desc()).limit(index.max_docs)
+            notes = notes.order_by(v.id.desc()).limit(index.max_docs)
+        else:
+            turns = turns.where(c.change_seq > index.turn_seq).order_by(c.change_seq)
+            notes = notes.where(v.change_seq > index.note_seq).order_by(v.change_seq)
+        turn_rows = session.exec(turns).all()
+        note_rows = session.exec(notes).all()
+        if initial:
+            turn_rows, note_rows = turn_rows[::-1], note_rows[::-1]
+        for row_id, question, answer, seq in turn_rows:
+            index.add(("turn", row_id), _turn_tokens(question, answer))
+            index.turn_seq = max(index.turn_seq, seq or 0)
+        for row_id, note, seq in note_rows:
+            index.add(("note", row_id), tokenize(note))
+            index.note_seq = max(index.note_seq, seq or 0)
+        index.loaded = True
+
+    def search(self, session: Session, user_id: int, question: str, k: int) -> List[Tuple[DocKey, float]]:
+        index = self._user_index(user_id)
+        with index.lock:
+            self._load(session, user_id, index)
+            return index.search(question, k)
+
+
+conversation_index = ConversationIndex()
+
+
+def _format_turns(turns: Sequence[Tuple[str, str]]) -> str:
+    return "\n".join(f"User: {question}\nAI: {answer}" for question, answer in turns)
+
+
+def recent_turns(session: Session, user_id: int, turns: int) -> List[Tuple[str, str]]:
+    """The user's latest turns, oldest first."""
+    if turns <= 0:
+        return []
+    records = session.exec(
+        select(ConversationHistory.user_message, ConversationHistory.ai_response)
+        .where(ConversationHistory.user_id == user_id)
+        # Walks the (user_id, change_seq) index, whose entries end in the primary key,
+        # instead of sorting the user's rows; id orders rows not yet numbered by app.sync
+        .order_by(ConversationHistory.change_seq.desc(), ConversationHistory.id.desc())
+        .limit(turns)
+    ).all()
+    return [(question, answer) for question, answer in reversed(records)]
+
+
+def _fetch(session: Session, keys: List[DocKey]) -> Dict[DocKey, tuple]:
+    """(created_at, question, answer) per turn and (created_at, note) per note, by key."""
+    c, v = ConversationHistory, VitalsRecord
+    turn_ids = [row_id for kind, row_id in keys if kind == "turn"]
+    note_ids = [row_id for kind, row_id in keys if kind == "note"]
+    rows: Dict[DocKey, tuple] = {}
+    if turn_ids:
+        for row_id, *row in session.exec(
+                select(c.id, c.created_at, c.user_message, c.ai_response).where(c.id.in_(turn_ids))):
+            rows[("turn", row_id)] = tuple(row)
+    if note_ids:
+        for row_id, *row in session.exec(select(v.id, v.created_at, v.patient_history).where(v.id.in_(note_ids))):
+            rows[("note", row_id)] = tuple(row)
+    return rows
+
+
+def prompt_history(session: Session, user_id: int, question: str, turns: int,
+                   recent: Optional[List[Tuple[str, str]]] = None) -> str:
+    """The history block for a chat prompt of at most ``turns`` turns.
+
+    ``recent`` is the caller's copy of the latest turns, oldest first (the
+    WebSocket session keeps them in memory); they are read from the
+    database otherwise.
+    """
+    if not settings.RETRIEVAL_ENABLED:
+        if recent is None:
+            recent = recent_turns(session, user_id, turns)
+        return _format_turns(recent[-turns:] if turns else [])
+    keep = min(settings.RETRIEVAL_RECENT_TURNS, turns)
+    if recent is None:
+        recent = recent_turns(session, user_id, keep)
+    recent = recent[-keep:] if keep else []
+    k = min(settings.RETRIEVAL_TOP_K, turns - len(recent))
+    if k <= 0:
+        return _format_turns(recent)
+
+    try:
+        hits = conversation_index.search(session, user_id, question, k + len(recent))
+        rows = _fetch(session, [key for key, _ in hits])
+    except Exception:
+        logger.exception("Conversation retrieval failed for user %s", user_id)
+        return _format_turns(recent)
+
+    # Best matches first, skipping what the recent turns already carry; shown oldest first
+    seen = set(recent)
+    chosen = []
+    for key, _ in hits:
+        row = rows.get(key)
+        if row is None or (key[0] == "turn" and row[1:] in seen):
+            continue
+        chosen.append((key, row))
+        if len(chosen) == k:
+            break
+    chosen.sort(key=lambda item: item[1][0])
+
+    parts = []
+    notes = [row for (kind, _), row in chosen if kind == "note"]
+    if notes:
+        parts.append("Relevant patient notes:\n" + "\n".join(
+            f"- ({created_at:%Y-%m-%d}) {note}" for created_at, note in notes))
+    earlier = [row[1:] for (kind, _), row in chosen if kind == "turn"]
+    if earlier:
+        parts.append("Relevant earlier turns:\n" + _format_turns(earlier))
+    if recent:
+        parts.append("Most recent turns:\n" + _format_turns(recent))
+    return "\n\n".join(parts)
@@ -0,0 +1,215 @@
+"""Production launcher: gunicorn with uvicorn workers, a preloaded app and tuned pools.
+
+    python -m app.serve                  # workers and pools from CPUs and DB_CONNECTION_BUDGET
+    python -m app.serve --print-plan     # show the computed settings and exit
+
+The master imports ``app.main`` and runs ``preload()`` (model and LLM
+client) once. Workers are forked from it and share those pages.
+
+Workers default to one per available CPU, counting CPU affinity and a cgroup
+CPU quota. DB_CONNECTION_BUDGET, the connections all workers on this host may
+hold together, is split evenly between them. Each worker gets two thirds of
+its share as DB_POOL_SIZE and the rest as DB_MAX_OVERFLOW. If the budget
+cannot give every worker two connections, fewer workers are started.
+
+Shutdown and recycling:
+
+- On SIGTERM a worker first keeps serving for SERVER_DRAIN_SECONDS while
+  ``/readyz`` answers 503, so the load balancer can take it out of rotation.
+- It then stops accepting connections and gives in-flight requests, such as
+  LLM calls, up to SERVER_GRACEFUL_TIMEOUT to finish.
+- A worker is replaced after SERVER_MAX_REQUESTS requests (with jitter), or
+  when its resident memory passes SERVER_MAX_RSS_MB. A replaced worker skips
+  the ``/readyz`` phase, since the load balancer sees the host and the other
+  workers keep serving: it stops accepting connections at once and gives
+  in-flight requests up to SERVER_GRACEFUL_TIMEOUT, as above.
+
+uvicorn's access log is off: ``log_requests`` already writes one structured
+record per request.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+from typing import NamedTuple, Optional
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.arbiter import Arbiter
+from uvicorn.main import Server
+from uvicorn_worker import UvicornWorker
+
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+MIN_CONNECTIONS_PER_WORKER = 2
+RSS_CHECK_TICKS = 100  # uvicorn ticks every 0.1 s
+
+
+class ServePlan(NamedTuple):
+    cpus: int
+    workers: int
+    pool_size: int
+    max_overflow: int
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def plan_workers(cpus: int, budget: int, workers: Optional[int] = None) -> ServePlan:
+    workers = workers or settings.SERVER_WORKERS or cpus
+    workers = max(1, min(workers, budget // MIN_CONNECTIONS_PER_WORKER))
+    per_worker = max(budget // workers, MIN_CONNECTIONS_PER_WORKER)
+    pool_size = max(1, per_worker * 2 // 3)
+    return ServePlan(cpus, workers, pool_size, per_worker - pool_size)
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # No /proc (macOS): the peak is the best available figure, in KiB there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ─────────── worker ───────────
+class DrainingServer(Server):
+    def handle_exit(self, sig, frame):
+        from app.health import health_prober
+
+        if sig == signal.SIGTERM and settings.SERVER_DRAIN_SECONDS > 0 and not health_prober.draining:
+            health_prober.draining = True
+            logger.info("Worker %s draining for %ss", os.getpid(), settings.SERVER_DRAIN_SECONDS)
+            timer = threading.Timer(settings.SERVER_DRAIN_SECONDS, super().handle_exit, (sig, frame))
+            timer.daemon = True
+            timer.start()
+            return
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter: int) -> bool:
+        if await super().on_tick(counter):
+            return True
+        if settings.SERVER_MAX_RSS_MB and counter % RSS_CHECK_TICKS == 0 and rss_mb() > settings.SERVER_MAX_RSS_MB:
+            logger.warning("Worker %s at %.0f MB RSS, above SERVER_MAX_RSS_MB=%s; recycling",
+                           os.getpid(), rss_mb(), settings.SERVER_MAX_RSS_MB)
+            return True
+        return False
+
+
+class AfyaUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {"loop": "auto", "http": "auto", "access_log": False}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config.timeout_graceful_shutdown = int(settings.SERVER_GRACEFUL_TIMEOUT)
+
+    async def _serve(self):
+        # UvicornWorker._serve, with DrainingServer in place of Server
+        self.config.app = self.wsgi
+        server = DrainingServer(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+
+# ─────────── master ───────────
+def _post_fork(server, worker):
+    from app.database import engine
+
+    # Connections opened by the master must not be shared with the worker. The rate
+    # limit storage (app.rate_limit) opens its own SQLite connection per process.
+    engine.dispose(close=False)
+
+
+def _child_exit(server, worker):
+    from app.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
+
+
+class AfyaApplication(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app, preload
+
+        preload()
+        return app
+
+
+def _prometheus_dir():
+    """Workers need one shared multiprocess directory, emptied of a previous run's files."""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="afya-prometheus-")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API under gunicorn")
+    parser.add_argument("--bind", default=f"{settings.HOST}:{settings.PORT}")
+    parser.add_argument("--workers", type=int, help="overrides SERVER_WORKERS and the CPU count")
+    parser.add_argument("--print-plan", action="store_true", help="print the computed settings and exit")
+    args = parser.parse_args(argv)
+
+    plan = plan_workers(available_cpus(), settings.DB_CONNECTION_BUDGET, args.workers)
+    if args.print_plan:
+        print(json.dumps(plan._asdict()))
+        return
+
+    # Before app.database is imported, so every worker's engine gets its share
+    settings.DB_POOL_SIZE = plan.pool_size
+    settings.DB_MAX_OVERFLOW = plan.max_overflow
+    _prometheus_dir()
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Serving on %s: %s workers for %s CPUs, DB pool %s+%s per worker",
+                args.bind, plan.workers, plan.cpus, plan.pool_size, plan.max_overflow)
+
+    AfyaApplication({
+        "bind": args.bind,
+        "workers": plan.workers,
+        "worker_class": "app.serve.AfyaUvicornWorker",
+        "preload_app": True,
+        "graceful_timeout": math.ceil(settings.SERVER_DRAIN_SECONDS + settings.SERVER_GRACEFUL_TIMEOUT) + 5,
+        "timeout": max(30, int(settings.LLM_TIMEOUT_SECONDS * 2)),
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "max_requests": settings.SERVER_MAX_REQUESTS,
+        "max_requests_jitter": settings.SERVER_MAX_REQUESTS_JITTER,
+        "post_fork": _post_fork,
+        "child_exit": _child_exit,
+        "accesslog": None,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Delta sync for offline-first clients.
+
+Every insert or update of a VitalsRecord or ConversationHistory row takes
+the next value of its user's counter in ``user_sync_state`` and stores it
+in ``change_seq``. The counter row stays locked until the transaction
+commits, so a user's changes become visible in sequence order. A client
+that has seen everything up to N can therefore ask for ``change_seq > N``
+without missing a row that commits late.
+
+Sync tokens are decimal sequence numbers. Treat them as opaque. Rows
+written before this table existed are numbered once with::
+
+    python -m app.sync backfill
+"""
+import argparse
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from app.database import create_db_and_tables, engine
+from app.importances import vitals_response
+from app.models import ConversationHistory, SyncResponse, UserSyncState, VitalsRecord
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYNCED_MODELS = (VitalsRecord, ConversationHistory)
+MAX_SYNC_LIMIT = 500
+
+
+def reserve_change_seqs(conn, user_id: int, count: int = 1) -> int:
+    """Reserve count consecutive sequence numbers for a user; returns the first.
+
+    Must run inside the transaction that writes the rows: the counter row is
+    locked until it commits.
+    """
+    state = UserSyncState.__table__
+    where = state.c.user_id == user_id
+    if not conn.execute(update(state).where(where).values(change_seq=state.c.change_seq + count)).rowcount:
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(state).values(user_id=user_id, change_seq=count))
+        except IntegrityError:
+            # Another writer created the row first
+            conn.execute(update(state).where(where).values(change_seq=state.c.change_seq + count))
+    return conn.execute(select(state.c.change_seq).where(where)).scalar() - count + 1
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _stamp_change_seq(session, flush_context, instances):
+    changed = defaultdict(list)
+    for obj in session.new:
+        if isinstance(obj, SYNCED_MODELS):
+            changed[obj.user_id].append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, SYNCED_MODELS) and session.is_modified(obj):
+            changed[obj.user_id].append(obj)
+    if not changed:
+        return
+    conn = session.connection()
+    for user_id, objs in changed.items():
+        first = reserve_change_seqs(conn, user_id, len(objs))
+        for offset, obj in enumerate(objs):
+            obj.change_seq = first + offset
+
+
+def parse_token(token: Optional[str]) -> int:
+    """Sequence number of a sync token; raises ValueError for malformed tokens."""
+    if not token:
+        return 0
+    seq = int(token)
+    if seq < 0:
+        raise ValueError("negative sync token")
+    return seq
+
+
+def etag_for(seq: int) -> str:
+    return f'W/"{seq}"'
+
+
+def current_seq(session: Session, user_id: int) -> int:
+    state = session.get(UserSyncState, user_id)
+    return state.change_seq if state else 0
+
+
+def changes_since(session: Session, user_id: int, since: int, limit: int, latest: int) -> SyncResponse:
+    """Up to limit changed rows of both tables, in sequence order.
+
+    latest is the user's counter read before the query. On the last page the
+    token jumps to it, which skips sequence numbers of archived turns.
+    """
+    limit = max(1, min(limit, MAX_SYNC_LIMIT))
+    rows: List[Tuple[int, object]] = []
+    for model in SYNCED_MODELS:
+        rows.extend((r.change_seq, r) for r in session.scalars(
+            select(model).where(model.user_id == user_id, model.change_seq > since)
+            .order_by(model.change_seq).limit(limit + 1)
+        ))
+    rows.sort(key=lambda pair: pair[0])
+    page, has_more = rows[:limit], len(rows) > limit
+    return SyncResponse(
+        vitals=[vitals_response(r) for _, r in page if isinstance(r, VitalsRecord)],
+        conversations=[r for _, r in page if isinstance(r, ConversationHistory)],
+        next_token=str(page[-1][0] if has_more else max([latest, since, *(seq for seq, _ in page[-1:])])),
+        has_more=has_more,
+    )
+
+
+def backfill() -> int:
+    """Number rows that have no change_seq yet, per user in created_at order."""
+    numbered = 0
+    with engine.connect() as conn:
+        user_ids = set()
+        for model in SYNCED_MODELS:
+            table = model.__table__
+            user_ids.update(conn.execute(
+                select(table.c.user_id).where(table.c.change_seq.is_(None)).distinct()
+            ).scalars())
+    for user_id in sorted(user_ids):
+        with engine.begin() as conn:
+            pending = []
+            for model in SYNCED_MODELS:
+                table = model.__table__
+                pending.extend((created_at, table, row_id) for row_id, created_at in conn.execute(
+                    select(table.c.id, table.c.created_at)
+                    .where(table.c.user_id == user_id, table.c.change_seq.is_(None))
+                ))
+            pending.sort(key=lambda item: item[0])
+            first = reserve_change_seqs(conn, user_id, len(pending))
+            params = defaultdict(list)
+            for offset, (_, table, row_id) in enumerate(pending):
+                params[table].append({"row_id": row_id, "seq": first + offset})
+            for table, table_params in params.items():
+                conn.execute(
+                    update(table).where(table.c.id == bindparam("row_id")).values(change_seq=bindparam("seq")),
+                    table_params,
+                )
+        numbered += len(pending)
+    logger.info("Assigned change sequence numbers to %s rows of %s users", numbered, len(user_ids))
+    return numbered
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Maintain delta sync sequence numbers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="number rows written before delta sync existed")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    create_db_and_tables()
+    if args.command == "backfill":
+        print(f"Numbered {backfill()} rows")
+
+
+if __name__ == "__main__":
+    main()
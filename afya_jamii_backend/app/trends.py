@@ -0,0 +1,195 @@
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import distinct
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.config import settings
+from app.database import engine
+from app.models import (
+    UserRiskTrend, VitalsRecord, MetricTrend, RiskPoint, RiskTrendResponse
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# VitalsRecord attribute -> name used in the API response
+TREND_METRICS = {
+    "systolic_bp": "systolic_bp",
+    "diastolic_bp": "diastolic_bp",
+    "bs": "bs",
+    "ml_probability": "risk_probability",
+}
+
+# Slopes are only reported once submissions span at least about an hour;
+# bursts of same-minute submissions would otherwise give meaningless rates.
+MIN_SLOPE_SPREAD_DAYS = 1 / 24
+
+
+def _apply(trend: UserRiskTrend, record: VitalsRecord):
+    """Fold one submission into the running sums in O(1).
+
+    Sums are kept relative to the latest submission (t=0, in days), so each
+    update shifts the origin to the new point, decays the old weight by the
+    half-life and adds the new point.
+    """
+    at = record.created_at or datetime.utcnow()
+    if trend.submissions:
+        d = max((at - trend.last_at).total_seconds() / 86400.0, 0.0)
+        decay = 0.5 ** (d / settings.TREND_HALF_LIFE_DAYS)
+        # Shift origin by d: t' = t - d
+        trend.tt_sum = (trend.tt_sum - 2 * d * trend.t_sum + d * d * trend.w_sum) * decay
+        trend.t_sum = (trend.t_sum - d * trend.w_sum) * decay
+        trend.w_sum *= decay
+        for metric in TREND_METRICS:
+            x_sum = getattr(trend, f"{metric}_sum")
+            tx_sum = getattr(trend, f"{metric}_t_sum")
+            setattr(trend, f"{metric}_t_sum", (tx_sum - d * x_sum) * decay)
+            setattr(trend, f"{metric}_sum", x_sum * decay)
+    else:
+        trend.first_at = at
+
+    trend.w_sum += 1.0
+    for metric in TREND_METRICS:
+        value = float(getattr(record, metric))
+        setattr(trend, f"{metric}_sum", getattr(trend, f"{metric}_sum") + value)
+        setattr(trend, f"{metric}_last", value)
+
+    points = json.loads(trend.recent_probabilities) if trend.recent_probabilities else []
+    points.append([at.isoformat(), float(record.ml_probability), record.ml_risk_label])
+    trend.recent_probabilities = json.dumps(points[-settings.TREND_TRAJECTORY_POINTS:])
+
+    trend.submissions += 1
+    trend.last_at = at
+    trend.last_risk_label = record.ml_risk_label
+
+
+def rebuild_trend(session: Session, user_id: int) -> UserRiskTrend:
+    """Recompute a user's trend from the full history (one-off backfill)."""
+    trend = UserRiskTrend(user_id=user_id)
+    records = session.exec(
+        select(VitalsRecord).where(VitalsRecord.user_id == user_id)
+        .order_by(VitalsRecord.created_at.asc())
+    )
+    for record in records:
+        _apply(trend, record)
+    return trend
+
+
+def rebuild_all_trends() -> int:
+    """Recompute every user's stored trend from history (e.g. after re-scoring); returns users rebuilt.
+
+    Like rebuild_rollups, run it in a quiet period: a submission racing a
+    user's rebuild can be lost from that user's trend.
+    """
+    with engine.connect() as conn:
+        user_ids = conn.execute(select(distinct(VitalsRecord.user_id))).scalars().all()
+    for user_id in user_ids:
+        with Session(engine) as session:
+            session.merge(rebuild_trend(session, user_id))
+            session.commit()
+    logger.info("Rebuilt risk trends of %d users", len(user_ids))
+    return len(user_ids)
+
+
+def update_trend(session: Session, record: VitalsRecord) -> UserRiskTrend:
+    """Update the user's trend for a new (added, not yet committed) VitalsRecord.
+
+    Users who predate the trends table are backfilled from history once.
+    """
+    query = select(UserRiskTrend).where(UserRiskTrend.user_id == record.user_id).with_for_update()
+    # No autoflush: a backfill must not see the pending record, which is applied below
+    with session.no_autoflush:
+        trend = session.exec(query).first()
+        if trend is None:
+            backfill = rebuild_trend(session, record.user_id)
+    if trend is None:
+        try:
+            with session.begin_nested():
+                session.add(backfill)
+            trend = backfill
+        except IntegrityError:
+            # A concurrent submission created the row first; wait for it to commit
+            trend = session.exec(query).one()
+    _apply(trend, record)
+    session.add(trend)
+    return trend
+
+
+def _store_backfill(user_id: int) -> UserRiskTrend:
+    """Rebuild and save the trend of a user who predates the trends table.
+
+    A user without submissions gets an empty row, so later reads do not rescan
+    their history; update_trend fills it in on the first submission. Uses its
+    own session, so reads never commit the caller's request session.
+    """
+    with Session(engine, expire_on_commit=False) as session:
+        trend = rebuild_trend(session, user_id)
+        try:
+            session.add(trend)
+            session.commit()
+        except IntegrityError:
+            # A vitals submission stored the row first
+            session.rollback()
+            trend = session.get(UserRiskTrend, user_id)
+    return trend
+
+
+def get_trend(session: Session, user_id: int) -> Optional[UserRiskTrend]:
+    """The user's trend, None without submissions; backfilled and stored on the first read if they predate the trends table."""
+    trend = session.get(UserRiskTrend, user_id)
+    if trend is None:
+        trend = _store_backfill(user_id)
+    return trend if trend.submissions else None
+
+
+def _metric(trend: UserRiskTrend, metric: str) -> MetricTrend:
+    x_sum = getattr(trend, f"{metric}_sum")
+    tx_sum = getattr(trend, f"{metric}_t_sum")
+    slope = None
+    if trend.submissions > 1:
+        spread = trend.tt_sum / trend.w_sum - (trend.t_sum / trend.w_sum) ** 2
+        if spread >= MIN_SLOPE_SPREAD_DAYS ** 2:
+            denom = trend.w_sum * trend.tt_sum - trend.t_sum ** 2
+            slope = (trend.w_sum * tx_sum - trend.t_sum * x_sum) / denom
+    return MetricTrend(
+        latest=getattr(trend, f"{metric}_last"),
+        ewma=x_sum / trend.w_sum if trend.w_sum else 0.0,
+        slope_per_day=slope,
+    )
+
+
+def trend_response(user_id: int, trend: Optional[UserRiskTrend]) -> RiskTrendResponse:
+    if trend is None:
+        return RiskTrendResponse(
+            user_id=user_id, submissions=0, half_life_days=settings.TREND_HALF_LIFE_DAYS
+        )
+    points = json.loads(trend.recent_probabilities) if trend.recent_probabilities else []
+    return RiskTrendResponse(
+        user_id=user_id,
+        submissions=trend.submissions,
+        first_at=trend.first_at,
+        last_at=trend.last_at,
+        half_life_days=settings.TREND_HALF_LIFE_DAYS,
+        trajectory=[RiskPoint(timestamp=t, probability=p, risk_label=l) for t, p, l in points],
+        **{name: _metric(trend, metric) for metric, name in TREND_METRICS.items()},
+    )
+
+
+def describe_trend(trend: Optional[UserRiskTrend]) -> str:
+    """One-paragraph trend summary for the LLM prompt."""
+    if trend is None or trend.submissions < 2:
+        return "No previous submissions to compare against."
+    parts = []
+    for metric, label, unit in (
+        ("systolic_bp", "Systolic BP", "mmHg"),
+        ("diastolic_bp", "Diastolic BP", "mmHg"),
+        ("bs", "Blood Sugar", "mmol/L"),
+        ("ml_probability", "Risk probability", ""),
+    ):
+        m = _metric(trend, metric)
+        slope = f"{m.slope_per_day:+.2f}{unit and ' ' + unit}/day" if m.slope_per_day is not None else "n/a"
+        parts.append(f"{label}: weighted mean {m.ewma:.2f}, trend {slope}")
+    return f"Based on {trend.submissions} submissions since {trend.first_at:%Y-%m-%d}: " + "; ".join(parts)
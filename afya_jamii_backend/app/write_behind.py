@@ -0,0 +1,207 @@
+"""Group commit for non-critical inserts (conversation turns, and later audit or metrics rows).
+
+Rows are queued in memory. A flusher thread writes them as one multi-row
+INSERT per table and commits once per batch. A batch closes after
+WRITE_BEHIND_BATCH_ROWS rows or WRITE_BEHIND_FLUSH_MS milliseconds,
+whichever comes first, so many requests share one commit (and one fsync).
+
+``WRITE_BEHIND_MODE`` selects durability:
+
+- ``off``: each caller adds and commits its own row, as before.
+- ``group``: callers wait until the batch holding their row has committed.
+  The row is as durable as before, just written with fewer commits.
+- ``async``: callers return at once. A crash can lose the rows of the
+  current batch, so only use it for rows that can be lost.
+
+The buffer holds at most WRITE_BEHIND_MAX_ROWS rows. When it is full, a
+caller writes its own row directly; the request pays for its own commit,
+which slows producers down. Rows of synced tables get their change_seq
+here, since Core inserts skip the ORM flush hook. ``close()`` drains the
+buffer on shutdown.
+"""
+import asyncio
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel
+
+from app.config import settings
+from app.database import engine
+from app.metrics import record_error, record_write_behind
+from app.sync import SYNCED_MODELS, reserve_change_seqs
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "group", "async")
+_STOP = object()
+
+PendingRow = Tuple[type, dict, Future]
+
+
+def _row(obj: SQLModel) -> dict:
+    """Column values of a model instance, leaving out an unset autoincrement id."""
+    values = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.name, None)
+        if column.primary_key and column.autoincrement and value is None:
+            continue
+        values[column.name] = value
+    return values
+
+
+class WriteBehindBuffer:
+    def __init__(self, mode: Optional[str] = None):
+        self.mode = mode or settings.WRITE_BEHIND_MODE
+        if self.mode not in MODES:
+            raise ValueError(f"WRITE_BEHIND_MODE must be one of {MODES}, not {self.mode!r}")
+        self._queue: "queue.Queue" = queue.Queue(maxsize=settings.WRITE_BEHIND_MAX_ROWS)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _ensure_thread(self):
+        # Started on first use, so a gunicorn master that preloads the app forks no thread
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+
+    # ---- producers ----
+    def _enqueue(self, model: type, row: dict) -> Optional[Future]:
+        """Queue a row without blocking; None when the buffer is full or closed."""
+        if self._closed:
+            return None
+        self._ensure_thread()
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((model, row, future))
+        except queue.Full:
+            record_write_behind("direct", 1)
+            return None
+        return future
+
+    def _direct(self, model: type, row: dict) -> Future:
+        future: Future = Future()
+        self._write_direct(model, row, future)
+        return future
+
+    def submit(self, obj: SQLModel) -> Future:
+        """Queue a row; the future resolves once it is committed. Writes it directly when full."""
+        model, row = type(obj), _row(obj)
+        future = self._enqueue(model, row)
+        return future if future is not None else self._direct(model, row)
+
+    async def save(self, session: Session, obj: SQLModel):
+        """Persist obj according to WRITE_BEHIND_MODE, from an async endpoint."""
+        if not self.enabled:
+            session.add(obj)
+            session.commit()
+            return
+        model, row = type(obj), _row(obj)
+        future = self._enqueue(model, row)
+        if future is None:
+            # Backpressure: the direct write happens off the event loop
+            future = await run_in_threadpool(self._direct, model, row)
+        if self.mode == "group":
+            await asyncio.wrap_future(future)
+
+    def save_sync(self, obj: SQLModel):
+        """save() for code already running in a worker thread."""
+        if not self.enabled:
+            with Session(engine) as session:
+                session.add(obj)
+                session.commit()
+            return
+        future = self.submit(obj)
+        if self.mode == "group":
+            future.result()
+
+    # ---- flusher ----
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch: List[PendingRow] = [item]
+            deadline = time.monotonic() + settings.WRITE_BEHIND_FLUSH_MS / 1000
+            stop = False
+            while len(batch) < settings.WRITE_BEHIND_BATCH_ROWS:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch: List[PendingRow]):
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                self._insert(conn, batch)
+        except Exception as e:
+            logger.warning("Batch insert of %s rows failed, retrying one by one: %s", len(batch), e)
+            for model, row, future in batch:
+                self._write_direct(model, row, future)
+            return
+        for _, _, future in batch:
+            future.set_result(None)
+        record_write_behind("flushed", len(batch), time.perf_counter() - start)
+
+    @staticmethod
+    def _insert(conn, batch: List[PendingRow]):
+        by_model: Dict[type, List[dict]] = defaultdict(list)
+        for model, row, _ in batch:
+            by_model[model].append(row)
+        for model, rows in by_model.items():
+            if issubclass(model, SYNCED_MODELS):
+                per_user = defaultdict(list)
+                for row in rows:
+                    per_user[row["user_id"]].append(row)
+                for user_id, user_rows in sorted(per_user.items()):  # fixed lock order
+                    first = reserve_change_seqs(conn, user_id, len(user_rows))
+                    for offset, row in enumerate(user_rows):
+                        row["change_seq"] = first + offset
+            conn.execute(insert(model.__table__), rows)
+
+    def _write_direct(self, model: type, row: dict, future: Future):
+        try:
+            with engine.begin() as conn:
+                self._insert(conn, [(model, row, future)])
+            future.set_result(None)
+        except Exception as e:
+            logger.error("Could not write %s row: %s", model.__tablename__, e)
+            record_error("write_behind")
+            record_write_behind("failed", 1)
+            future.set_exception(e)
+
+    def close(self, timeout: float = 30.0):
+        """Flush everything queued and stop the flusher thread."""
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error("Write-behind flusher did not finish within %ss; about %s rows not written",
+                             timeout, self._queue.qsize())
+            self._thread = None
+
+
+write_behind = WriteBehindBuffer()
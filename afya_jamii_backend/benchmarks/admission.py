@@ -0,0 +1,193 @@
+"""Priority admission control under overload: latency of critical routes with it on and off.
+
+    python -m benchmarks.admission --flood 64 --chat-users 24 --duration 20 --output admission.json
+
+Runs the API against a slow stub Groq (``--llm-latency-ms``) twice, with
+ADMISSION_ENABLED off and on, under the same load:
+
+- ``flood``: ``--flood`` tasks reading history, sync and trends (priority
+  ``history``) and running analytics and exports as a supervisor (``bulk``),
+  back to back; a 503 makes the task wait out its Retry-After, as the apps do
+- ``chat``: ``--chat-users`` users asking chat questions back to back; each
+  holds a slow LLM call (``triage``)
+- probes at a fixed rate, the requests that must stay fast: a login every
+  ``--login-interval`` seconds (``auth``) and a vitals submission every
+  ``--submit-interval`` seconds (``vitals``, which includes one LLM call)
+
+Reports per class the status codes seen, latency p50/p95/p99 of successful
+requests, and the Retry-After values sent with 503s. With admission on, the
+flood should mostly get early 503s while login and vitals keep their
+latency; with it off, everything queues behind the flood.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from benchmarks.common import bench_env, emit, summarize, uvicorn_server, workdir
+
+VITALS = {
+    "age": 28, "systolic_bp": 130, "diastolic_bp": 85, "bs": 6.8,
+    "body_temp": 37.1, "body_temp_unit": "celsius", "heart_rate": 82,
+    "patient_history": "Second pregnancy, mild headaches in the evenings",
+}
+PASSWORD = "benchmark-password"
+SUPERVISOR = "bench_supervisor"
+FLOOD_REQUESTS = [
+    ("history", "/api/v1/history/vitals", False),
+    ("history", "/api/v1/history/conversations", False),
+    ("history", "/api/v1/sync", False),
+    ("history", "/api/v1/trends", False),
+    ("bulk", "/api/v1/analytics/risk-distribution", True),
+    ("bulk", "/api/v1/export/vitals", True),
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.retry_after = defaultdict(Counter)
+
+    async def call(self, kind: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.statuses[kind][type(e).__name__] += 1
+            return None
+        self.statuses[kind][str(response.status_code)] += 1
+        if response.status_code == 503:
+            self.retry_after[kind][response.headers.get("retry-after", "missing")] += 1
+        elif response.status_code < 400:
+            self.latencies[kind].append(time.perf_counter() - start)
+        return response
+
+    def report(self) -> dict:
+        return {
+            kind: {
+                "statuses": dict(self.statuses[kind]),
+                "ok": summarize(self.latencies[kind]),
+                "retry_after": dict(self.retry_after[kind]),
+            }
+            for kind in sorted(self.statuses)
+        }
+
+
+async def account(client: httpx.AsyncClient, name: str) -> dict:
+    await client.post("/api/v1/auth/signup", json={
+        "username": name, "email": f"{name}@example.com", "account_type": "pregnant", "password": PASSWORD,
+    })
+    response = await client.post("/api/v1/auth/login", json={"username": name, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def client_for(base_url: str, connections: int) -> httpx.AsyncClient:
+    # One client per class, so the flood cannot take the probes' connections
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    return httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0)
+
+
+async def drive(base_url: str, args) -> dict:
+    rec = Recorder()
+    lags = []
+    async with client_for(base_url, args.flood) as flood_client, \
+            client_for(base_url, args.chat_users) as chat_client, \
+            client_for(base_url, 8) as probe_client:
+        reader = await account(probe_client, "bench_reader")
+        supervisor = await account(probe_client, SUPERVISOR)
+        chatters = [await account(probe_client, f"bench_chat_{i}") for i in range(args.chat_users)]
+        submitter = await account(probe_client, "bench_submitter")
+        deadline = time.perf_counter() + args.duration
+
+        async def flood(offset: int):
+            for kind, path, as_supervisor in itertools.islice(itertools.cycle(FLOOD_REQUESTS), offset, None):
+                if time.perf_counter() >= deadline:
+                    return
+                response = await rec.call(kind, flood_client.get(path, headers=supervisor if as_supervisor else reader))
+                if response is not None and response.status_code == 503:
+                    await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+
+        async def chat(headers: dict):
+            while time.perf_counter() < deadline:
+                await rec.call("triage", chat_client.post(
+                    "/api/v1/chat/advice", headers=headers, json={"question": "Is walking safe?"}))
+
+        async def paced(interval: float, make_request):
+            tasks = []
+            while time.perf_counter() < deadline:
+                tasks.append(asyncio.create_task(make_request()))
+                await asyncio.sleep(interval)
+            await asyncio.gather(*tasks)
+
+        def login():
+            return rec.call("auth", probe_client.post(
+                "/api/v1/auth/login", json={"username": "bench_reader", "password": PASSWORD}))
+
+        async def sample_lag():
+            # afya_event_loop_lag_seconds; /metrics is never shed
+            while time.perf_counter() < deadline:
+                response = await rec.call("metrics", probe_client.get("/metrics"))
+                for line in (response.text.splitlines() if response is not None else ()):
+                    if line.startswith("afya_event_loop_lag_seconds"):
+                        lags.append(float(line.split()[-1]))
+                await asyncio.sleep(0.5)
+
+        def submit():
+            return rec.call("vitals", probe_client.post(
+                "/api/v1/vitals/submit", headers=submitter, json={"vitals": VITALS, "account_type": "pregnant"}))
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(flood(i) for i in range(args.flood)),
+            *(chat(headers) for headers in chatters),
+            paced(args.login_interval, login),
+            paced(args.submit_interval, submit),
+            sample_lag(),
+        )
+        elapsed = time.perf_counter() - start
+        admission = (await probe_client.get("/health/details")).json().get("admission")
+    return {"elapsed_s": elapsed, "loop_lag_ms": summarize(lags), "classes": rec.report(),
+            "admission_after": admission}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flood", type=int, default=64)
+    parser.add_argument("--chat-users", type=int, default=24)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--login-interval", type=float, default=1.0)
+    parser.add_argument("--submit-interval", type=float, default=1.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=3000)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {}
+    with workdir() as tmp:
+        stub_env = bench_env(tmp, STUB_LATENCY_MS=args.llm_latency_ms)
+        with uvicorn_server("benchmarks.stub_groq:app", stub_env, ready_path="/docs") as groq_url:
+            for mode, enabled in (("admission_off", False), ("admission_on", True)):
+                env = bench_env(
+                    tmp, f"sqlite:///{tmp}/{mode}.db", GROQ_API_BASE=groq_url,
+                    LLM_UPSTREAM_RPM=0, LLM_UPSTREAM_TPM=0, ADMISSION_ENABLED=enabled,
+                    SUPERVISOR_USERNAMES=f'["{SUPERVISOR}"]',
+                )
+                with uvicorn_server("app.main:app", env) as api_url:
+                    report[mode] = asyncio.run(drive(api_url, args))
+
+    emit({
+        "benchmark": "admission",
+        "config": {"flood": args.flood, "chat_users": args.chat_users, "duration_s": args.duration,
+                   "login_interval_s": args.login_interval, "submit_interval_s": args.submit_interval,
+                   "llm_latency_ms": args.llm_latency_ms, "cpus": os.cpu_count()},
+        **report,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Storage and history-query latency before and after conversation archival.
+
+    python -m benchmarks.archive --users 50 --turns 400 --hot-days 30 --output archive.json
+
+Seeds ``--users`` users with ``--turns`` turns each, spread over the last
+year, with generated advice-like text. It then times ``read_history`` for a
+recent page and a deep page, archives with ``--hot-days``, and measures
+again. Storage is reported as payload bytes per tier and as database file
+size after VACUUM (SQLite) or data_length + index_length (MySQL).
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import apply_env, bench_env, emit, summarize, workdir
+
+SENTENCES = [
+    "Your blood pressure of {bp} mmHg is {level} for your stage of pregnancy.",
+    "Drink at least eight glasses of water a day and rest on your left side.",
+    "Eat iron-rich foods such as sukuma wiki, beans, liver and omena.",
+    "If you notice swelling of the face or hands, visit the nearest clinic.",
+    "Severe headaches, blurred vision or pain below the ribs need urgent care.",
+    "Attend all antenatal visits and bring your clinic card each time.",
+    "Your blood sugar reading of {bs} mmol/L is {level}; limit sugary drinks.",
+    "Take the folic acid and iron supplements your clinician prescribed.",
+    "Gentle walking for thirty minutes a day helps circulation and mood.",
+    "Call your community health volunteer if the baby moves less than usual.",
+]
+
+
+def advice(rng: random.Random) -> str:
+    parts = rng.sample(SENTENCES, rng.randint(4, 9))
+    return " ".join(
+        s.format(bp=f"{rng.randint(100, 170)}/{rng.randint(60, 110)}",
+                 bs=round(rng.uniform(4, 11), 1),
+                 level=rng.choice(["normal", "slightly high", "high", "low"]))
+        for s in parts
+    )
+
+
+def storage_bytes(engine) -> int:
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("VACUUM"))
+            return os.path.getsize(engine.url.database)
+        return int(conn.execute(text(
+            "SELECT SUM(data_length + index_length) FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name LIKE 'conversation_history%'"
+        )).scalar() or 0)
+
+
+def time_history(engine, user_ids, limit: int, samples: int):
+    from sqlmodel import Session
+    from app.archive import read_history
+    timings = []
+    with Session(engine) as session:
+        for _ in range(samples):
+            user_id = random.choice(user_ids)
+            start = time.perf_counter()
+            read_history(session, user_id, limit)
+            timings.append(time.perf_counter() - start)
+            session.expunge_all()
+    return summarize(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=400, help="turns per user")
+    parser.add_argument("--hot-days", type=int, default=30)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--database-url", help="e.g. a MySQL container; defaults to a temporary SQLite file")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        apply_env(bench_env(tmp, args.database_url))
+        from sqlalchemy import insert
+        from app.archive import archive_conversations, storage_report
+        from app.database import create_db_and_tables, engine
+        from app.models import AccountType, ConversationHistory, UserDB
+
+        create_db_and_tables()
+        rng = random.Random(42)
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(insert(UserDB.__table__), [
+                {"username": f"archive_{i}", "email": f"archive_{i}@example.com",
+                 "account_type": AccountType.PREGNANT, "hashed_password": "x",
+                 "is_active": True, "created_at": now}
+                for i in range(args.users)
+            ])
+            user_ids = list(range(1, args.users + 1))
+            for user_id in user_ids:
+                conn.execute(insert(ConversationHistory.__table__), [
+                    {"user_id": user_id, "user_message": "What should I do about my readings?",
+                     "ai_response": advice(rng),
+                     "created_at": now - timedelta(days=365 * (args.turns - i) / args.turns)}
+                    for i in range(args.turns)
+                ])
+
+        phases = {}
+        for phase in ("before", "after"):
+            if phase == "after":
+                start = time.perf_counter()
+                moved = archive_conversations(args.hot_days)
+                archive_seconds = time.perf_counter() - start
+            phases[phase] = {
+                "tiers": storage_report(),
+                "database_bytes": storage_bytes(engine),
+                "recent_page_20": time_history(engine, user_ids, 20, args.samples),
+                "deep_page_200": time_history(engine, user_ids, 200, args.samples),
+            }
+
+    emit({
+        "benchmark": "archive",
+        "users": args.users, "turns_per_user": args.turns, "hot_days": args.hot_days,
+        "archived_turns": moved, "archive_seconds": archive_seconds,
+        **phases,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""End-to-end check of WebSocket chat through a real uvicorn server.
+
+    python -m benchmarks.chat_ws --questions 5 --output chat_ws.json
+
+Starts the stub Groq server and the API, signs a user up, opens
+``/api/v1/chat/ws`` and walks the protocol: auth -> ready, then
+``--questions`` questions, each streamed as token frames and closed by a
+done frame. Fails with a non-zero exit when the upgrade is refused or a
+frame is missing or out of order (for example when the server has no
+WebSocket library installed). Otherwise prints seconds to ``ready`` and
+per-question time to first token and to ``done``.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+import websockets
+
+from benchmarks.common import bench_env, emit, summarize, uvicorn_server, workdir
+
+QUESTIONS = [
+    "What foods should I eat to manage my blood pressure?",
+    "Is it safe to continue light exercise?",
+    "Ninawezaje kupunguza sukari mwilini?",
+]
+
+
+class ProtocolError(Exception):
+    pass
+
+
+async def _expect(ws, frame_type: str, timeout: float) -> dict:
+    frame = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+    if frame.get("type") != frame_type:
+        raise ProtocolError(f"expected a {frame_type} frame, got {frame}")
+    return frame
+
+
+async def login(base_url: str) -> str:
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        response = await client.post("/api/v1/auth/signup", json={
+            "username": "ws_check", "email": "ws_check@example.com",
+            "account_type": "pregnant", "password": "password123",
+        })
+        response.raise_for_status()
+        response = await client.post("/api/v1/auth/login", json={"username": "ws_check", "password": "password123"})
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+
+async def check(base_url: str, questions: int, timeout: float) -> dict:
+    token = await login(base_url)
+    first_token, done = [], []
+    start = time.perf_counter()
+    async with websockets.connect(base_url.replace("http://", "ws://") + "/api/v1/chat/ws") as ws:
+        await ws.send(json.dumps({"type": "auth", "token": token}))
+        await _expect(ws, "ready", timeout)
+        ready_s = time.perf_counter() - start
+
+        for i in range(questions):
+            request_id = f"q{i}"
+            sent = time.perf_counter()
+            await ws.send(json.dumps({"type": "question", "question": QUESTIONS[i % len(QUESTIONS)], "id": request_id}))
+            streamed = []
+            while True:
+                frame = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+                if frame.get("id") != request_id or frame.get("type") not in ("token", "done"):
+                    raise ProtocolError(f"unexpected frame for {request_id}: {frame}")
+                if frame["type"] == "token":
+                    if not streamed:
+                        first_token.append(time.perf_counter() - sent)
+                    streamed.append(frame["text"])
+                    continue
+                done.append(time.perf_counter() - sent)
+                if not frame.get("advice"):
+                    raise ProtocolError(f"done frame without advice: {frame}")
+                break
+    return {
+        "ready_s": ready_s,
+        "first_token": summarize(first_token),
+        "done": summarize(done),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0, help="longest wait for any one frame (s)")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--workdir", help="keep databases here instead of a temp dir")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir(args.workdir) as tmp:
+        stub_env = bench_env(tmp, STUB_LATENCY_MS=args.llm_latency_ms)
+        with uvicorn_server("benchmarks.stub_groq:app", stub_env, ready_path="/docs") as groq_url:
+            api_env = bench_env(tmp, GROQ_API_BASE=groq_url)
+            with uvicorn_server("app.main:app", api_env) as api_url:
+                try:
+                    results = asyncio.run(check(api_url, args.questions, args.timeout))
+                except (ProtocolError, asyncio.TimeoutError, websockets.WebSocketException, OSError) as e:
+                    raise SystemExit(f"WebSocket chat check failed: {e!r}")
+
+    emit({
+        "benchmark": "chat_ws",
+        "config": {"questions": args.questions, "llm_latency_ms": args.llm_latency_ms},
+        **results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Helpers shared by the benchmark scripts: local environment, servers and stats."""
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def bench_env(workdir: str, database_url: Optional[str] = None, **overrides) -> Dict[str, str]:
+    """Environment for running the API against local stand-ins only."""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url or f"sqlite:///{workdir}/bench.db",
+        "DATABASE_HOST": "127.0.0.1",
+        "DATABASE_PORT": "3306",
+        "DATABASE_NAME": "afya_bench",
+        "DATABASE_USER": "bench",
+        "DB_PASSWORD": "bench",
+        "GROQ_API_KEY": "stub-key",
+        "SECRET_KEY": "benchmark-secret-key",
+        "LOG_LEVEL": "WARNING",
+        "DEBUG": "False",
+        "RATE_LIMIT_ENABLED": "False",
+        "RATE_LIMIT_STORAGE_URI": f"sqlite:///{workdir}/ratelimit.db",
+        "PROMETHEUS_MULTIPROC_DIR": _ensure_dir(f"{workdir}/prometheus"),
+        "PYTHONPATH": str(BACKEND_DIR),
+    })
+    env.update({k: str(v) for k, v in overrides.items()})
+    return env
+
+
+def apply_env(env: Dict[str, str]):
+    """Install bench_env() into this process before importing app modules."""
+    os.environ.update(env)
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _ensure_dir(path: str) -> str:
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    with httpx.Client(timeout=1.0) as client:
+        while time.time() < deadline:
+            try:
+                if client.get(url).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+@contextmanager
+def uvicorn_server(app_path: str, env: Dict[str, str], workers: int = 1, ready_path: str = "/"):
+    """Run ``uvicorn app_path`` in a subprocess and yield its base URL."""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_path, "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(base_url + ready_path)
+        yield base_url
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+@contextmanager
+def workdir(path: Optional[str] = None):
+    if path:
+        yield _ensure_dir(path)
+    else:
+        with tempfile.TemporaryDirectory(prefix="afya-bench-") as tmp:
+            yield tmp
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int = 0, elapsed: Optional[float] = None) -> dict:
+    """Latency summary in milliseconds, plus throughput when ``elapsed`` is given."""
+    values = sorted(latencies)
+    total = len(values) + errors
+    summary = {
+        "count": len(values),
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+    if elapsed:
+        summary["throughput_rps"] = total / elapsed
+    return summary
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def emit(report: dict, output: Optional[str]):
+    """Write the JSON report to ``output`` (or stdout)."""
+    report.setdefault("revision", git_revision())
+    report.setdefault("python", sys.version.split()[0])
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text + "\n")
+    else:
+        print(text)
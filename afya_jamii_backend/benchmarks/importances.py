@@ -0,0 +1,136 @@
+"""Row size and history decode cost of JSON vs. packed float32 feature importances.
+
+    python -m benchmarks.importances --rows 20000 --output importances.json
+
+Seeds ``--rows`` vitals records with importances in the legacy JSON column
+and measures the history path (load a page, decode, serialize the response).
+It then runs the ``app.importances`` migration and measures again. Also
+reports per-value encode/decode cost and stored bytes per row.
+"""
+import argparse
+import json
+import os
+import random
+import time
+import timeit
+from datetime import datetime, timedelta
+
+from benchmarks.common import apply_env, bench_env, emit, summarize, workdir
+
+
+def random_importances(rng: random.Random) -> dict:
+    import numpy as np
+    values = np.array([rng.random() for _ in range(6)], dtype=np.float32)
+    values /= values.sum()
+    return dict(zip(("Age", "SystolicBP", "DiastolicBP", "BS", "BodyTemp", "HeartRate"), values.tolist()))
+
+
+def time_history_page(engine, user_ids, limit: int, samples: int):
+    from pydantic import TypeAdapter
+    from sqlmodel import Session, select
+    from typing import List
+    from app.importances import vitals_response
+    from app.models import VitalsRecord, VitalsRecordResponse
+
+    adapter = TypeAdapter(List[VitalsRecordResponse])
+    timings = []
+    with Session(engine) as session:
+        for _ in range(samples):
+            user_id = random.choice(user_ids)
+            start = time.perf_counter()
+            records = session.exec(
+                select(VitalsRecord).where(VitalsRecord.user_id == user_id)
+                .order_by(VitalsRecord.created_at.desc()).limit(limit)
+            ).all()
+            adapter.dump_json([vitals_response(r) for r in records])
+            timings.append(time.perf_counter() - start)
+            session.expunge_all()
+    return summarize(timings)
+
+
+def column_bytes(engine) -> dict:
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        json_bytes, blob_bytes, rows = conn.execute(text(
+            "SELECT COALESCE(SUM(LENGTH(ml_feature_importances)), 0), "
+            "COALESCE(SUM(LENGTH(ml_importances)) + 2 * COUNT(ml_feature_schema), 0), COUNT(*) "
+            "FROM vitals_records"
+        )).one()
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("VACUUM"))
+            file_bytes = os.path.getsize(engine.url.database)
+        else:
+            file_bytes = conn.execute(text(
+                "SELECT data_length + index_length FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = 'vitals_records'"
+            )).scalar()
+    return {
+        "importance_bytes_per_row": (json_bytes + blob_bytes) / rows if rows else 0,
+        "database_bytes": int(file_bytes or 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=100, help="history page size")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--database-url", help="e.g. a MySQL container; defaults to a temporary SQLite file")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        apply_env(bench_env(tmp, args.database_url))
+        from sqlalchemy import insert
+        from app.database import create_db_and_tables, engine
+        from app.importances import migrate, pack_importances, unpack_importances
+        from app.models import AccountType, UserDB, VitalsRecord
+
+        create_db_and_tables()
+        rng = random.Random(7)
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(insert(UserDB.__table__), [
+                {"username": f"imp_{i}", "email": f"imp_{i}@example.com",
+                 "account_type": AccountType.PREGNANT, "hashed_password": "x",
+                 "is_active": True, "created_at": now, "updated_at": now}
+                for i in range(args.users)
+            ])
+            conn.execute(insert(VitalsRecord.__table__), [
+                {"user_id": rng.randint(1, args.users), "age": 28, "systolic_bp": rng.randint(100, 160),
+                 "diastolic_bp": rng.randint(60, 100), "bs": 6.1, "body_temp": 37.0,
+                 "body_temp_unit": "celsius", "heart_rate": 80, "ml_risk_label": "low risk",
+                 "ml_probability": rng.random(),
+                 "ml_feature_importances": json.dumps(random_importances(rng)),
+                 "created_at": now - timedelta(minutes=i)}
+                for i in range(args.rows)
+            ])
+        user_ids = list(range(1, args.users + 1))
+
+        sample = random_importances(rng)
+        legacy = json.dumps(sample)
+        schema_id, blob = pack_importances(sample)
+        codec = {
+            "json_encode_us": timeit.timeit(lambda: json.dumps(sample), number=20000) / 20000 * 1e6,
+            "packed_encode_us": timeit.timeit(lambda: pack_importances(sample), number=20000) / 20000 * 1e6,
+            "json_decode_us": timeit.timeit(lambda: json.loads(legacy), number=20000) / 20000 * 1e6,
+            "packed_decode_us": timeit.timeit(lambda: unpack_importances(schema_id, blob), number=20000) / 20000 * 1e6,
+            "lossless_for_float32": unpack_importances(schema_id, blob) == sample,
+        }
+
+        before = {**column_bytes(engine), "history_page": time_history_page(engine, user_ids, args.limit, args.samples)}
+        start = time.perf_counter()
+        migrated = migrate()
+        migrate_seconds = time.perf_counter() - start
+        after = {**column_bytes(engine), "history_page": time_history_page(engine, user_ids, args.limit, args.samples)}
+
+    emit({
+        "benchmark": "importances", "rows": args.rows, "page_size": args.limit,
+        "codec": codec, "migrated_rows": migrated, "migrate_seconds": migrate_seconds,
+        "json": before, "packed": after,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Risk-model scoring in the API process vs. through the inference server.
+
+    python -m benchmarks.inference --requests 5000 --concurrency 32 --output inference.json
+
+Runs ``--requests`` single-row predictions from ``--concurrency`` asyncio
+tasks, the way ``submit_vitals`` scores, in three setups:
+
+- ``in_process``: ``risk_model.predict`` on the event loop
+- ``server``: ``inference_client.predict`` against ``python -m app.inference_server``
+  with one worker
+- ``server_pool``: the same with ``--server-workers`` worker processes
+
+Reports predictions/s, per-prediction p50/p95/p99, and event-loop lag:
+how late a 1 ms ticker task woke up while the predictions ran. Lag is
+what every other request on that worker waits through. ``in_process``
+latencies do not include that wait, since each call blocks the loop
+until it returns.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import BACKEND_DIR, apply_env, bench_env, emit, summarize, workdir
+
+FEATURES = {
+    "Age": 28, "SystolicBP": 130, "DiastolicBP": 85,
+    "BS": 6.8, "BodyTemp": 37.1, "HeartRate": 82,
+}
+
+
+async def drive(predict, requests: int, concurrency: int) -> dict:
+    latencies, lags = [], []
+    counter = iter(range(requests))
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    async def worker():
+        for _ in counter:
+            start = time.perf_counter()
+            await predict(FEATURES)
+            latencies.append(time.perf_counter() - start)
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+    lag = summarize(lags)
+    return {
+        **summarize(latencies, elapsed=elapsed),
+        "predictions_per_second": requests / elapsed,
+        "loop_lag_p99_ms": lag["p99_ms"],
+        "loop_lag_max_ms": lag["max_ms"],
+    }
+
+
+def run_server(socket_path: str, workers: int, env: dict) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.inference_server", "--socket", socket_path, "--workers", str(workers)],
+        cwd=BACKEND_DIR, env=env,
+    )
+    deadline = time.time() + 60
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.time() > deadline:
+            proc.kill()
+            raise RuntimeError("Inference server did not start")
+        time.sleep(0.05)
+    return proc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--server-workers", type=int, default=2)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        env = bench_env(tmp, INFERENCE_CONNECTIONS=args.concurrency)
+        apply_env(env)
+        from app.inference_server import InferenceClient
+        from app.ml_model import initialize_model, risk_model
+
+        if not initialize_model():
+            raise RuntimeError("Could not load the risk model")
+
+        async def in_process(features):
+            return risk_model.predict(features)
+
+        report = {"in_process": asyncio.run(drive(in_process, args.requests, args.concurrency))}
+        for name, workers in (("server", 1), ("server_pool", args.server_workers)):
+            socket_path = os.path.join(tmp, f"{name}.sock")
+            proc = run_server(socket_path, workers, env)
+            try:
+                async def remote():
+                    client = InferenceClient(socket_path)
+                    try:
+                        return await drive(client.predict, args.requests, args.concurrency)
+                    finally:
+                        await client.close()
+
+                report[name] = {**asyncio.run(remote()), "server_workers": workers}
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+    emit({"benchmark": "inference", "requests": args.requests, "concurrency": args.concurrency, **report},
+         args.output)
+
+
+if __name__ == "__main__":
+    main()
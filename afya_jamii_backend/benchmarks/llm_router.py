@@ -0,0 +1,116 @@
+"""Tail latency of LLM calls through ``app.llm_router`` with in-process stub backends.
+
+    python -m benchmarks.llm_router --calls 400 --output router.json
+
+Runs fully offline. Each stub backend sleeps for a lognormal latency and
+with probability ``--slow-rate`` stalls for ``--slow-factor`` times longer,
+like a congested upstream. Scenarios:
+
+- ``single``: one backend (it is never hedged against itself)
+- ``two_backends``: a primary and a faster secondary, hedged
+- ``primary_down``: the primary always fails; calls fail over
+- ``all_down``: every backend fails; the rules engine answers
+
+Reports p50/p95/p99 per scenario, the extra upstream requests hedging cost,
+and which backend answered.
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+
+from benchmarks.common import apply_env, bench_env, emit, summarize, workdir
+
+
+class StubBackend:
+    def __init__(self, name: str, median: float, slow_rate: float, slow_factor: float,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.name = name
+        self.median = median
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, prompt_data, prompt, max_tokens):
+        from app.llm_router import LLMReply
+
+        with self._lock:
+            self.calls += 1
+            latency = self.median * self._rng.lognormvariate(0, 0.25)
+            if self._rng.random() < self.slow_rate:
+                latency *= self.slow_factor
+            fail = self._rng.random() < self.error_rate
+        time.sleep(latency)
+        if fail:
+            raise RuntimeError(f"{self.name} stub failure")
+        return LLMReply(f"advice from {self.name}", 100, 20, self.name)
+
+
+def run_scenario(router, backends, calls: int, concurrency: int) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+
+    prompt_data = {"context": "Model Prediction: mid risk", "history": "", "question": "what should I eat?"}
+
+    def one(_):
+        start = time.perf_counter()
+        reply = router.generate(prompt_data, "prompt", 256)
+        return time.perf_counter() - start, reply.backend
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(calls)))
+    upstream = sum(b.calls for b in backends)
+    return {
+        **summarize([seconds for seconds, _ in results]),
+        "answered_by": dict(Counter(backend for _, backend in results)),
+        "upstream_requests_per_call": upstream / calls,
+        "backends": router.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--median-ms", type=float, default=100.0, help="primary backend median latency")
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--hedge-min-ms", type=float, default=50.0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        apply_env(bench_env(
+            tmp, LLM_HEDGE_MIN_SECONDS=args.hedge_min_ms / 1000, LLM_TIMEOUT_SECONDS=30,
+            LLM_ROUTER_COOLDOWN_SECONDS=600,
+        ))
+        from app.config import settings
+        from app.llm_router import LLMRouter
+
+        median = args.median_ms / 1000
+
+        def stub(name, factor=1.0, error_rate=0.0, seed=1):
+            return StubBackend(name, median * factor, args.slow_rate, args.slow_factor, error_rate, seed)
+
+        def scenario(backends, hedge_max):
+            settings.LLM_HEDGE_MAX = hedge_max
+            return run_scenario(LLMRouter(backends), backends, args.calls, args.concurrency)
+
+        report = {}
+        report["single"] = scenario([stub("primary")], 0)
+        report["two_backends"] = scenario([stub("primary"), stub("secondary", 0.7, seed=2)], 1)
+        report["primary_down"] = scenario([stub("primary", error_rate=1.0), stub("secondary", 0.7, seed=2)], 1)
+        report["all_down"] = scenario([stub("primary", error_rate=1.0), stub("secondary", error_rate=1.0, seed=2)], 1)
+
+    emit({
+        "benchmark": "llm_router", "calls": args.calls, "concurrency": args.concurrency,
+        "median_ms": args.median_ms, "slow_rate": args.slow_rate, "slow_factor": args.slow_factor,
+        "hedge_min_ms": args.hedge_min_ms, **report,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
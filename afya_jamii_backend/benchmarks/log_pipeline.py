@@ -0,0 +1,101 @@
+"""Caller-side cost of one access-log record, synchronous vs. through ``app.log_pipeline``.
+
+    python -m benchmarks.log_pipeline --records 50000 --output logging.json
+
+Logs the record ``log_requests`` writes per request (message plus method,
+path, status, duration and client fields) ``--records`` times, to a real file:
+
+- ``sync_text``: StreamHandler with the old text format, on the caller thread
+- ``sync_json``: StreamHandler with the JSON formatter, on the caller thread
+- ``queued_json``: NonBlockingQueueHandler, formatted and written by the listener
+- ``queued_json_sampled``: the same with ``--sample-rate`` of INFO records kept
+
+Per-call latencies are what the event loop pays. ``drain_ms`` is how long
+the writer thread needed after the last call. The ``burst`` run uses a
+small queue to show records being dropped (and counted) instead of
+blocking the caller.
+"""
+import argparse
+import logging
+import os
+import queue
+import time
+
+from benchmarks.common import apply_env, bench_env, emit, summarize, workdir
+
+EXTRA = {"method": "POST", "path": "/api/v1/chat/advice", "status": 200, "duration_ms": 412.5, "client": "10.0.0.7"}
+
+
+def run(handler: logging.Handler, records: int, listener=None) -> dict:
+    logger = logging.getLogger(f"bench.{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    latencies = []
+    for _ in range(records):
+        start = time.perf_counter()
+        logger.info("request", extra=EXTRA)
+        latencies.append(time.perf_counter() - start)
+    drain_start = time.perf_counter()
+    if listener is not None:
+        listener.stop()
+    handler.flush()
+    drain_ms = (time.perf_counter() - drain_start) * 1000
+    logger.removeHandler(handler)
+    summary = summarize(latencies)
+    return {
+        "count": summary["count"],
+        "mean_us": summary["mean_ms"] * 1000,
+        "p50_us": summary["p50_ms"] * 1000,
+        "p99_us": summary["p99_ms"] * 1000,
+        "max_us": summary["max_ms"] * 1000,
+        "drain_ms": drain_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--burst-queue", type=int, default=1000)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        apply_env(bench_env(tmp, LOG_FORMAT="json"))
+        from app.log_pipeline import TEXT_FORMAT, DrainingQueueListener, NonBlockingQueueHandler, _formatter
+        from app.metrics import LOG_RECORDS
+
+        def file_handler(name: str, formatter: logging.Formatter) -> logging.Handler:
+            handler = logging.StreamHandler(open(os.path.join(tmp, name), "w"))
+            handler.setFormatter(formatter)
+            return handler
+
+        def queued(name: str, sample_rate: float, size: int):
+            log_queue = queue.Queue(maxsize=size)
+            listener = DrainingQueueListener(log_queue, file_handler(name, _formatter()))
+            listener.start()
+            return NonBlockingQueueHandler(log_queue, sample_rate), listener
+
+        def dropped() -> float:
+            return LOG_RECORDS.labels("dropped")._value.get()
+
+        report = {
+            "sync_text": run(file_handler("text.log", logging.Formatter(TEXT_FORMAT)), args.records),
+            "sync_json": run(file_handler("json.log", _formatter()), args.records),
+        }
+        handler, listener = queued("queued.log", 1.0, 10000)
+        report["queued_json"] = run(handler, args.records, listener)
+        handler, listener = queued("sampled.log", args.sample_rate, 10000)
+        report["queued_json_sampled"] = run(handler, args.records, listener)
+
+        before = dropped()
+        handler, listener = queued("burst.log", 1.0, args.burst_queue)
+        report["burst"] = {**run(handler, args.records, listener), "dropped": dropped() - before}
+
+    emit({"benchmark": "log_pipeline", "records": args.records, "sample_rate": args.sample_rate, **report},
+         args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Microbenchmarks for hot functions on the request path.
+
+    python -m benchmarks.micro --iterations 2000 --output micro.json
+
+Runs in-process against a temporary SQLite database; no network needed.
+"""
+import argparse
+import asyncio
+import time
+import timeit
+
+from benchmarks.common import apply_env, bench_env, emit, workdir
+
+FEATURES = {
+    "Age": 28, "SystolicBP": 130, "DiastolicBP": 85,
+    "BS": 6.8, "BodyTemp": 37.1, "HeartRate": 82,
+}
+
+
+def time_call(fn, iterations: int, repeat: int = 5) -> dict:
+    """Best-of-``repeat`` mean per call in microseconds."""
+    runs = timeit.repeat(fn, number=iterations, repeat=repeat)
+    return {
+        "iterations": iterations,
+        "best_us": min(runs) / iterations * 1e6,
+        "median_us": sorted(runs)[len(runs) // 2] / iterations * 1e6,
+    }
+
+
+def time_async_call(make_coro, iterations: int, repeat: int = 5) -> dict:
+    async def run_once():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await make_coro()
+        return time.perf_counter() - start
+
+    runs = [asyncio.run(run_once()) for _ in range(repeat)]
+    return {
+        "iterations": iterations,
+        "best_us": min(runs) / iterations * 1e6,
+        "median_us": sorted(runs)[len(runs) // 2] / iterations * 1e6,
+    }
+
+
+def bench_predict(iterations: int) -> dict:
+    from app.ml_model import initialize_model, risk_model
+    if not initialize_model():
+        raise RuntimeError("Could not load the risk model")
+    return time_call(lambda: risk_model.predict(FEATURES), iterations)
+
+
+def bench_safe_json(iterations: int) -> dict:
+    import numpy as np
+    from app.main import safe_json
+    payload = {name: np.float32(i / 10) for i, name in enumerate(FEATURES)}
+    return time_call(lambda: safe_json(payload), iterations)
+
+
+def bench_get_current_user(iterations: int) -> dict:
+    from fastapi.security import HTTPAuthorizationCredentials
+    from sqlmodel import Session
+    from app.auth import create_access_token, get_current_user
+    from app.database import create_db_and_tables, engine
+    from app.models import AccountType, UserDB
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        session.add(UserDB(
+            username="micro_user", email="micro@example.com",
+            account_type=AccountType.PREGNANT, hashed_password="x",
+        ))
+        session.commit()
+
+    credentials = HTTPAuthorizationCredentials(
+        scheme="Bearer", credentials=create_access_token({"sub": "micro_user"})
+    )
+    with Session(engine) as session:
+        return time_async_call(
+            lambda: get_current_user(credentials=credentials, session=session), iterations
+        )
+
+
+def _asgi_get(app, path: str):
+    """One GET through the whole ASGI app, as a server would call it, without a socket."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"127.0.0.1")], "client": ("127.0.0.1", 40000), "server": ("127.0.0.1", 8000),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    return app(scope, receive, send)
+
+
+def bench_probe(path: str):
+    def run(iterations: int) -> dict:
+        from app.main import app
+        return time_async_call(lambda: _asgi_get(app, path), iterations)
+    return run
+
+
+BENCHMARKS = {
+    "risk_model_predict": bench_predict,
+    "safe_json": bench_safe_json,
+    "get_current_user": bench_get_current_user,
+    # Whole endpoint, all middleware included; "/" shows what a request pays for the full stack
+    "livez_endpoint": bench_probe("/livez"),
+    "readyz_endpoint": bench_probe("/readyz"),
+    "root_endpoint": bench_probe("/"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--only", choices=sorted(BENCHMARKS), action="append")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        apply_env(bench_env(tmp))
+        results = {
+            name: BENCHMARKS[name](args.iterations) for name in (args.only or BENCHMARKS)
+        }
+    emit({"benchmark": "micro", "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Chat prompt history: last-N turns vs. recent turns plus BM25 retrieval, at growing history sizes.
+
+    python -m benchmarks.retrieval --sizes 20,200,2000,20000 --output retrieval.json
+
+For a user with each number of past turns (generated from a set of maternal
+health topics), measures:
+
+- ``last_n``: the latest LLM_HISTORY_TURNS turns, what prompts carried before
+- ``build_ms``: first ``prompt_history`` call, which builds the user's index
+- ``search_us``: BM25 scoring in the in-memory index alone
+- ``prompt_history``: the whole call as the chat endpoint makes it, including
+  the catch-up query and reading back the k hits
+- ``catch_up_ms``: ``prompt_history`` right after one new turn was stored
+
+plus the history characters each builder puts in the prompt. Runs against a
+temporary SQLite file.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import apply_env, bench_env, emit, summarize, workdir
+
+TOPICS = [
+    ("What foods help with anemia and low iron?", "Eat beans, sukuma wiki, liver and take iron supplements."),
+    ("My feet are swollen in the evening", "Rest with your feet raised; sudden swelling needs a clinic visit."),
+    ("Is it safe to walk every day while pregnant?", "Gentle walking is good unless your clinician advised rest."),
+    ("My blood pressure reading was 150/100", "That is high. Please visit a health facility today."),
+    ("Which fruits are good for blood sugar?", "Choose guavas, oranges and pawpaw in small portions."),
+    ("I have a headache and blurred vision", "These can be danger signs; seek care immediately."),
+    ("How much water should I drink?", "About eight glasses a day, more in hot weather."),
+    ("The baby is moving less than yesterday", "Count kicks for two hours; fewer than ten needs a check."),
+    ("Can I keep breastfeeding while sick with flu?", "Yes, keep breastfeeding and wash your hands often."),
+    ("My sleep is poor at night", "Sleep on your left side and avoid tea late in the day."),
+]
+QUESTIONS = [
+    "Is my blood pressure still too high?",
+    "what should I eat for iron",
+    "swelling in my legs again",
+    "baby kicks are fewer today",
+    "can I drink more water for headaches",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="20,200,2000,20000")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    with workdir() as tmp:
+        apply_env(bench_env(tmp))
+        from sqlalchemy import insert
+        from sqlmodel import Session
+        from app.config import settings
+        from app.database import create_db_and_tables, engine
+        from app.models import AccountType, ConversationHistory, UserDB
+        from app.retrieval import conversation_index, prompt_history, recent_turns
+        from app.write_behind import write_behind
+
+        create_db_and_tables()
+        rng = random.Random(7)
+        turns = settings.LLM_HISTORY_TURNS
+        report = {}
+        for size in sizes:
+            with Session(engine) as session:
+                user = UserDB(username=f"rt_{size}", email=f"rt_{size}@example.com",
+                              account_type=AccountType.PREGNANT, hashed_password="x")
+                session.add(user)
+                session.commit()
+                user_id = user.id
+            start_at = datetime.utcnow() - timedelta(days=size)
+            rows = []
+            for i in range(size):
+                question, answer = rng.choice(TOPICS)
+                rows.append({
+                    "user_id": user_id, "user_message": f"{question} ({i})", "ai_response": answer,
+                    "created_at": start_at + timedelta(hours=i), "change_seq": i + 1,
+                })
+            with engine.begin() as conn:
+                conn.execute(insert(ConversationHistory.__table__), rows)
+
+            with Session(engine) as session:
+                last_n_latencies = []
+                for _ in range(args.queries):
+                    start = time.perf_counter()
+                    old = "\n".join(f"User: {q}\nAI: {a}" for q, a in recent_turns(session, user_id, turns))
+                    last_n_latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                new = prompt_history(session, user_id, QUESTIONS[0], turns)
+                build_ms = (time.perf_counter() - start) * 1000
+
+                index = conversation_index._user_index(user_id)
+                search_latencies = []
+                for i in range(args.queries):
+                    start = time.perf_counter()
+                    index.search(QUESTIONS[i % len(QUESTIONS)], settings.RETRIEVAL_TOP_K + 2)
+                    search_latencies.append(time.perf_counter() - start)
+
+                call_latencies = []
+                for i in range(args.queries):
+                    start = time.perf_counter()
+                    prompt_history(session, user_id, QUESTIONS[i % len(QUESTIONS)], turns)
+                    call_latencies.append(time.perf_counter() - start)
+
+                write_behind.save_sync(ConversationHistory(
+                    user_id=user_id, user_message="Is iron safe with my malaria tablets?",
+                    ai_response="Ask your clinician; some combinations need spacing.",
+                ))
+                start = time.perf_counter()
+                prompt_history(session, user_id, "iron tablets", turns)
+                catch_up_ms = (time.perf_counter() - start) * 1000
+
+            search = summarize(search_latencies)
+            report[str(size)] = {
+                "last_n": summarize(last_n_latencies),
+                "last_n_history_chars": len(old),
+                "build_ms": build_ms,
+                "search_us": {"p50": search["p50_ms"] * 1000, "p99": search["p99_ms"] * 1000},
+                "prompt_history": summarize(call_latencies),
+                "prompt_history_chars": len(new),
+                "catch_up_ms": catch_up_ms,
+                "indexed_docs": len(index.docs),
+                "indexed_terms": len(index.postings),
+            }
+
+    emit({"benchmark": "retrieval", "queries": args.queries, "top_k": settings.RETRIEVAL_TOP_K,
+          "recent_turns": settings.RETRIEVAL_RECENT_TURNS, "max_docs": settings.RETRIEVAL_MAX_DOCS,
+          "sizes": report}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Startup, steady state and shutdown of the production launcher (``python -m app.serve``).
+
+    python -m benchmarks.serve --workers 2 --duration 20 --output serve.json
+
+Starts ``app.serve`` against the stub Groq server and reports:
+
+- ``startup``: seconds until ``/livez`` and ``/readyz`` first answer 200,
+  and the memory of the master and its workers at that point. PSS splits
+  pages the workers share with the preloaded master between them, so it
+  shows what preloading saves; RSS counts shared pages in every process.
+- ``steady_state``: chat requests (``--concurrency`` users) for
+  ``--duration`` seconds: throughput, p50/p95/p99, memory afterwards.
+- ``shutdown``: ``--in-flight`` chat requests are started and the master
+  gets SIGTERM. Reports how those requests ended, the ``/readyz`` statuses
+  seen during SERVER_DRAIN_SECONDS, and the seconds until the server exited.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.common import BACKEND_DIR, bench_env, emit, free_port, summarize, uvicorn_server, workdir
+
+
+def _memory_mb(pid: int) -> dict:
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    fields[name.lower()] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return fields
+
+
+def _children(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory(master: int) -> dict:
+    workers = [_memory_mb(pid) for pid in _children(master)]
+    master_memory = _memory_mb(master)
+    return {
+        "workers": len(workers),
+        "master_rss_mb": master_memory.get("rss", 0.0),
+        "worker_rss_mb": [round(w.get("rss", 0.0), 1) for w in workers],
+        "total_rss_mb": master_memory.get("rss", 0.0) + sum(w.get("rss", 0.0) for w in workers),
+        "total_pss_mb": master_memory.get("pss", 0.0) + sum(w.get("pss", 0.0) for w in workers),
+    }
+
+
+async def login(client: httpx.AsyncClient, name: str) -> dict:
+    await client.post("/api/v1/auth/signup", json={
+        "username": name, "email": f"{name}@example.com", "account_type": "pregnant", "password": "password123",
+    })
+    response = await client.post("/api/v1/auth/login", json={"username": name, "password": "password123"})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def steady_state(base_url: str, concurrency: int, duration: float) -> dict:
+    latencies, errors = [], 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        users = await asyncio.gather(*(login(client, f"serve_{i}") for i in range(concurrency)))
+        deadline = time.perf_counter() + duration
+
+        async def user(headers):
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/api/v1/chat/advice", json={"question": "What should I eat?"},
+                                                 headers=headers)
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(headers) for headers in users))
+        return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def shutdown(base_url: str, proc: subprocess.Popen, in_flight: int) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        headers = await login(client, "serve_drain")
+
+        async def chat():
+            try:
+                response = await client.post("/api/v1/chat/advice", json={"question": "Is walking safe?"},
+                                             headers=headers)
+                return str(response.status_code)
+            except httpx.HTTPError as e:
+                return type(e).__name__
+
+        requests = [asyncio.create_task(chat()) for _ in range(in_flight)]
+        await asyncio.sleep(0.2)
+        start = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+
+        readyz = Counter()
+        while proc.poll() is None:
+            try:
+                async with httpx.AsyncClient(base_url=base_url, timeout=1) as probe:
+                    readyz[str((await probe.get("/readyz")).status_code)] += 1
+            except httpx.HTTPError as e:
+                readyz[type(e).__name__] += 1
+            await asyncio.sleep(0.1)
+        exited_s = time.perf_counter() - start
+        outcomes = Counter(await asyncio.gather(*requests))
+    return {"in_flight": dict(outcomes), "readyz_during_shutdown": dict(readyz), "exit_s": exited_s,
+            "exit_code": proc.returncode}
+
+
+def wait_for_status(url: str, deadline: float):
+    with httpx.Client(timeout=1.0) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if client.get(url).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--drain-seconds", type=float, default=2.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=1500)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        stub_env = bench_env(tmp, STUB_LATENCY_MS=args.llm_latency_ms)
+        with uvicorn_server("benchmarks.stub_groq:app", stub_env, ready_path="/docs") as groq_url:
+            env = bench_env(
+                tmp, GROQ_API_BASE=groq_url, LLM_UPSTREAM_RPM=0, LLM_UPSTREAM_TPM=0,
+                SERVER_DRAIN_SECONDS=args.drain_seconds, HEALTH_PROBE_INTERVAL_SECONDS=0.5,
+            )
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "app.serve", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers)],
+                cwd=BACKEND_DIR, env=env, stderr=subprocess.DEVNULL,
+            )
+            try:
+                deadline = start + 120
+                wait_for_status(base_url + "/livez", deadline)
+                startup = {"first_livez_s": time.perf_counter() - start}
+                wait_for_status(base_url + "/readyz", deadline)
+                startup["first_readyz_s"] = time.perf_counter() - start
+                startup["memory"] = memory(proc.pid)
+
+                steady = asyncio.run(steady_state(base_url, args.concurrency, args.duration))
+                steady["memory"] = memory(proc.pid)
+                stopped = asyncio.run(shutdown(base_url, proc, args.in_flight))
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+
+    emit({
+        "benchmark": "serve",
+        "config": {"workers": args.workers, "concurrency": args.concurrency, "duration_s": args.duration,
+                   "drain_seconds": args.drain_seconds, "llm_latency_ms": args.llm_latency_ms,
+                   "cpus": os.cpu_count()},
+        "startup": startup,
+        "steady_state": steady,
+        "shutdown": stopped,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
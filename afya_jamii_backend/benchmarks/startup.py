@@ -0,0 +1,129 @@
+"""Cold-start benchmark: import time of app.main and time-to-first-request.
+
+    python -m benchmarks.startup --repeat 5 --output startup.json
+
+``import_app_main`` is measured in a fresh interpreter per run.
+``time_to_first_request`` is the time from spawning uvicorn until ``GET /``
+succeeds, which includes the lifespan handler (DB tables, model load, LLM
+client). ``preloaded_worker_first_request`` forks a worker from a process
+that already ran ``app.main.preload()``, as gunicorn does with preload_app.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.common import BACKEND_DIR, bench_env, emit, free_port, workdir
+
+HEAVY_MODULES = ["xgboost", "sklearn", "scipy", "pandas", "joblib", "langchain", "langchain_groq"]
+
+IMPORT_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_s": elapsed,
+                  "heavy_loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+PRELOAD_PROBE = """
+import os, sys, time, httpx, uvicorn
+import app.main
+app.main.preload()
+port = int(sys.argv[1])
+start = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    uvicorn.run(app.main.app, host="127.0.0.1", port=port, log_level="warning")
+    os._exit(0)
+with httpx.Client(timeout=1.0) as client:
+    while True:
+        try:
+            if client.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                break
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+print(time.perf_counter() - start)
+os.kill(pid, 15)
+os.waitpid(pid, 0)
+"""
+
+
+def measure_import(env) -> dict:
+    out = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND_DIR, env=env, text=True,
+        stderr=subprocess.DEVNULL,
+    )
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure_first_request(env, timeout: float = 120.0) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stderr=subprocess.DEVNULL,
+    )
+    # One client for all polls: httpx.get() builds an SSL context per call,
+    # which would steal CPU from the server being measured.
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - start < timeout:
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                        return time.perf_counter() - start
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.02)
+        raise RuntimeError("API did not become ready")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=15)
+
+
+def measure_preloaded_worker(env) -> float:
+    out = subprocess.check_output(
+        [sys.executable, "-c", PRELOAD_PROBE, str(free_port())], cwd=BACKEND_DIR, env=env,
+        text=True, stderr=subprocess.DEVNULL, timeout=120,
+    )
+    return float(out.strip().splitlines()[-1])
+
+
+def describe(values) -> dict:
+    return {
+        "runs": len(values),
+        "min_s": min(values),
+        "median_s": statistics.median(values),
+        "max_s": max(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        env = bench_env(tmp)
+        imports = [measure_import(env) for _ in range(args.repeat)]
+        first_requests = [measure_first_request(env) for _ in range(args.repeat)]
+        preloaded = [measure_preloaded_worker(env) for _ in range(args.repeat)]
+
+    emit({
+        "benchmark": "startup",
+        "import_app_main": describe([r["import_s"] for r in imports]),
+        "heavy_modules_after_import": imports[-1]["heavy_loaded"],
+        "time_to_first_request": describe(first_requests),
+        "preloaded_worker_first_request": describe(preloaded),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
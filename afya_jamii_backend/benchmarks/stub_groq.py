@@ -0,0 +1,87 @@
+"""Stand-in for the Groq OpenAI-compatible chat completions API.
+
+Run with ``uvicorn benchmarks.stub_groq:app --port 9100`` and point the API at it
+with ``GROQ_API_BASE=http://127.0.0.1:9100``. Behaviour is controlled by env vars:
+
+- STUB_LATENCY_MS: time before the first byte (default 200)
+- STUB_TOKEN_DELAY_MS: delay between streamed chunks (default 5)
+- STUB_COMPLETION_TOKENS: number of words in the answer (default 120)
+- STUB_ERROR_RATE: fraction of requests answered with HTTP 500 (default 0)
+"""
+import asyncio
+import json
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY = float(os.environ.get("STUB_LATENCY_MS", "200")) / 1000
+TOKEN_DELAY = float(os.environ.get("STUB_TOKEN_DELAY_MS", "5")) / 1000
+COMPLETION_TOKENS = int(os.environ.get("STUB_COMPLETION_TOKENS", "120"))
+ERROR_RATE = float(os.environ.get("STUB_ERROR_RATE", "0"))
+
+WORDS = (
+    "Eat plenty of sukuma wiki, beans, omena and fruits; drink clean water, "
+    "rest well and attend your antenatal clinic visits regularly."
+).split()
+
+app = FastAPI()
+
+
+def _answer() -> list[str]:
+    return [WORDS[i % len(WORDS)] + " " for i in range(COMPLETION_TOKENS)]
+
+
+def _usage(body: dict) -> dict:
+    prompt_tokens = sum(len(m.get("content", "").split()) for m in body.get("messages", []))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": COMPLETION_TOKENS,
+        "total_tokens": prompt_tokens + COMPLETION_TOKENS,
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY)
+    if random.random() < ERROR_RATE:
+        return JSONResponse(status_code=500, content={"error": {"message": "stub failure"}})
+
+    created = int(time.time())
+    model = body.get("model", "stub")
+    tokens = _answer()
+
+    if not body.get("stream"):
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(body),
+        }
+
+    async def stream():
+        for i, token in enumerate(tokens):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            if i == len(tokens) - 1:
+                chunk["choices"][0]["finish_reason"] = "stop"
+                chunk["x_groq"] = {"usage": _usage(body)}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(TOKEN_DELAY)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
@@ -0,0 +1,80 @@
+"""Per-insert cost of the incremental risk trend vs. rescanning history.
+
+    python -m benchmarks.trends --sizes 10 100 1000 10000 --output trends.json
+
+For each history size the user is first given that many VitalsRecord rows,
+then ``--samples`` more submissions are timed through ``update_trend`` and
+through a full ``rebuild_trend`` rescan.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import apply_env, bench_env, emit, summarize, workdir
+
+
+def make_record(user_id: int, at: datetime):
+    from app.models import VitalsRecord
+    return VitalsRecord(
+        user_id=user_id, age=28, systolic_bp=random.randint(100, 160),
+        diastolic_bp=random.randint(60, 100), bs=round(random.uniform(4, 9), 1),
+        body_temp=37.0, body_temp_unit="celsius", heart_rate=80,
+        ml_risk_label="low risk", ml_probability=random.random(), created_at=at,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        apply_env(bench_env(tmp))
+        from sqlmodel import Session
+        from app.database import create_db_and_tables, engine
+        from app.models import AccountType, UserDB
+        from app.trends import rebuild_trend, update_trend
+
+        create_db_and_tables()
+        results = {}
+        for size in sorted(args.sizes):
+            with Session(engine) as session:
+                user = UserDB(
+                    username=f"trend_{size}", email=f"trend_{size}@example.com",
+                    account_type=AccountType.PREGNANT, hashed_password="x",
+                )
+                session.add(user)
+                session.commit()
+                at = datetime.utcnow() - timedelta(days=size)
+                session.add_all(make_record(user.id, at + timedelta(days=i)) for i in range(size))
+                session.commit()
+                update_trend(session, make_record(user.id, datetime.utcnow()))
+                session.commit()
+
+                incremental, rescan = [], []
+                for _ in range(args.samples):
+                    record = make_record(user.id, datetime.utcnow())
+                    session.add(record)
+                    start = time.perf_counter()
+                    update_trend(session, record)
+                    session.commit()
+                    incremental.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    rebuild_trend(session, user.id)
+                    rescan.append(time.perf_counter() - start)
+                    session.expunge_all()
+
+            results[str(size)] = {
+                "incremental_update": summarize(incremental),
+                "full_rescan": summarize(rescan),
+            }
+
+    emit({"benchmark": "trends", "samples": args.samples, "history_sizes": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
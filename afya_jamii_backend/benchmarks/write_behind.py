@@ -0,0 +1,104 @@
+"""Conversation-turn inserts per second with and without the write-behind buffer.
+
+    python -m benchmarks.write_behind --rows 5000 --concurrency 50 --output write_behind.json
+
+Inserts ``--rows`` ConversationHistory rows from ``--concurrency`` asyncio
+tasks through ``write_behind.save``, the way the chat endpoints do, in each
+``WRITE_BEHIND_MODE``. Reports inserts/s, per-save latency and rows per
+commit. Use ``--database-url`` against a MySQL container to include real
+fsync costs. The default temporary SQLite file runs with synchronous=FULL.
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from benchmarks.common import apply_env, bench_env, emit, summarize, workdir
+
+
+async def run_mode(mode: str, rows: int, concurrency: int, user_ids) -> dict:
+    from sqlmodel import Session
+    from app.database import engine
+    from app.models import ConversationHistory
+    from app.write_behind import WriteBehindBuffer
+
+    class CountingBuffer(WriteBehindBuffer):
+        batches = 0
+
+        def _flush(self, batch):
+            CountingBuffer.batches += 1
+            super()._flush(batch)
+
+    buffer = CountingBuffer(mode)
+    latencies = []
+    counter = iter(range(rows))
+
+    async def producer():
+        for i in counter:
+            obj = ConversationHistory(
+                user_id=user_ids[i % len(user_ids)], user_message=f"question {i}",
+                ai_response="Eat plenty of sukuma wiki, beans and omena. " * 8,
+            )
+            start = time.perf_counter()
+            with Session(engine) as session:
+                await buffer.save(session, obj)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(concurrency)))
+    buffer.close()  # async mode: count the drain too
+    elapsed = time.perf_counter() - start
+    commits = CountingBuffer.batches if buffer.enabled else rows
+    return {
+        **summarize(latencies, elapsed=elapsed),
+        "inserts_per_second": rows / elapsed,
+        "commits": commits,
+        "rows_per_commit": rows / commits if commits else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--flush-ms", type=float, default=5.0)
+    parser.add_argument("--batch-rows", type=int, default=200)
+    parser.add_argument("--database-url", help="e.g. a MySQL container; defaults to a temporary SQLite file")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with workdir() as tmp:
+        apply_env(bench_env(
+            tmp, args.database_url, WRITE_BEHIND_FLUSH_MS=args.flush_ms, WRITE_BEHIND_BATCH_ROWS=args.batch_rows,
+        ))
+        from sqlalchemy import func, insert, select
+        from app.database import create_db_and_tables, engine
+        from app.models import AccountType, ConversationHistory, UserDB
+
+        create_db_and_tables()
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(insert(UserDB.__table__), [
+                {"username": f"wb_{i}", "email": f"wb_{i}@example.com",
+                 "account_type": AccountType.PREGNANT, "hashed_password": "x",
+                 "is_active": True, "created_at": now, "updated_at": now}
+                for i in range(args.users)
+            ])
+            user_ids = list(conn.execute(select(UserDB.__table__.c.id)).scalars())
+
+        report = {}
+        for mode in ("off", "group", "async"):
+            report[mode] = asyncio.run(run_mode(mode, args.rows, args.concurrency, user_ids))
+        with engine.connect() as conn:
+            stored = conn.execute(select(func.count()).select_from(ConversationHistory.__table__)).scalar()
+
+    emit({
+        "benchmark": "write_behind", "rows": args.rows, "concurrency": args.concurrency,
+        "flush_ms": args.flush_ms, "batch_rows": args.batch_rows,
+        "rows_stored": stored, **report,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
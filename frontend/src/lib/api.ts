@@ -70,11 +70,26 @@ export interface ConversationResponse {
   created_at: string;
 }
 
+export interface SyncResponse {
+  vitals: VitalsResponse[];
+  conversations: ConversationResponse[];
+  next_token: string;
+  has_more: boolean;
+}
+
 export interface ChatResponse {
   advice: string;
   timestamp: string;
 }
 
+export interface ChatSocketHandlers {
+  onReady?: () => void;
+  onToken: (id: string | null, text: string) => void;
+  onDone: (id: string | null, advice: string) => void;
+  onError?: (id: string | null, detail: string) => void;
+  onClose?: (code: number) => void;
+}
+
 export const api = {
   async login(credentials: LoginCredentials): Promise<{ token: string }> {
     const response = await fetch(`${API_BASE_URL}/api/v1/auth/login`, {
@@ -112,12 +127,14 @@ export const api = {
     return response.json();
   },
 
-  async submitVitals(payload: VitalsSubmitPayload, token: string): Promise<VitalsSubmitResponse> {
+  async submitVitals(payload: VitalsSubmitPayload, token: string, idempotencyKey?: string): Promise<VitalsSubmitResponse> {
     const response = await fetch(`${API_BASE_URL}/api/v1/vitals/submit`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
         'Authorization': `Bearer ${token}`,
+        // Reuse the same key when retrying so the server runs the request once
+        ...(idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}),
       },
       body: JSON.stringify(payload),
     });
@@ -130,12 +147,14 @@ export const api = {
     return response.json();
   },
 
-  async chatAdvice(question: string, token: string): Promise<ChatResponse> {
+  async chatAdvice(question: string, token: string, idempotencyKey?: string): Promise<ChatResponse> {
     const response = await fetch(`${API_BASE_URL}/api/v1/chat/advice`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
         'Authorization': `Bearer ${token}`,
+        // Reuse the same key when retrying so the server runs the request once
+        ...(idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}),
       },
       body: JSON.stringify({ question }),
     });
@@ -179,4 +198,42 @@ export const api = {
 
     return response.json();
   },
+
+  // Changes since a stored sync token; resolves to null when nothing changed (HTTP 304)
+  async sync(token: string, since?: string, etag?: string): Promise<{ changes: SyncResponse; etag: string | null } | null> {
+    const query = since ? `?since=${encodeURIComponent(since)}` : '';
+    const response = await fetch(`${API_BASE_URL}/api/v1/sync${query}`, {
+      method: 'GET',
+      headers: {
+        'Authorization': `Bearer ${token}`,
+        ...(etag ? { 'If-None-Match': etag } : {}),
+      },
+    });
+
+    if (response.status === 304) {
+      return null;
+    }
+
+    if (!response.ok) {
+      const error = await response.json().catch(() => ({ detail: 'Failed to sync' }));
+      throw new Error(error.detail || 'Failed to sync');
+    }
+
+    return { changes: await response.json(), etag: response.headers.get('ETag') };
+  },
+
+  // Opens a chat socket; send { type: 'question', question, id } once onReady has fired
+  chatSocket(token: string, handlers: ChatSocketHandlers): WebSocket {
+    const socket = new WebSocket(`${API_BASE_URL.replace(/^http/, 'ws')}/api/v1/chat/ws`);
+    socket.onopen = () => socket.send(JSON.stringify({ type: 'auth', token }));
+    socket.onmessage = (event) => {
+      const frame = JSON.parse(event.data);
+      if (frame.type === 'ready') handlers.onReady?.();
+      else if (frame.type === 'token') handlers.onToken(frame.id, frame.text);
+      else if (frame.type === 'done') handlers.onDone(frame.id, frame.advice);
+      else if (frame.type === 'error') handlers.onError?.(frame.id, frame.detail);
+    };
+    socket.onclose = (event) => handlers.onClose?.(event.code);
+    return socket;
+  },
 };